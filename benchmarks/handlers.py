@@ -0,0 +1,283 @@
+"""Сквозной бенчмарк обработчиков бота.
+
+Апдейты проходят через настоящее Application с обработчиками из psymatch2
+(ConversationHandler, button_handler, SQLitePersistence) к базе, заполненной
+синтетическими пользователями и лайками. Сеть заменена FakeRequest: он отвечает
+на вызовы Bot API без обращения к Telegram и считает их; он же используется в тестах
+(tests/fakes.py).
+
+Сценарии выполняются по очереди, внутри сценария --vusers виртуальных
+пользователей работают одновременно. Для каждого сценария выводятся
+p50/p95/p99 задержки апдейта, пропускная способность, число SQL-запросов,
+вызовов базы (обращений к пулу потоков AsyncDatabase) и вызовов Bot API на апдейт.
+
+    python benchmarks/handlers.py --users 20000 --vusers 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+
+from telegram import Update
+
+from fakes import FakeRequest, UpdateFactory
+from psymatch_db import backfill_matches, parse_price
+
+APPROACHES = ['Когнитивно-поведенческая терапия (КПТ)', 'Психоанализ', 'Гештальт', 'Психодрама', 'Телесная терапия']
+TOPICS = ['тревога', 'депрессия', 'одиночество', 'утрата', 'отношения с семьей', 'поиск себя']
+PRICES = ['1000-2000 руб./сессия', '2000-3000 руб./сессия', '3000-5000 руб./сессия']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000, help='пользователей в базе (половина - психологи)')
+    parser.add_argument('--likes', type=int, default=20, help='лайков от каждого клиента')
+    parser.add_argument('--mutual', type=float, default=0.3, help='доля лайков, на которые ответили взаимностью')
+    parser.add_argument('--vusers', type=int, default=20, help='одновременных виртуальных пользователей')
+    parser.add_argument('--steps', type=int, default=20, help='действий виртуального пользователя в сценарии')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+# ========== ПОДСЧЕТ ОБРАЩЕНИЙ К БАЗЕ ==========
+
+def make_counting_database(psymatch2):
+    """Database, считающий SQL-запросы через trace callback, и AsyncDatabase, считающий вызовы"""
+
+    class CountingDatabase(psymatch2.Database):
+        def __init__(self, *args, **kwargs):
+            self.statements = 0
+            self._statements_lock = threading.Lock()
+            super().__init__(*args, **kwargs)
+
+        def _trace(self, statement: str):
+            with self._statements_lock:
+                self.statements += 1
+
+        def _connect(self):
+            conn = super()._connect()
+            conn.set_trace_callback(self._trace)
+            return conn
+
+    class CountingAsyncDatabase(psymatch2.AsyncDatabase):
+        calls = 0
+
+        async def _run(self, func, *args, **kwargs):
+            self.calls += 1
+            return await super()._run(func, *args, **kwargs)
+
+    return CountingDatabase, CountingAsyncDatabase
+
+# ========== ДАННЫЕ ==========
+
+def seed(database, users: int, likes_per_client: int, mutual: float, rng: random.Random):
+    """Заполняет базу пользователями, анкетами и лайками одним батчем"""
+    psychologists = list(range(2, users + 1, 2))
+    clients = list(range(1, users + 1, 2))
+
+    with database.get_connection() as conn:
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, role) VALUES (?, ?, ?, ?)',
+            ((user_id, f'bench{user_id}', 'Bench', 'psychologist' if user_id % 2 == 0 else 'client')
+             for user_id in range(1, users + 1))
+        )
+        conn.executemany(
+            '''INSERT INTO psychologist_profiles
+               (user_id, name, gender, age, education, about_me, approach, work_requests, price, price_min, price_max,
+                photo_file_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            # У половины психологов есть фото
+            ((user_id, f'Психолог {user_id}', rng.choice(['male', 'female']), rng.randint(25, 65),
+              'МГУ, факультет психологии', 'Работаю бережно и последовательно. ' * 5,
+              rng.choice(APPROACHES), ', '.join(rng.sample(TOPICS, 3)), price, *parse_price(price),
+              f'photo{user_id}' if user_id % 4 == 0 else None)
+             for user_id, price in ((user_id, rng.choice(PRICES)) for user_id in psychologists))
+        )
+        conn.executemany(
+            'INSERT INTO client_profiles (user_id, name, gender, age, request) VALUES (?, ?, ?, ?, ?)',
+            ((user_id, f'Клиент {user_id}', rng.choice(['male', 'female']), rng.randint(18, 60),
+              ', '.join(rng.sample(TOPICS, 2)))
+             for user_id in clients)
+        )
+
+        like_rows = []
+        for client_id in clients:
+            for psychologist_id in rng.sample(psychologists, min(likes_per_client, len(psychologists))):
+                like_rows.append((client_id, psychologist_id))
+                if rng.random() < mutual:
+                    like_rows.append((psychologist_id, client_id))
+        conn.executemany('INSERT OR IGNORE INTO likes (from_user_id, to_user_id) VALUES (?, ?)', like_rows)
+        conn.execute('''
+            UPDATE likes SET is_mutual = 1
+            WHERE EXISTS (SELECT 1 FROM likes r WHERE r.from_user_id = likes.to_user_id AND r.to_user_id = likes.from_user_id)
+        ''')
+        backfill_matches(conn.cursor())
+        conn.commit()
+    return clients, psychologists, len(like_rows)
+
+# ========== СЦЕНАРИИ ==========
+
+PSYCHOLOGIST_ANSWERS = [
+    '/start', '👨‍⚕️ Психолог', 'Анна Петрова', '👩 Женский', '34',
+    'МГУ, факультет психологии; курсы КПТ', 'Работаю бережно и последовательно.',
+    'Когнитивно-поведенческая терапия (КПТ)', 'тревога, депрессия, поиск себя',
+    '2000-3000 руб./сессия', '/skip',
+]
+
+class Bench:
+    def __init__(self, app, request: FakeRequest, database):
+        self.app = app
+        self.request = request
+        self.database = database
+        self.updates = UpdateFactory(app.bot)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def send(self, scenario: str, update: Update):
+        start = time.perf_counter()
+        await self.app.process_update(update)
+        self.latencies[scenario].append(time.perf_counter() - start)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        """Нажатие кнопки под последним сообщением с клавиатурой"""
+        return self.updates.callback(user_id, data, photo=user_id in self.request.photo_keyboards)
+
+    def button(self, user_id: int, prefix: str) -> Optional[str]:
+        """callback_data кнопки из последней клавиатуры, показанной пользователю"""
+        return next((data for data in self.request.keyboards.get(user_id, ()) if data.startswith(prefix)), None)
+
+    async def browse(self, user_id: int, steps: int):
+        await self.send('browse', self.callback(user_id, 'view_profiles'))
+        for _ in range(steps - 1):
+            await self.send('browse', self.callback(user_id, self.button(user_id, 'skip_') or 'view_profiles'))
+
+    async def like(self, user_id: int, steps: int):
+        for _ in range(steps):
+            data = self.button(user_id, 'like_')
+            if data is None:
+                await self.app.process_update(self.callback(user_id, 'view_profiles'))
+                continue
+            await self.send('like', self.callback(user_id, data))
+            # Следующий апдейт отменяет отложенный показ анкеты, как у настоящего пользователя
+            await self.app.process_update(self.callback(user_id, self.button(user_id, 'skip_') or 'view_profiles'))
+
+    async def matches(self, user_id: int, steps: int):
+        for _ in range(steps):
+            await self.send('matches', self.callback(user_id, 'view_matches'))
+
+    async def search(self, user_id: int, steps: int):
+        """Поиск по теме и листание результатов"""
+        for step in range(steps):
+            data = self.button(user_id, 'search_page_') if step % 2 else None
+            if data is None:
+                await self.send('search', self.updates.message(user_id, f'/search {random.choice(TOPICS)}'))
+            else:
+                await self.send('search', self.callback(user_id, data))
+
+    async def stats(self, user_id: int, steps: int):
+        for step in range(steps):
+            await self.send('stats', self.callback(user_id, 'my_stats' if step % 2 else 'global_stats'))
+
+    async def registration(self, user_id: int, steps: int):
+        for answer in PSYCHOLOGIST_ANSWERS:
+            await self.send('registration', self.updates.message(user_id, answer))
+
+    async def run(self, scenario: str, user_ids: List[int], steps: int) -> Dict:
+        statements, calls, api_calls = self.database.sync.statements, self.database.calls, sum(self.request.calls.values())
+        start = time.perf_counter()
+        await asyncio.gather(*(getattr(self, scenario)(user_id, steps) for user_id in user_ids))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(self.latencies[scenario])
+        count = len(latencies)
+        return {
+            'scenario': scenario,
+            'updates': count,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'throughput': count / elapsed if elapsed else 0.0,
+            'sql': (self.database.sync.statements - statements) / max(count, 1),
+            'db_calls': (self.database.calls - calls) / max(count, 1),
+            'api_calls': (sum(self.request.calls.values()) - api_calls) / max(count, 1),
+        }
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль по ближайшему рангу, в миллисекундах"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[rank] * 1000
+
+# ========== ЗАПУСК ==========
+
+async def run(args):
+    rng = random.Random(args.seed)
+    tmp = tempfile.TemporaryDirectory()
+    # База бота открывается при импорте модуля, поэтому путь задается заранее
+    os.environ['DB_PATH'] = os.path.join(tmp.name, 'bench.db')
+    import psymatch2
+    from telegram.ext import Application
+
+    CountingDatabase, CountingAsyncDatabase = make_counting_database(psymatch2)
+    psymatch2.db.close()
+    database = psymatch2.db = CountingAsyncDatabase(CountingDatabase(os.environ['DB_PATH']))
+
+    start = time.perf_counter()
+    clients, psychologists, like_count = seed(database.sync, args.users, args.likes, args.mutual, rng)
+    print(f"База: {args.users} пользователей, {like_count} лайков, заполнено за {time.perf_counter() - start:.1f} с")
+
+    request = FakeRequest(args.api_latency / 1000)
+    app = (
+        Application.builder()
+        .token('1:benchmark')
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .persistence(psymatch2.SQLitePersistence(database))
+        .build()
+    )
+    psymatch2.add_handlers(app)
+    await app.initialize()
+    await psymatch2.on_startup(app)
+
+    bench = Bench(app, request, database)
+    vclients = rng.sample(clients, min(args.vusers, len(clients)))
+    new_users = list(range(args.users + 1, args.users + 1 + args.vusers))
+    results = [
+        await bench.run('registration', new_users, 1),
+        await bench.run('browse', vclients, args.steps),
+        await bench.run('like', vclients, args.steps),
+        await bench.run('matches', vclients, args.steps),
+        await bench.run('search', vclients, args.steps),
+        await bench.run('stats', vclients, args.steps),
+    ]
+
+    await psymatch2.next_profile_actions.shutdown()
+    await psymatch2.notifications.stop()
+    await app.shutdown()
+    database.close()
+    tmp.cleanup()
+
+    print(f"Виртуальных пользователей: {args.vusers}, задержка Bot API: {args.api_latency:g} мс")
+    print(f"{'сценарий':<14}{'апдейтов':>9}{'p50, мс':>9}{'p95, мс':>9}{'p99, мс':>9}"
+          f"{'апд./с':>9}{'SQL':>7}{'БД':>7}{'API':>7}")
+    for result in results:
+        print(f"{result['scenario']:<14}{result['updates']:>9}{result['p50']:>9.2f}{result['p95']:>9.2f}"
+              f"{result['p99']:>9.2f}{result['throughput']:>9.0f}{result['sql']:>7.1f}"
+              f"{result['db_calls']:>7.1f}{result['api_calls']:>7.1f}")
+    print("SQL, БД и API - в среднем на один апдейт сценария; у like сюда входит и показ следующей анкеты")
+
+def main():
+    args = parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Бенчмарк записи состояний диалогов SQLitePersistence.
+
+Имитирует проход Application.update_persistence для N активных диалогов:
+у каждого пользователя меняется состояние анкеты и user_data, затем все
+изменения записываются одним батчем. Запуск:
+
+    python benchmarks/persistence_flush.py --users 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000, help='число активных диалогов')
+    parser.add_argument('--rounds', type=int, default=5, help='число проходов записи')
+    return parser.parse_args()
+
+async def run(users: int, rounds: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        # База бота открывается при импорте модуля, поэтому путь задается заранее
+        os.environ['DB_PATH'] = os.path.join(tmp, 'bot.db')
+        from psymatch2 import Database, AsyncDatabase, SQLitePersistence, PSY_EDUCATION, db
+        db.close()
+
+        database = AsyncDatabase(Database(os.path.join(tmp, 'bench.db')))
+        persistence = SQLitePersistence(database, write_delay=3600)
+
+        timings = []
+        for round_number in range(rounds):
+            start = time.perf_counter()
+            for user_id in range(1, users + 1):
+                await persistence.update_conversation('registration', (user_id, user_id), PSY_EDUCATION)
+                await persistence.update_user_data(user_id, {
+                    'psy_name': f'Психолог {user_id}',
+                    'psy_gender': '👩 Женский',
+                    'psy_age': str(25 + user_id % 40),
+                    'round': round_number
+                })
+            staged = time.perf_counter()
+            await persistence.flush()
+            done = time.perf_counter()
+            timings.append((staged - start, done - staged))
+
+        # Ленивая загрузка одного пользователя после "перезапуска"
+        restarted = SQLitePersistence(database)
+        start = time.perf_counter()
+        conversations = await database.load_user_conversations(users // 2)
+        user_data = {}
+        await restarted.refresh_user_data(users // 2, user_data)
+        load_time = time.perf_counter() - start
+
+        database.close()
+
+    print(f"Активных диалогов: {users}, проходов: {rounds}")
+    for round_number, (stage_time, flush_time) in enumerate(timings, start=1):
+        print(f"  проход {round_number}: накопление {stage_time * 1000:.1f} мс, запись {flush_time * 1000:.1f} мс "
+              f"({flush_time / users * 1e6:.2f} мкс на диалог)")
+    print(f"Загрузка после перезапуска: {len(conversations)} диалогов и user_data одного пользователя "
+          f"за {load_time * 1000:.1f} мс")
+
+def main():
+    args = parse_args()
+    asyncio.run(run(args.users, args.rounds))
+
+if __name__ == '__main__':
+    main()
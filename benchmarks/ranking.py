@@ -0,0 +1,107 @@
+"""Бенчмарк ранжирования анкет CandidateIndex.
+
+Строит индекс по синтетическим анкетам психологов и клиентов с известными
+темами и сравнивает ранжирование с прежним порядком "первые по user_id":
+- точность@10 - доля показанных психологов, работающих хотя бы с одной темой клиента;
+- охват - сколько разных психологов попадает в первые 10 у всех клиентов;
+- максимальная доля клиентов, у которых в первых 10 один и тот же психолог;
+- стоимость: построение индекса, ранжирование одного клиента, обновление анкеты.
+
+    python benchmarks/ranking.py --psychologists 100000 --clients 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOPICS = [
+    'тревога', 'депрессия', 'одиночество', 'утрата', 'отношения с семьей', 'романтические отношения',
+    'поиск себя', 'постановка целей', 'неуверенность в себе', 'пищевое поведение', 'панические атаки',
+    'выгорание', 'самооценка', 'развод', 'созависимость', 'психосоматика', 'зависимости', 'травма',
+    'стресс', 'конфликты на работе', 'детско-родительские отношения', 'кризис', 'прокрастинация', 'бессонница',
+]
+APPROACHES = ['Когнитивно-поведенческая терапия (КПТ)', 'Психоанализ', 'Гештальт', 'Психодрама', 'Телесная терапия']
+CLIENT_PHRASES = ['Меня беспокоит {}', 'Хочу разобраться: {}', 'Сейчас у меня {}', '{}, не знаю что делать']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--psychologists', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--top', type=int, default=10, help='сколько первых анкет оценивать')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    tmp = tempfile.TemporaryDirectory()
+    # База бота открывается при импорте модуля, поэтому путь задается заранее
+    os.environ['DB_PATH'] = os.path.join(tmp.name, 'bench.db')
+    from psymatch2 import CandidateIndex, db
+    db.close()
+
+    psychologist_topics = {}
+    profiles = []
+    for user_id in range(2, 2 * args.psychologists + 1, 2):
+        topics = rng.sample(range(len(TOPICS)), 4)
+        psychologist_topics[user_id] = set(topics)
+        profiles.append({
+            'user_id': user_id, 'role': 'psychologist', 'gender': None, 'age': rng.randint(25, 65),
+            'last_active': f'2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d} 12:00:00',
+            'text': ', '.join(TOPICS[topic] for topic in topics) + ' ' + rng.choice(APPROACHES),
+        })
+    client_topics = {}
+    for user_id in range(1, 2 * args.clients, 2):
+        topics = rng.sample(range(len(TOPICS)), rng.randint(1, 2))
+        client_topics[user_id] = set(topics)
+        profiles.append({
+            'user_id': user_id, 'role': 'client', 'gender': None, 'age': rng.randint(18, 60), 'last_active': None,
+            'text': rng.choice(CLIENT_PHRASES).format(' и '.join(TOPICS[topic] for topic in topics)),
+        })
+
+    index = CandidateIndex()
+    start = time.perf_counter()
+    index.load(profiles)
+    build_time = time.perf_counter() - start
+
+    baseline = sorted(psychologist_topics)[:args.top]
+    rank_times = []
+    ranked_hits = baseline_hits = 0
+    ranked_exposure: Counter = Counter()
+    for client_id, topics in client_topics.items():
+        start = time.perf_counter()
+        top = index.rank(client_id, 'client', limit=args.top)
+        rank_times.append(time.perf_counter() - start)
+        ranked_exposure.update(top)
+        ranked_hits += sum(1 for psychologist_id in top if psychologist_topics[psychologist_id] & topics)
+        baseline_hits += sum(1 for psychologist_id in baseline if psychologist_topics[psychologist_id] & topics)
+
+    updates = profiles[:1000]
+    start = time.perf_counter()
+    for profile in updates:
+        index.add(profile)
+    update_time = (time.perf_counter() - start) / len(updates)
+
+    shown = args.top * len(client_topics)
+    print(f"Психологов: {args.psychologists}, клиентов: {args.clients}, оцениваются первые {args.top} анкет")
+    print(f"{'':<24}{'точность':>10}{'охват':>10}{'макс. доля':>12}")
+    print(f"{'первые по user_id':<24}{baseline_hits / shown:>10.2f}{len(baseline):>10}{1.0:>12.2f}")
+    print(f"{'ранжирование':<24}{ranked_hits / shown:>10.2f}{len(ranked_exposure):>10}"
+          f"{max(ranked_exposure.values()) / len(client_topics):>12.2f}")
+    print(f"Построение индекса: {build_time * 1000:.0f} мс, обновление анкеты: {update_time * 1e6:.1f} мкс")
+    print(f"Ранжирование одного клиента: p50 {percentile(rank_times, 50) * 1000:.2f} мс, "
+          f"p95 {percentile(rank_times, 95) * 1000:.2f} мс, p99 {percentile(rank_times, 99) * 1000:.2f} мс")
+    tmp.cleanup()
+
+if __name__ == '__main__':
+    main()
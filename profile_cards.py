@@ -0,0 +1,241 @@
+"""Карточки анкет: шаблоны и кэш отрисованных карточек.
+
+Анкета одного психолога при просмотре показывается тысячам клиентов, поэтому
+шаблоны разбираются один раз при импорте, а отрисованная карточка - текст,
+entities и клавиатура - кэшируется по (user_id, версия анкеты). Версия растет
+при каждом сохранении анкеты, так что устаревшая карточка не будет показана,
+даже если ее запись не успели сбросить.
+
+В шаблоне поля задаются как {name}, жирный текст - между **...**. Значения
+полей подставляются как есть, без разбора разметки: оформление передается
+через entities.
+"""
+import string
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity
+from telegram.constants import MessageLimit
+
+from psymatch_db import gender_label
+
+NOT_SPECIFIED = 'Не указано'
+
+def telegram_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram - в кодовых единицах UTF-16"""
+    return len(text.encode('utf-16-le')) // 2
+
+# ========== ШАБЛОНЫ ==========
+
+class CardTemplate:
+    """Шаблон карточки, заранее разобранный на куски текста и поля"""
+
+    def __init__(self, source: str):
+        # (текст или имя поля, это поле, жирный)
+        self._parts: List[Tuple[str, bool, bool]] = []
+        for index, chunk in enumerate(source.strip().split('**')):
+            bold = index % 2 == 1
+            for literal, field, _, _ in string.Formatter().parse(chunk):
+                if literal:
+                    self._parts.append((literal, False, bold))
+                if field is not None:
+                    self._parts.append((field, True, bold))
+
+    def render(self, values: Dict) -> Tuple[str, Tuple[MessageEntity, ...]]:
+        """Текст карточки и entities жирных участков"""
+        pieces = []
+        entities = []
+        offset = 0
+        bold_start = None
+        for part, is_field, bold in self._parts:
+            if is_field:
+                value = values.get(part)
+                part = NOT_SPECIFIED if value is None or value == '' else str(value)
+            if bold and bold_start is None:
+                bold_start = offset
+            elif not bold and bold_start is not None:
+                entities.append(MessageEntity(MessageEntity.BOLD, bold_start, offset - bold_start))
+                bold_start = None
+            pieces.append(part)
+            offset += telegram_length(part)
+        if bold_start is not None:
+            entities.append(MessageEntity(MessageEntity.BOLD, bold_start, offset - bold_start))
+        return ''.join(pieces), tuple(entity for entity in entities if entity.length)
+
+PSYCHOLOGIST_CARD = CardTemplate('''
+**👨‍⚕️ Анкета психолога:**
+
+👤 {name}, {gender}, {age}
+🎓 Образование: {education}
+💫 О себе: {about_me}
+🧠 Подход: {approach}
+🎯 Работает с: {work_requests}
+💰 Стоимость: {price}
+''')
+
+CLIENT_CARD = CardTemplate('''
+**👤 Анкета клиента:**
+
+👤 {name}, {gender}, {age}
+🎯 Запрос: {request}
+''')
+
+OWN_PSYCHOLOGIST_CARD = CardTemplate('''
+**{title}**
+
+👤 Имя: {name}
+👫 Пол: {gender}
+🎂 Возраст: {age}
+🎓 Образование: {education}
+💫 О себе: {about_me}
+🧠 Подход: {approach}
+🎯 Работаю с запросами: {work_requests}
+💰 Стоимость: {price}
+''')
+
+OWN_CLIENT_CARD = CardTemplate('''
+**{title}**
+
+👤 Имя: {name}
+👫 Пол: {gender}
+🎂 Возраст: {age}
+🎯 Запрос: {request}
+''')
+
+MATCH_CARD = CardTemplate('''
+**💞 У вас взаимный лайк с {name}!**
+
+👤 Username: @{username}
+💌 Можете написать друг другу и начать общение!
+''')
+
+MATCH_CARD_NO_USERNAME = CardTemplate('''
+**💞 У вас взаимный лайк с {name}!**
+
+👤 Имя: {name}
+❌ К сожалению, у этого пользователя не указан username.
+Вы можете связаться через другие контакты, если они указаны в анкете.
+''')
+
+# ========== КАРТОЧКИ ==========
+
+class Card(NamedTuple):
+    text: str
+    entities: Tuple[MessageEntity, ...] = ()
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    photo_file_id: Optional[str] = None
+
+def profile_values(profile: Dict) -> Dict:
+    """Значения полей шаблонов по строке анкеты"""
+    values = dict(profile)
+    values['gender'] = gender_label(profile.get('gender'))
+    return values
+
+def candidate_keyboard(user_id: int) -> InlineKeyboardMarkup:
+    """Кнопки под анкетой при просмотре"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("❤️ Лайк", callback_data=f"like_{user_id}"),
+            InlineKeyboardButton("➡️ Дальше", callback_data=f"skip_{user_id}")
+        ],
+        [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")]
+    ])
+
+def split_caption(card: Card, limit: int = MessageLimit.CAPTION_LENGTH) -> Tuple[Card, Optional[Card]]:
+    """Подпись к фото и остаток карточки, если текст в подпись не помещается.
+
+    Текст делится по строкам, чтобы поля анкеты не разрывались посередине;
+    кнопки остаются у последнего сообщения.
+    """
+    text = card.text
+    if telegram_length(text) <= limit:
+        return card, None
+
+    cut = start = 0
+    for line in text.split('\n'):
+        end = start + len(line)
+        if telegram_length(text[:end]) > limit:
+            break
+        cut, start = end, end + 1
+    if not cut:
+        # Первая строка сама длиннее подписи
+        cut = limit
+        while telegram_length(text[:cut]) > limit:
+            cut -= 1
+    caption, rest = text[:cut].rstrip(), text[cut:].lstrip()
+    caption_length = telegram_length(caption)
+    rest_start = telegram_length(text[:len(text) - len(rest)])
+
+    caption_entities, rest_entities = [], []
+    for entity in card.entities:
+        if entity.offset < caption_length:
+            length = min(entity.length, caption_length - entity.offset)
+            caption_entities.append(MessageEntity(entity.type, entity.offset, length))
+        end = entity.offset + entity.length
+        if end > rest_start:
+            offset = max(entity.offset, rest_start)
+            rest_entities.append(MessageEntity(entity.type, offset - rest_start, end - offset))
+    return (
+        Card(caption, tuple(caption_entities), None, card.photo_file_id),
+        Card(rest, tuple(rest_entities), card.reply_markup) if rest else None
+    )
+
+class CardRenderer:
+    """Отрисовка карточек с LRU-кэшем по (user_id, версия анкеты)"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # user_id -> (версия анкеты, {вид карточки: карточка})
+        self._data: OrderedDict = OrderedDict()
+
+    def _cached(self, kind: Tuple, profile: Dict, build: Callable[[], Card]) -> Card:
+        user_id = profile['user_id']
+        version = profile.get('version') or 0
+        entry = self._data.get(user_id)
+        if entry is not None and entry[0] == version:
+            card = entry[1].get(kind)
+            if card is not None:
+                self.hits += 1
+                self._data.move_to_end(user_id)
+                return card
+        else:
+            entry = self._data[user_id] = (version, {})
+
+        self.misses += 1
+        card = entry[1][kind] = build()
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        return card
+
+    def candidate(self, profile: Dict, role: str) -> Card:
+        """Анкета при просмотре; role - роль владельца анкеты"""
+        def build():
+            template = PSYCHOLOGIST_CARD if role == 'psychologist' else CLIENT_CARD
+            text, entities = template.render(profile_values(profile))
+            return Card(text, entities, candidate_keyboard(profile['user_id']), profile.get('photo_file_id'))
+        return self._cached(('candidate', role), profile, build)
+
+    def own(self, profile: Dict, role: str, title: str) -> Card:
+        """Анкета, которую показывают ее владельцу"""
+        def build():
+            template = OWN_PSYCHOLOGIST_CARD if role == 'psychologist' else OWN_CLIENT_CARD
+            text, entities = template.render(dict(profile_values(profile), title=title))
+            return Card(text, entities, None, profile.get('photo_file_id'))
+        return self._cached(('own', role, title), profile, build)
+
+    def match(self, profile: Dict) -> Card:
+        """Уведомление о взаимном лайке с владельцем анкеты; profile содержит username"""
+        def build():
+            template = MATCH_CARD if profile.get('username') else MATCH_CARD_NO_USERNAME
+            text, entities = template.render(profile_values(profile))
+            return Card(text, entities)
+        return self._cached(('match',), profile, build)
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+
+    def clear(self):
+        self._data.clear()
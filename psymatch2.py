@@ -1,13 +1,26 @@
 import os
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
-from telegram.error import BadRequest
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, TypeHandler, BaseUpdateProcessor, BasePersistence, PersistenceInput
+from telegram.error import BadRequest, RetryAfter, Forbidden, NetworkError
+from telegram.request import HTTPXRequest
 import logging
-import sqlite3
+import json
+import threading
 import asyncio
+import time
+import functools
+import heapq
+import math
+import re
 import nest_asyncio
-from typing import Optional, List, Dict, Tuple
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple, Iterable, Callable, Awaitable
+from datetime import datetime, timezone
+from collections import deque, OrderedDict
+
+from psymatch_db import (Database, build_search_query, tokenize, GENDER_LABELS, MIN_AGE, MAX_AGE,
+                         parse_gender, gender_label, parse_age, parse_age_range, parse_price)
+from profile_cards import Card, CardRenderer, split_caption
 
 # Применяем исправление для Replit
 nest_asyncio.apply()
@@ -22,6 +35,62 @@ logger = logging.getLogger(__name__)
 # Токен бота из переменных окружения
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 
+# Способ получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', '3'))
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # публичный адрес за reverse proxy
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Кэш пользователей и анкет
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', '10000'))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '300'))  # секунды
+CARD_CACHE_SIZE = int(os.environ.get('CARD_CACHE_SIZE', '10000'))  # отрисованных карточек анкет
+
+# Рассылка уведомлений (лимиты Telegram: ~30 сообщений/с всего, ~1 сообщение/с в чат)
+NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', '8'))
+NOTIFY_QUEUE_SIZE = int(os.environ.get('NOTIFY_QUEUE_SIZE', '10000'))
+NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', '25'))
+NOTIFY_CHAT_RATE = float(os.environ.get('NOTIFY_CHAT_RATE', '1'))
+NOTIFY_CHAT_BURST = float(os.environ.get('NOTIFY_CHAT_BURST', '3'))
+NOTIFY_MAX_RETRIES = int(os.environ.get('NOTIFY_MAX_RETRIES', '3'))
+
+# Задержка перед показом следующей анкеты после лайка, секунды
+NEXT_PROFILE_DELAY = float(os.environ.get('NEXT_PROFILE_DELAY', '1'))
+
+# Параллельная обработка апдейтов разных пользователей (1 - последовательно)
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '32'))
+# Сколько принятых апдейтов может ждать или обрабатываться одновременно: при заполнении
+# polling перестает забирать апдейты, а вебхук придерживает ответ Telegram
+MAX_PENDING_UPDATES = int(os.environ.get('MAX_PENDING_UPDATES', '256'))
+
+# Сохранение состояний диалогов и user_data
+PERSISTENCE_UPDATE_INTERVAL = float(os.environ.get('PERSISTENCE_UPDATE_INTERVAL', '10'))  # секунды
+PERSISTENCE_WRITE_DELAY = float(os.environ.get('PERSISTENCE_WRITE_DELAY', '0.5'))  # секунды
+
+# Метрики: порт HTTP-эндпоинта /metrics (0 - метрики выключены) и порог медленных вызовов базы
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))  # 0 - не логировать
+
+# Полнотекстовый поиск психологов
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '5'))
+
+# Предзагрузка анкет для просмотра
+PREFETCH_SIZE = int(os.environ.get('PREFETCH_SIZE', '10'))
+PREFETCH_LOW_WATERMARK = int(os.environ.get('PREFETCH_LOW_WATERMARK', '3'))
+PREFETCH_MAX_USERS = int(os.environ.get('PREFETCH_MAX_USERS', '10000'))
+
+# Ранжирование анкет по совпадению запросов
+RANKING_ENABLED = os.environ.get('RANKING_ENABLED', '1') == '1'
+RANKING_DEPTH = int(os.environ.get('RANKING_DEPTH', '200'))  # сколько лучших кандидатов ранжировать
+RANKING_POOL = int(os.environ.get('RANKING_POOL', '2000'))  # сколько кандидатов оценивать
+RANKING_FRESHNESS_DAYS = float(os.environ.get('RANKING_FRESHNESS_DAYS', '14'))
+RANKING_FRESHNESS_WEIGHT = float(os.environ.get('RANKING_FRESHNESS_WEIGHT', '0.5'))
+
 # Проверка токена
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN не установлен! Добавьте его в Secrets Replit")
@@ -36,378 +105,1085 @@ CLIENT_NAME, CLIENT_GENDER, CLIENT_AGE, CLIENT_REQUEST = range(10, 14)
 EDIT_CHOICE = 20
 EDIT_PSY_NAME, EDIT_PSY_GENDER, EDIT_PSY_AGE, EDIT_PSY_EDUCATION, EDIT_PSY_ABOUT, EDIT_PSY_APPROACH, EDIT_PSY_REQUESTS, EDIT_PSY_PRICE, EDIT_PSY_PHOTO = range(21, 30)
 EDIT_CLIENT_NAME, EDIT_CLIENT_GENDER, EDIT_CLIENT_AGE, EDIT_CLIENT_REQUEST = range(30, 34)
-
-# ========== БАЗА ДАННЫХ SQLite ==========
-
-class Database:
-    def __init__(self, db_path: str = "psymatch.db"):
-        self.db_path = db_path
-        self.init_db()
+FILTER_CHOICE = 40
+FILTER_GENDER, FILTER_AGE, FILTER_PRICE, FILTER_APPROACH = range(41, 45)
+
+APPROACHES = [
+    'Когнитивно-поведенческая терапия (КПТ)',
+    'Психоанализ',
+    'Гештальт',
+    'Экзистенциально-гуманистическая терапия',
+    '3 волна КПТ (АСТ, ДБТ, CFT, MBCT, схема-терапия)',
+    'Психодрама',
+    'Телесная терапия',
+]
+
+# ========== МЕТРИКИ ==========
+
+class Metrics:
+    """Гистограммы задержек и счетчики в текстовом формате Prometheus.
     
-    def get_connection(self):
-        try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            return conn
-        except sqlite3.Error as e:
-            logger.error(f"Database connection error: {e}")
-            raise
+    Если метрики выключены, инструментирующие обертки не устанавливаются
+    вовсе, и горячий путь не платит за них ничего, кроме одной проверки.
+    """
     
-    def init_db(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                role TEXT NOT NULL,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица профилей психологов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS psychologist_profiles (
-                user_id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                gender TEXT,
-                age INTEGER,
-                education TEXT,
-                about_me TEXT,
-                approach TEXT,
-                work_requests TEXT,
-                price TEXT,
-                photo_file_id TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # Таблица профилей клиентов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS client_profiles (
-                user_id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                gender TEXT,
-                age INTEGER,
-                request TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # Таблица лайков
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS likes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id INTEGER NOT NULL,
-                to_user_id INTEGER NOT NULL,
-                liked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_mutual INTEGER DEFAULT 0,
-                UNIQUE(from_user_id, to_user_id),
-                FOREIGN KEY (from_user_id) REFERENCES users(user_id),
-                FOREIGN KEY (to_user_id) REFERENCES users(user_id)
-            )
-        ''')
-        
-        # Таблица просмотренных профилей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS profiles_viewed (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                viewed_user_id INTEGER NOT NULL,
-                viewed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, viewed_user_id),
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                FOREIGN KEY (viewed_user_id) REFERENCES users(user_id)
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    HELP = {
+        'psymatch_button_seconds': 'Время обработки нажатия inline-кнопки',
+        'psymatch_db_seconds': 'Время выполнения метода Database в потоке пула',
+        'psymatch_telegram_seconds': 'Время вызова Bot API',
+    }
+    
+    def __init__(self, enabled: bool = METRICS_PORT > 0, slow_query_ms: float = SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        # (метрика, метки) -> [счетчики корзин..., сумма, количество]
+        self._histograms: Dict[Tuple[str, Tuple], List[float]] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    def observe(self, metric: str, seconds: float, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0.0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+    
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        """Регистрирует значение, которое вычисляется при каждом чтении /metrics"""
+        self._gauges[name] = (help_text, func)
+    
+    def timed_db_call(self, call: Callable, method: str, args: Tuple) -> Callable:
+        """Оборачивает вызов Database: гистограмма и лог медленных вызовов"""
+        def timed():
+            start = time.perf_counter()
+            try:
+                return call()
+            finally:
+                elapsed = time.perf_counter() - start
+                self.observe('psymatch_db_seconds', elapsed, method=method)
+                if self.slow_query_ms and elapsed * 1000 >= self.slow_query_ms:
+                    logger.warning(f"Slow database call: {method}{str(args)[:200]} took {elapsed * 1000:.1f} ms")
+        return timed
+    
+    @staticmethod
+    def _labels(labels: Tuple, extra: str = '') -> str:
+        parts = [f'{name}="{value}"' for name, value in labels]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+    
+    def render(self) -> str:
+        with self._lock:
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        
+        lines = []
+        described = set()
+        for (metric, labels), values in histograms:
+            if metric not in described:
+                described.add(metric)
+                lines.append(f'# HELP {metric} {self.HELP.get(metric, metric)}')
+                lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, values):
+                cumulative += count
+                bucket_labels = self._labels(labels, f'le="{bound}"')
+                lines.append(f'{metric}_bucket{bucket_labels} {cumulative:.0f}')
+            bucket_labels = self._labels(labels, 'le="+Inf"')
+            lines.append(f'{metric}_bucket{bucket_labels} {values[-1]:.0f}')
+            lines.append(f'{metric}_sum{self._labels(labels)} {values[-2]:.6f}')
+            lines.append(f'{metric}_count{self._labels(labels)} {values[-1]:.0f}')
+        
+        for name, (help_text, func) in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logger.error(f"Error reading metric {name}: {e}")
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+    
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode() + body
             )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
     
-    def create_user(self, user_id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str], role: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    async def start_server(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        if not self.enabled:
+            return
+        self._server = await asyncio.start_server(self._handle_http, host, port)
+        logger.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+    
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый вызов Bot API"""
+    
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, role)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name, role))
-            conn.commit()
-            logger.info(f"User created: {user_id}, role: {role}")
-        except sqlite3.Error as e:
-            logger.error(f"Error creating user: {e}")
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = str(code)
+            return code, payload
         finally:
-            conn.close()
+            metrics.observe('psymatch_telegram_seconds', time.perf_counter() - start,
+                            method=url.rsplit('/', 1)[-1], status=status)
+
+def callback_label(data: Optional[str]) -> str:
+    """Тип нажатой кнопки без идентификаторов: like_42 -> like, matches_next_7 -> matches_next"""
+    if not data:
+        return 'none'
+    label = re.sub(r'(_\d+)+$', '', data)
+    return label if label in KNOWN_CALLBACKS else 'other'
+
+KNOWN_CALLBACKS = {
+    'view_profiles', 'my_stats', 'view_matches', 'view_inbox', 'tech_functions', 'back_to_main',
+    'edit_profile', 'restart_bot', 'global_stats', 'reset_viewed', 'like', 'skip',
+    'matches_next', 'matches_prev', 'inbox_next', 'inbox_prev', 'search_page', 'search_like',
+}
+
+def instrument_button(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Замеряет обработчик нажатий по типу кнопки; без метрик возвращает обработчик как есть"""
+    if not metrics.enabled:
+        return handler
     
-    def get_user(self, user_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            data = update.callback_query.data if update.callback_query else None
+            metrics.observe('psymatch_button_seconds', time.perf_counter() - start, callback=callback_label(data))
+    return wrapper
+
+metrics = Metrics()
+
+# ========== РАНЖИРОВАНИЕ АНКЕТ ==========
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+class CandidateIndex:
+    """Инвертированный индекс анкет по основам слов для ранжирования кандидатов.
     
-    def update_last_active(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users SET last_active = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-        ''', (user_id,))
-        conn.commit()
-        conn.close()
+    Для психологов индексируются "работаю с запросами" и подход, для клиентов - запрос.
+    Кандидат получает сумму IDF общих с пользователем слов, бонус за недавнюю
+    активность и, если заданы, за пол и возраст.
     
-    def save_psychologist_profile(self, user_id: int, name: str, gender: str, age: str, 
-                                education: str, about_me: str, approach: str, 
-                                work_requests: str, price: str, photo_file_id: Optional[str] = None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO psychologist_profiles 
-            (user_id, name, gender, age, education, about_me, approach, work_requests, price, photo_file_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, name, gender, age, education, about_me, approach, work_requests, price, photo_file_id))
-        conn.commit()
-        conn.close()
-        logger.info(f"Psychologist profile saved: {user_id}")
+    Оценивается не больше pool_size кандидатов: они набираются из списков по
+    словам пользователя, начиная с самых редких слов, а из длинного списка
+    берется окно, смещенное по user_id. Поэтому стоимость ранжирования не растет
+    с числом анкет, а разные пользователи с одинаковым запросом видят разных
+    психологов. Равные оценки тоже упорядочены по-разному для разных пользователей.
+    Индекс загружается при старте и обновляется при сохранении и удалении анкет.
+    """
     
-    def save_client_profile(self, user_id: int, name: str, gender: str, age: str, request: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO client_profiles 
-            (user_id, name, gender, age, request)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, name, gender, age, request))
-        conn.commit()
-        conn.close()
-        logger.info(f"Client profile saved: {user_id}")
+    def __init__(self, freshness_days: float = RANKING_FRESHNESS_DAYS,
+                 freshness_weight: float = RANKING_FRESHNESS_WEIGHT, pool_size: int = RANKING_POOL):
+        self.freshness_days = freshness_days
+        self.freshness_weight = freshness_weight
+        self.pool_size = pool_size
+        self.loaded = False
+        # роль -> основа слова -> id анкет; списки для окон строятся лениво
+        self._postings: Dict[str, Dict[str, set]] = {'psychologist': {}, 'client': {}}
+        self._posting_lists: Dict[Tuple[str, str], List[int]] = {}
+        self._counts: Dict[str, int] = {'psychologist': 0, 'client': 0}
+        # id -> (роль, основы, пол, возраст, цена для фильтра, время активности)
+        self._profiles: Dict[int, Tuple[str, set, Optional[str], Optional[int], Optional[int], Optional[float]]] = {}
     
-    def get_psychologist_profile(self, user_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.*, u.username, u.first_name, u.last_name 
-            FROM psychologist_profiles p
-            LEFT JOIN users u ON p.user_id = u.user_id
-            WHERE p.user_id = ?
-        ''', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+    def load(self, profiles: Iterable[Dict]):
+        for profile in profiles:
+            self.add(profile)
+        self.loaded = True
+        logger.info(f"Ranking index loaded: {len(self._profiles)} profiles")
     
-    def get_client_profile(self, user_id: int) -> Optional[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT c.*, u.username, u.first_name, u.last_name 
-            FROM client_profiles c
-            LEFT JOIN users u ON c.user_id = u.user_id
-            WHERE c.user_id = ?
-        ''', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+    def add(self, profile: Dict):
+        """Добавляет или заменяет анкету (поля как в Database.get_ranking_profiles)"""
+        user_id = profile['user_id']
+        self.remove(user_id)
+        role = profile['role']
+        if role not in self._postings:
+            return
+        tokens = tokenize(profile.get('text'))
+        self._profiles[user_id] = (
+            role, tokens, profile.get('gender'), parse_age(profile.get('age')), profile.get('price'),
+            parse_timestamp(profile.get('last_active'))
+        )
+        self._counts[role] += 1
+        postings = self._postings[role]
+        for token in tokens:
+            postings.setdefault(token, set()).add(user_id)
+            self._posting_lists.pop((role, token), None)
     
-    def get_all_psychologists(self) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.*, u.username, u.first_name, u.last_name 
-            FROM psychologist_profiles p
-            JOIN users u ON p.user_id = u.user_id
-            WHERE u.role = 'psychologist'
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    def remove(self, user_id: int):
+        entry = self._profiles.pop(user_id, None)
+        if entry is None:
+            return
+        role, tokens = entry[0], entry[1]
+        self._counts[role] -= 1
+        postings = self._postings[role]
+        for token in tokens:
+            self._posting_lists.pop((role, token), None)
+            ids = postings.get(token)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del postings[token]
     
-    def get_all_clients(self) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT c.*, u.username, u.first_name, u.last_name 
-            FROM client_profiles c
-            JOIN users u ON c.user_id = u.user_id
-            WHERE u.role = 'client'
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    def _matches(self, candidate_id: int, preferences: Dict) -> bool:
+        """Подходит ли анкета под фильтры (так же, как Database._filter_clause)"""
+        _, _, gender, age, price, _ = self._profiles[candidate_id]
+        if preferences.get('gender') and gender != preferences['gender']:
+            return False
+        if preferences.get('age_min') is not None and (age is None or age < preferences['age_min']):
+            return False
+        if preferences.get('age_max') is not None and (age is None or age > preferences['age_max']):
+            return False
+        if preferences.get('price_max') is not None and (price is None or price > preferences['price_max']):
+            return False
+        return True
     
-    def create_like(self, from_user_id: int, to_user_id: int) -> Tuple[bool, bool]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем, есть ли уже лайк
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (from_user_id, to_user_id))
-        if cursor.fetchone():
-            conn.close()
-            return False, False
-        
-        # Создаем лайк
-        cursor.execute('''
-            INSERT INTO likes (from_user_id, to_user_id)
-            VALUES (?, ?)
-        ''', (from_user_id, to_user_id))
-        
-        # Проверяем взаимность
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (to_user_id, from_user_id))
-        is_mutual = cursor.fetchone() is not None
+    def rank(self, user_id: int, role: str, limit: int = RANKING_DEPTH,
+             preferences: Optional[Dict] = None) -> List[int]:
+        """До limit лучших кандидатов для пользователя, у которых есть общие с ним слова.
         
-        if is_mutual:
-            cursor.execute('''
-                UPDATE likes SET is_mutual = 1 
-                WHERE (from_user_id = ? AND to_user_id = ?) 
-                OR (from_user_id = ? AND to_user_id = ?)
-            ''', (from_user_id, to_user_id, to_user_id, from_user_id))
-        
-        conn.commit()
-        conn.close()
-        logger.info(f"Like created: {from_user_id} -> {to_user_id}, mutual: {is_mutual}")
-        return True, is_mutual
+        preferences - фильтры клиента по полу, возрасту и цене: неподходящие анкеты
+        отбрасываются до подсчета оценок.
+        """
+        entry = self._profiles.get(user_id)
+        if entry is None:
+            return []
+        target_role = 'client' if role == 'psychologist' else 'psychologist'
+        postings = self._postings[target_role]
+        total = self._counts[target_role]
+        
+        tokens = sorted((token for token in entry[1] if token in postings), key=lambda token: len(postings[token]))
+        if not tokens:
+            return []
+        
+        # Набираем кандидатов, начиная с самых редких слов
+        pool = set()
+        for token in tokens:
+            room = self.pool_size - len(pool)
+            if room <= 0:
+                break
+            ids = postings[token]
+            if len(ids) <= room:
+                pool.update(ids)
+                continue
+            members = self._posting_lists.get((target_role, token))
+            if members is None:
+                members = self._posting_lists[(target_role, token)] = list(ids)
+            offset = (user_id * 2654435761) % len(members)
+            window = members[offset:offset + room]
+            pool.update(window)
+            pool.update(members[:room - len(window)])
+        pool.discard(user_id)
+        if preferences:
+            pool = {candidate_id for candidate_id in pool if self._matches(candidate_id, preferences)}
+        
+        idf = {token: math.log(1 + total / len(postings[token])) for token in tokens}
+        scores = {
+            candidate_id: sum(weight for token, weight in idf.items() if candidate_id in postings[token])
+            for candidate_id in pool
+        }
+        if not scores:
+            return []
+        
+        now = time.time()
+        for candidate_id in scores:
+            last_active = self._profiles[candidate_id][5]
+            if last_active is not None and self.freshness_weight:
+                days = max(0.0, now - last_active) / 86400
+                scores[candidate_id] += self.freshness_weight * math.exp(-days / self.freshness_days)
+        
+        # Детерминированный разброс равных оценок по пользователю
+        def key(item):
+            candidate_id, score = item
+            return score, hash((user_id, candidate_id))
+        return [candidate_id for candidate_id, _ in heapq.nlargest(limit, scores.items(), key=key)]
+
+# ========== АСИНХРОННЫЙ ДОСТУП К БАЗЕ ==========
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей"""
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: float = CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        # Счетчик инвалидаций: загрузка, во время которой была инвалидация, не кэшируется
+        self.version = 0
+
+    def get(self, key):
+        """Значение по ключу или TTLCache._MISSING"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return self._MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        self.version += 1
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self.version += 1
+        self._data.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Все запросы выполняются в отдельном пуле потоков, поэтому медленный
+    запрос не блокирует цикл событий и обработку апдейтов других пользователей.
+    Для просмотра анкет держит по каждому пользователю очередь из нескольких
+    заранее загруженных кандидатов и дозагружает ее в фоне. Пользователи и
+    анкеты читаются через кэш, который сбрасывается при их изменении, там же
+    сбрасываются отрисованные карточки анкет (cards).
+    """
+
+    def __init__(self, database: Database, max_workers: Optional[int] = None,
+                 prefetch_size: int = PREFETCH_SIZE, prefetch_low_watermark: int = PREFETCH_LOW_WATERMARK,
+                 prefetch_max_users: int = PREFETCH_MAX_USERS, cache: Optional[TTLCache] = None,
+                 ranking: Optional[CandidateIndex] = None, cards: Optional[CardRenderer] = None):
+        self.sync = database
+        self.cache = cache or TTLCache()
+        self.ranking = ranking or CandidateIndex()
+        self.cards = cards or CardRenderer(CARD_CACHE_SIZE)
+        # По одному потоку на соединение пула
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or database.pool_size, thread_name_prefix='db')
+        self.closed = False
+        
+        self.prefetch_size = prefetch_size
+        self.prefetch_low_watermark = prefetch_low_watermark
+        self.prefetch_max_users = prefetch_max_users
+        self._candidates: Dict[int, deque] = {}
+        self._last_served: Dict[int, int] = {}
+        self._refills: Dict[int, asyncio.Task] = {}
+        # Поколения очередей: результат дозагрузки, начатой до сброса, отбрасывается.
+        # Поколение пользователя хранится, только пока у него идет дозагрузка
+        self._candidates_epoch = 0
+        self._candidate_generations: Dict[int, int] = {}
+        # Ранжированный список кандидатов пользователя и позиция, до которой он проверен;
+        # LRU не больше prefetch_max_users пользователей
+        self._ranked: OrderedDict = OrderedDict()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        if metrics.enabled:
+            call = metrics.timed_db_call(call, func.__name__, args)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def _cached(self, key: Tuple, func, *args) -> Optional[Dict]:
+        value = self.cache.get(key)
+        if value is TTLCache._MISSING:
+            version = self.cache.version
+            value = await self._run(func, *args)
+            if version == self.cache.version:
+                self.cache.set(key, value)
+        # Копия, чтобы обработчики не меняли закэшированный словарь
+        return dict(value) if value is not None else None
+
+    def invalidate_user_cache(self, user_id: int):
+        """Сбрасывает закэшированные данные пользователя, его анкеты и ее карточки"""
+        self.cache.invalidate(('user', user_id), ('psychologist', user_id), ('client', user_id),
+                              ('preferences', user_id))
+        self.cards.invalidate(user_id)
+
+    async def create_user(self, user_id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str], role: str):
+        result = await self._run(self.sync.create_user, user_id, username, first_name, last_name, role)
+        self.invalidate_user_cache(user_id)
+        self.invalidate_profile_candidates(user_id)
+        return result
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        return await self._cached(('user', user_id), self.sync.get_user, user_id)
+
+    async def update_last_active(self, user_id: int):
+        # Только запись в буфер, без обращения к базе
+        self.sync.update_last_active(user_id)
+
+    async def save_psychologist_profile(self, user_id: int, *args, **kwargs):
+        result = await self._run(self.sync.save_psychologist_profile, user_id, *args, **kwargs)
+        self.invalidate_user_cache(user_id)
+        self.invalidate_profile_candidates(user_id)
+        await self._reindex_profile(user_id)
+        return result
+
+    async def save_client_profile(self, user_id: int, *args, **kwargs):
+        result = await self._run(self.sync.save_client_profile, user_id, *args, **kwargs)
+        self.invalidate_user_cache(user_id)
+        self.invalidate_profile_candidates(user_id)
+        await self._reindex_profile(user_id)
+        return result
+
+    async def get_psychologist_profile(self, user_id: int) -> Optional[Dict]:
+        return await self._cached(('psychologist', user_id), self.sync.get_psychologist_profile, user_id)
+
+    async def get_client_profile(self, user_id: int) -> Optional[Dict]:
+        return await self._cached(('client', user_id), self.sync.get_client_profile, user_id)
+
+    async def get_all_psychologists(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_psychologists)
+
+    async def get_all_clients(self) -> List[Dict]:
+        return await self._run(self.sync.get_all_clients)
+
+    async def get_next_candidates(self, user_id: int, role: str, limit: int = 1,
+                                  exclude_ids: Iterable[int] = (), preferences: Optional[Dict] = None) -> List[Dict]:
+        return await self._run(self.sync.get_next_candidates, user_id, role, limit, exclude_ids, preferences)
+
+    async def get_preferences(self, user_id: int) -> Optional[Dict]:
+        return await self._cached(('preferences', user_id), self.sync.get_preferences, user_id)
+
+    async def save_preferences(self, user_id: int, *args, **kwargs):
+        result = await self._run(self.sync.save_preferences, user_id, *args, **kwargs)
+        self.cache.invalidate(('preferences', user_id))
+        # Очередь и ранжированный список собраны по старым фильтрам
+        self.invalidate_candidates(user_id)
+        return result
+
+    async def create_like(self, from_user_id: int, to_user_id: int) -> Tuple[bool, bool]:
+        result = await self._run(self.sync.create_like, from_user_id, to_user_id)
+        self._discard_candidate(from_user_id, to_user_id)
+        return result
+
+    async def get_likes_for_user(self, user_id: int) -> List[Dict]:
+        return await self._run(self.sync.get_likes_for_user, user_id)
+
+    async def get_likes_page(self, user_id: int, *args, **kwargs) -> Tuple[List[Dict], bool]:
+        return await self._run(self.sync.get_likes_page, user_id, *args, **kwargs)
     
-    def get_likes_for_user(self, user_id: int) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT l.*, u.username, u.first_name, u.last_name, u.role
-            FROM likes l
-            JOIN users u ON l.from_user_id = u.user_id
-            WHERE l.to_user_id = ?
-            ORDER BY l.liked_date DESC
-        ''', (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    async def get_mutual_likes_page(self, user_id: int, *args, **kwargs) -> Tuple[List[Dict], bool]:
+        return await self._run(self.sync.get_mutual_likes_page, user_id, *args, **kwargs)
     
-    def get_mutual_likes(self, user_id: int) -> List[Dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.user_id, u.username, u.first_name, u.last_name, u.role,
-                   CASE 
-                     WHEN u.role = 'psychologist' THEN p.name
-                     WHEN u.role = 'client' THEN c.name
-                   END as name
-            FROM likes l1
-            JOIN likes l2 ON l1.from_user_id = l2.to_user_id AND l1.to_user_id = l2.from_user_id
-            JOIN users u ON l2.from_user_id = u.user_id
-            LEFT JOIN psychologist_profiles p ON u.user_id = p.user_id
-            LEFT JOIN client_profiles c ON u.user_id = c.user_id
-            WHERE l1.from_user_id = ? AND l1.is_mutual = 1
-        ''', (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+    async def get_mutual_likes(self, user_id: int) -> List[Dict]:
+        return await self._run(self.sync.get_mutual_likes, user_id)
+
+    async def search_psychologists(self, text: str, limit: int = SEARCH_PAGE_SIZE,
+                                   offset: int = 0) -> Tuple[List[Dict], bool]:
+        """Страница результатов поиска и признак того, что есть следующая.
+        
+        Ранжированный список id кэшируется по запросу на CACHE_TTL секунд, поэтому
+        листание и повторные популярные запросы не пересчитывают BM25 по всем
+        совпадениям. Новые анкеты появляются в результатах после истечения записи.
+        """
+        stems = sorted(tokenize(text))
+        if not stems:
+            return [], False
+        
+        key = ('search', tuple(stems))
+        user_ids = self.cache.get(key)
+        if user_ids is TTLCache._MISSING:
+            user_ids = tuple(await self._run(self.sync.search_psychologist_ids, stems))
+            self.cache.set(key, user_ids)
+        
+        page = await self._run(self.sync.get_search_results, build_search_query(stems),
+                               list(user_ids[offset:offset + limit]))
+        return page, len(user_ids) > offset + limit
+    
+    async def add_viewed_profile(self, user_id: int, viewed_user_id: int):
+        # Только запись в буфер, без обращения к базе
+        self.sync.add_viewed_profile(user_id, viewed_user_id)
+        self._discard_candidate(user_id, viewed_user_id)
+
+    async def get_viewed_profiles(self, user_id: int) -> List[int]:
+        return await self._run(self.sync.get_viewed_profiles, user_id)
+
+    async def get_user_likes(self, user_id: int) -> List[int]:
+        return await self._run(self.sync.get_user_likes, user_id)
+
+    async def count_matches(self, user_id: int) -> int:
+        return await self._run(self.sync.count_matches, user_id)
+    
+    async def check_mutual_like(self, user1_id: int, user2_id: int) -> bool:
+        return await self._run(self.sync.check_mutual_like, user1_id, user2_id)
+
+    async def get_statistics(self) -> Dict:
+        return await self._run(self.sync.get_statistics)
+
+    async def reset_viewed_profiles(self, user_id: int):
+        result = await self._run(self.sync.reset_viewed_profiles, user_id)
+        self.invalidate_candidates(user_id)
+        return result
+
+    async def delete_user_data(self, user_id: int):
+        result = await self._run(self.sync.delete_user_data, user_id)
+        self.invalidate_user_cache(user_id)
+        self.invalidate_profile_candidates(user_id)
+        self.ranking.remove(user_id)
+        return result
+
+    async def load_user_conversations(self, user_id: int) -> Dict[str, Dict[Tuple, object]]:
+        return await self._run(self.sync.load_user_conversations, user_id)
+
+    async def load_user_data(self, user_id: int) -> Optional[Dict]:
+        return await self._run(self.sync.load_user_data, user_id)
+
+    async def save_persistence_batch(self, conversations: Dict, user_data: Dict):
+        return await self._run(self.sync.save_persistence_batch, conversations, user_data)
+
+    # ----- Ранжирование -----
     
-    def add_viewed_profile(self, user_id: int, viewed_user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO profiles_viewed (user_id, viewed_user_id)
-            VALUES (?, ?)
-        ''', (user_id, viewed_user_id))
-        conn.commit()
-        conn.close()
+    async def load_ranking_index(self):
+        """Строит индекс ранжирования по всем анкетам (при запуске бота)"""
+        if RANKING_ENABLED:
+            self.ranking.load(await self._run(self.sync.get_ranking_profiles))
     
-    def get_viewed_profiles(self, user_id: int) -> List[int]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT viewed_user_id FROM profiles_viewed 
-            WHERE user_id = ?
-        ''', (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [row['viewed_user_id'] for row in rows]
+    async def _reindex_profile(self, user_id: int):
+        if not self.ranking.loaded:
+            return
+        try:
+            for profile in await self._run(self.sync.get_ranking_profiles, user_id):
+                self.ranking.add(profile)
+        except Exception as e:
+            logger.error(f"Error updating ranking index for {user_id}: {e}")
     
-    def get_user_likes(self, user_id: int) -> List[int]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT to_user_id FROM likes 
-            WHERE from_user_id = ?
-        ''', (user_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [row['to_user_id'] for row in rows]
+    async def _ranked_candidates(self, user_id: int, role: str, limit: int, exclude_ids: List[int],
+                                 preferences: Optional[Dict] = None) -> List[Dict]:
+        """Очередные доступные кандидаты из ранжированного списка пользователя"""
+        entry = self._ranked.get(user_id)
+        if entry is None:
+            entry = self._ranked[user_id] = [self.ranking.rank(user_id, role, preferences=preferences), 0]
+            while len(self._ranked) > self.prefetch_max_users:
+                self._ranked.popitem(last=False)
+        else:
+            self._ranked.move_to_end(user_id)
+        ranked, position = entry
+        
+        excluded = set(exclude_ids)
+        rows: List[Dict] = []
+        while len(rows) < limit and position < len(ranked):
+            # Порция с запасом: часть кандидатов уже просмотрена или лайкнута,
+            # а фильтр по подходу индекс ранжирования не проверяет
+            end = min(len(ranked), position + limit * (10 if preferences and preferences.get('approach') else 2))
+            chunk = [candidate_id for candidate_id in ranked[position:end] if candidate_id not in excluded]
+            found = await self._run(self.sync.get_candidates_by_ids, user_id, role, chunk, preferences) if chunk else []
+            if len(found) > limit - len(rows):
+                found = found[:limit - len(rows)]
+                # Следующая дозагрузка начнет сразу за последним взятым кандидатом
+                end = ranked.index(found[-1]['user_id'], position) + 1
+            rows.extend(found)
+            position = end
+        entry[1] = position
+        return rows
     
-    def check_mutual_like(self, user1_id: int, user2_id: int) -> bool:
-        """Проверяет, есть ли взаимный лайк между двумя пользователями"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) as count FROM likes 
-            WHERE (from_user_id = ? AND to_user_id = ?) 
-            OR (from_user_id = ? AND to_user_id = ?)
-        ''', (user1_id, user2_id, user2_id, user1_id))
-        result = cursor.fetchone()
-        conn.close()
-        return result['count'] == 2
+    # ----- Предзагрузка анкет -----
     
-    def get_statistics(self) -> Dict:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    async def next_candidate(self, user_id: int, role: str) -> Optional[Dict]:
+        """Следующая анкета для просмотра из очереди пользователя"""
+        candidates = self._candidates.get(user_id)
+        if not candidates:
+            await asyncio.shield(self._schedule_refill(user_id, role))
+            candidates = self._candidates.get(user_id)
+            if not candidates:
+                return None
+        
+        candidate = candidates.popleft()
+        self._last_served[user_id] = candidate['user_id']
+        
+        if len(candidates) < self.prefetch_low_watermark:
+            self._schedule_refill(user_id, role)
+        return candidate
+
+    def _schedule_refill(self, user_id: int, role: str) -> asyncio.Task:
+        task = self._refills.get(user_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refill_candidates(user_id, role))
+            self._refills[user_id] = task
+            task.add_done_callback(lambda t: self._refill_done(user_id, t))
+        return task
+
+    def _refill_done(self, user_id: int, task: asyncio.Task):
+        if self._refills.get(user_id) is task:
+            del self._refills[user_id]
+            # Других дозагрузок нет - поколение больше не с чем сравнивать
+            self._candidate_generations.pop(user_id, None)
+
+    async def _refill_candidates(self, user_id: int, role: str):
+        generation = (self._candidates_epoch, self._candidate_generations.get(user_id, 0))
+        candidates = self._candidates.get(user_id) or deque()
+        exclude_ids = [candidate['user_id'] for candidate in candidates]
+        if user_id in self._last_served:
+            exclude_ids.append(self._last_served[user_id])
         
-        cursor.execute("SELECT COUNT(*) as count FROM users WHERE role = 'psychologist'")
-        psychologists_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM users WHERE role = 'client'")
-        clients_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM likes WHERE is_mutual = 1")
-        mutual_matches = cursor.fetchone()['count'] // 2
-        
-        cursor.execute("SELECT COUNT(*) as count FROM likes")
-        total_likes = cursor.fetchone()['count']
+        try:
+            preferences = await self.get_preferences(user_id) if role == 'client' else None
+            rows = []
+            if self.ranking.loaded:
+                rows = await self._ranked_candidates(user_id, role, self.prefetch_size, exclude_ids, preferences)
+            if len(rows) < self.prefetch_size:
+                # Кандидаты без общих слов - в обычном порядке
+                rows += await self.get_next_candidates(
+                    user_id, role, self.prefetch_size - len(rows), exclude_ids + [row['user_id'] for row in rows],
+                    preferences
+                )
+        except Exception as e:
+            logger.error(f"Error prefetching candidates for {user_id}: {e}")
+            return
         
-        conn.close()
+        # Очередь была сброшена, пока шел запрос - результат устарел
+        if generation != (self._candidates_epoch, self._candidate_generations.get(user_id, 0)):
+            return
         
-        return {
-            'psychologists_count': psychologists_count,
-            'clients_count': clients_count,
-            'mutual_matches': mutual_matches,
-            'total_likes': total_likes
-        }
-    
-    def reset_viewed_profiles(self, user_id: int):
-        """Сброс просмотренных профилей"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM profiles_viewed WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
-        logger.info(f"Viewed profiles reset for user: {user_id}")
+        candidates = self._candidates.pop(user_id, None) or deque()
+        candidates.extend(rows)
+        self._candidates[user_id] = candidates
+        while len(self._candidates) > self.prefetch_max_users:
+            oldest_user_id = next(iter(self._candidates))
+            self.invalidate_candidates(oldest_user_id)
+
+    def _discard_candidate(self, user_id: int, candidate_id: int):
+        candidates = self._candidates.get(user_id)
+        if candidates:
+            self._candidates[user_id] = deque(c for c in candidates if c['user_id'] != candidate_id)
+
+    def invalidate_profile_candidates(self, user_id: int):
+        """Сбрасывает очередь пользователя после изменения его анкеты или роли и
+        убирает устаревшую анкету из очередей тех, кому она уже загружена"""
+        self.invalidate_candidates(user_id)
+        for other_id in [other_id for other_id, candidates in self._candidates.items()
+                         if any(candidate['user_id'] == user_id for candidate in candidates)]:
+            self._discard_candidate(other_id, user_id)
+
+    def invalidate_candidates(self, user_id: Optional[int] = None):
+        """Сбрасывает очередь анкет пользователя или, без user_id, всех пользователей"""
+        if user_id is None:
+            self._candidates.clear()
+            self._last_served.clear()
+            self._ranked.clear()
+            self._candidate_generations.clear()
+            self._candidates_epoch += 1
+        else:
+            self._candidates.pop(user_id, None)
+            self._last_served.pop(user_id, None)
+            self._ranked.pop(user_id, None)
+            if user_id in self._refills:
+                self._candidate_generations[user_id] = self._candidate_generations.get(user_id, 0) + 1
+
+    def close(self):
+        """Дожидается завершения запросов, останавливает пул потоков и закрывает соединения"""
+        self._executor.shutdown(wait=True)
+        self.sync.close()
+        self.closed = True
 
 # Создаем экземпляр базы данных
-db = Database()
+db = AsyncDatabase(Database())
 
 # ========== СИСТЕМА УВЕДОМЛЕНИЙ ==========
 
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Сколько секунд ждать до появления токена; токен не забирается"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+class NotificationDispatcher:
+    """Очередь исходящих уведомлений с пулом отправителей.
+    
+    Обработчики только ставят сообщение в очередь и сразу продолжают работу.
+    Отправители соблюдают общий лимит и лимит на чат, при RetryAfter
+    приостанавливают отправку на указанное Telegram время и повторяют попытку.
+    """
+
+    def __init__(self, workers: int = NOTIFY_WORKERS, queue_size: int = NOTIFY_QUEUE_SIZE,
+                 global_rate: float = NOTIFY_GLOBAL_RATE, chat_rate: float = NOTIFY_CHAT_RATE,
+                 chat_burst: float = NOTIFY_CHAT_BURST, max_retries: int = NOTIFY_MAX_RETRIES):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.bot = None
+
+    def start(self, bot):
+        """Запускает отправителей; вызывается после инициализации приложения"""
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Notification dispatcher started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает отправителей"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Notification dispatcher stopped with {self._queue.qsize()} unsent messages")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def enqueue(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Ставит сообщение в очередь; False, если очередь переполнена или не запущена"""
+        if self._queue is None:
+            logger.error(f"Notification dispatcher is not running, message to {chat_id} dropped")
+            return False
+        try:
+            self._queue.put_nowait((chat_id, dict(text=text, **kwargs), 0))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Notification queue is full, message to {chat_id} dropped")
+            return False
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.queue_size:
+                # Забываем чаты, в которые давно ничего не отправляли
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            chat_id, message, attempt = await self._queue.get()
+            try:
+                await self._send(chat_id, message, attempt)
+            except Exception as e:
+                logger.error(f"Error sending notification to {chat_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, chat_id: int, message: Dict, attempt: int):
+        while True:
+            # Токены берутся только когда оба лимита и пауза флуд-контроля это позволяют:
+            # заранее забранные токены после общей паузы ушли бы одной пачкой сверх лимита
+            while True:
+                chat_bucket = self._chat_bucket(chat_id)
+                delay = max(self._paused_until - time.monotonic(),
+                            self._global_bucket.wait_time(), chat_bucket.wait_time())
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self._global_bucket.take()
+            chat_bucket.take()
+            
+            try:
+                await self.bot.send_message(chat_id=chat_id, **message)
+                return
+            except RetryAfter as e:
+                # Флуд-контроль: приостанавливаем всю отправку, как просит Telegram
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Flood limit hit sending to {chat_id}, retry after {e.retry_after}s")
+            except Forbidden:
+                # Пользователь заблокировал бота - повторять бессмысленно
+                logger.info(f"Notification to {chat_id} not delivered: bot is blocked")
+                return
+            except BadRequest:
+                raise
+            except NetworkError as e:
+                logger.warning(f"Network error sending to {chat_id}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.error(f"Notification to {chat_id} dropped after {attempt} attempts")
+                return
+
+# Общий диспетчер уведомлений
+notifications = NotificationDispatcher()
+
+# ========== ОТЛОЖЕННЫЕ ДЕЙСТВИЯ ==========
+
+class DelayedActions:
+    """Отложенные действия по пользователям, не занимающие обработчик апдейта.
+    
+    У пользователя может быть только одно ожидающее действие: новое действие
+    или явная отмена (например, следующее нажатие кнопки) отменяет предыдущее.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, user_id: int, delay: float, action: Callable[[], Awaitable]):
+        self.cancel(user_id)
+        self._tasks[user_id] = asyncio.create_task(self._run(user_id, delay, action))
+
+    async def _run(self, user_id: int, delay: float, action: Callable[[], Awaitable]):
+        try:
+            await asyncio.sleep(delay)
+            await action()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in delayed action for {user_id}: {e}")
+        finally:
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
+
+    def cancel(self, user_id: int) -> bool:
+        """Отменяет ожидающее действие пользователя; True, если оно было"""
+        task = self._tasks.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Показ следующей анкеты после лайка
+next_profile_actions = DelayedActions()
+
+# ========== СОХРАНЕНИЕ ДИАЛОГОВ ==========
+
+class SQLitePersistence(BasePersistence):
+    """Хранит состояния ConversationHandler и context.user_data в SQLite.
+    
+    Изменения копятся в памяти и записываются одной транзакцией: Application
+    передает их раз в update_interval, а запись откладывается на write_delay,
+    чтобы все изменения одного прохода попали в один батч. Состояния диалогов
+    и user_data загружаются лениво, при первом апдейте пользователя после
+    запуска, поэтому время старта не зависит от числа пользователей.
+    
+    Сохраняются только значения типов JSON: для любого другого значения
+    update_* выбрасывает TypeError, а не записывает его строкой.
+    """
+
+    def __init__(self, database: AsyncDatabase, update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 write_delay: float = PERSISTENCE_WRITE_DELAY):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.database = database
+        self.write_delay = write_delay
+        self._loaded_users = set()
+        self._loaded_conversations = set()
+        self._pending_conversations: Dict[Tuple[str, int, str], Optional[str]] = {}
+        self._pending_user_data: Dict[int, Optional[str]] = {}
+        self._write_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    @staticmethod
+    def _dumps(value) -> str:
+        # Без default: значение не из JSON вызывает TypeError, иначе после
+        # перезапуска вместо него вернулась бы его строка
+        return json.dumps(value, ensure_ascii=False, allow_nan=False)
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._delayed_write())
+
+    async def _delayed_write(self):
+        await asyncio.sleep(self.write_delay)
+        # Отмена задачи (в flush) не должна прерывать уже начатую запись
+        await asyncio.shield(self._write_pending())
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            if not conversations and not user_data:
+                return
+            try:
+                await self.database.save_persistence_batch(conversations, user_data)
+            except Exception as e:
+                logger.error(f"Error saving conversation state: {e}")
+                # Возвращаем изменения, более новые значения не перетираем
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                self._pending_user_data = {**user_data, **self._pending_user_data}
+
+    # Состояния диалогов
+
+    async def get_conversations(self, name: str) -> Dict:
+        # Состояния подгружаются по пользователю в refresh_conversations
+        return {}
+
+    async def refresh_conversations(self, application: Application, user_id: int):
+        """Подгружает сохраненные состояния диалогов пользователя при его первом апдейте.
+        
+        ConversationHandler проверяет состояние синхронно и сам его не загружает,
+        поэтому состояния кладутся в его словарь до проверки апдейта.
+        """
+        if user_id in self._loaded_conversations:
+            return
+        self._loaded_conversations.add(user_id)
+        stored = await self.database.load_user_conversations(user_id)
+        if not stored:
+            return
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent and handler.name in stored):
+                    continue
+                # Состояния, уже измененные в этом запуске, важнее сохраненных
+                conversations = handler._conversations
+                conversations.update_no_track({
+                    key: state for key, state in stored[handler.name].items()
+                    if key not in conversations and state != ConversationHandler.END
+                })
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        # Ключ диалога - (chat_id, user_id); в личном чате последний элемент всегда id пользователя
+        pending_key = (name, key[-1], json.dumps(list(key)))
+        self._pending_conversations[pending_key] = None if new_state is None else self._dumps(new_state)
+        self._schedule_write()
+
+    # user_data
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        # Данные пользователей подгружаются в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        stored = await self.database.load_user_data(user_id)
+        if stored:
+            # Значения, уже записанные в этом апдейте, важнее сохраненных
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._loaded_users.add(user_id)
+        self._pending_user_data[user_id] = self._dumps(data) if data else None
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        self._loaded_users.add(user_id)
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+
+    # chat_data, bot_data и callback_data не используются
+
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        """Записывает все накопленные изменения (вызывается при остановке)"""
+        if self._write_task and not self._write_task.done():
+            self._write_task.cancel()
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self._write_pending()
+
 async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, from_user_id: int, to_user_id: int):
     """Отправка уведомления о новом лайке"""
     try:
         # Получаем информацию о пользователе, который поставил лайк
-        from_user = db.get_user(from_user_id)
+        from_user = await db.get_user(from_user_id)
         from_profile = None
         
         if from_user['role'] == 'psychologist':
-            from_profile = db.get_psychologist_profile(from_user_id)
+            from_profile = await db.get_psychologist_profile(from_user_id)
         else:
-            from_profile = db.get_client_profile(from_user_id)
+            from_profile = await db.get_client_profile(from_user_id)
         
         from_user_name = from_profile.get('name', 'пользователь') if from_profile else 'пользователь'
         from_user_role = "психолог" if from_user['role'] == 'psychologist' else "клиент"
@@ -421,14 +1197,14 @@ async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, from_user_i
 💫 Загляните в раздел "Мои мэтчи", чтобы посмотреть анкету и ответить взаимностью!
         """
         
-        # Отправляем уведомление
-        await context.bot.send_message(
+        # Ставим уведомление в очередь на отправку
+        notifications.enqueue(
             chat_id=to_user_id,
             text=message,
             parse_mode='Markdown'
         )
         
-        logger.info(f"Like notification sent to {to_user_id} from {from_user_id}")
+        logger.info(f"Like notification queued to {to_user_id} from {from_user_id}")
         
     except Exception as e:
         logger.error(f"Error sending like notification: {e}")
@@ -440,6 +1216,7 @@ async def create_main_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton("👀 Смотреть анкеты", callback_data="view_profiles")],
         [InlineKeyboardButton("💞 Мои мэтчи", callback_data="view_matches")],
+        [InlineKeyboardButton("📥 Кто меня лайкнул", callback_data="view_inbox")],
         [InlineKeyboardButton("📊 Моя статистика", callback_data="my_stats")],
         [InlineKeyboardButton("⚙️ Технические функции", callback_data="tech_functions")]
     ]
@@ -456,6 +1233,67 @@ async def create_tech_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(keyboard)
 
+async def create_gender_keyboard() -> ReplyKeyboardMarkup:
+    """Клавиатура выбора пола"""
+    return ReplyKeyboardMarkup([list(GENDER_LABELS.values())], one_time_keyboard=True, resize_keyboard=True)
+
+async def ask_gender_again(update: Update):
+    await update.message.reply_text('Выберите пол кнопкой ниже:', reply_markup=await create_gender_keyboard())
+
+async def ask_age_again(update: Update):
+    await update.message.reply_text(f'Укажите возраст числом от {MIN_AGE} до {MAX_AGE}:')
+
+async def reply_profile_card(message: Message, card: Card):
+    """Отправляет карточку новым сообщением: фото с текстом в подписи и кнопками.
+    
+    Если текст длиннее подписи, его остаток и кнопки уходят следующим сообщением.
+    """
+    if not card.photo_file_id:
+        await message.reply_text(card.text, entities=card.entities, reply_markup=card.reply_markup)
+        return
+    caption, rest = split_caption(card)
+    await message.reply_photo(photo=card.photo_file_id, caption=caption.text, caption_entities=caption.entities,
+                              reply_markup=None if rest else card.reply_markup)
+    if rest:
+        await message.reply_text(rest.text, entities=rest.entities, reply_markup=rest.reply_markup)
+
+async def show_profile_card(update: Update, card: Card):
+    """Показывает карточку вместо сообщения, на кнопке которого нажали.
+    
+    Фото подменяется в том же сообщении через edit_message_media, текст - через
+    edit_message_text. Если тип сообщения поменять нельзя (текст на фото или
+    наоборот) или текст не помещается в подпись, карточка отправляется заново.
+    """
+    query = update.callback_query
+    has_photo = bool(query.message and query.message.photo)
+    try:
+        if card.photo_file_id and has_photo:
+            caption, rest = split_caption(card)
+            if rest is None:
+                await query.edit_message_media(
+                    InputMediaPhoto(card.photo_file_id, caption=caption.text, caption_entities=caption.entities),
+                    reply_markup=card.reply_markup
+                )
+                return
+        elif not card.photo_file_id and not has_photo:
+            await query.edit_message_text(card.text, entities=card.entities, reply_markup=card.reply_markup)
+            return
+    except BadRequest as e:
+        if "Message is not modified" in str(e):
+            # Игнорируем ошибку, если сообщение не изменилось
+            await query.answer()
+            return
+        raise
+    await reply_profile_card(query.message, card)
+
+async def edit_or_reply(update: Update, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Заменяет текст сообщения с кнопкой; у анкеты с фото текста нет, поэтому отправляется новое"""
+    query = update.callback_query
+    if query.message and query.message.photo:
+        await query.message.reply_text(text, reply_markup=reply_markup)
+    else:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str = "Главное меню:"):
     """Показывает главное меню"""
     reply_markup = await create_main_keyboard()
@@ -464,7 +1302,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, mes
         await update.message.reply_text(message, reply_markup=reply_markup)
     elif hasattr(update, 'callback_query') and update.callback_query:
         try:
-            await update.callback_query.edit_message_text(message, reply_markup=reply_markup)
+            await edit_or_reply(update, message, reply_markup)
         except BadRequest as e:
             if "Message is not modified" in str(e):
                 # Игнорируем ошибку, если сообщение не изменилось
@@ -500,7 +1338,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /profile - Посмотреть свой профиль
 /edit - Редактировать анкету
 /stats - Общая статистика бота
-/search - Поиск анкет
+/search <запрос> - Поиск психологов по подходу и запросам
+/filters - Фильтры анкет психологов: пол, возраст, цена, подход
 /restart - Перезапустить бота (сбросить все данные)
 /help - Эта справка
 
@@ -518,17 +1357,7 @@ async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = user.id
         
         # Сбрасываем данные пользователя
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM psychologist_profiles WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM client_profiles WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?', (user_id, user_id))
-        cursor.execute('DELETE FROM profiles_viewed WHERE user_id = ? OR viewed_user_id = ?', (user_id, user_id))
-        
-        conn.commit()
-        conn.close()
+        await db.delete_user_data(user_id)
         
         # Очищаем user_data
         context.user_data.clear()
@@ -556,7 +1385,7 @@ async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Редактирование анкеты"""
     try:
         user_id = update.message.from_user.id
-        user_data = db.get_user(user_id)
+        user_data = await db.get_user(user_id)
         
         if not user_data:
             await update.message.reply_text("У вас нет анкеты. Используйте /start для создания.")
@@ -564,7 +1393,7 @@ async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Сохраняем текущий профиль в context для предзаполнения
         if user_data['role'] == 'psychologist':
-            profile = db.get_psychologist_profile(user_id)
+            profile = await db.get_psychologist_profile(user_id)
             if profile:
                 context.user_data['edit_profile'] = profile
                 
@@ -586,7 +1415,7 @@ async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("Профиль не найден. Используйте /start для создания анкеты.")
                 return ConversationHandler.END
         else:
-            profile = db.get_client_profile(user_id)
+            profile = await db.get_client_profile(user_id)
             if profile:
                 context.user_data['edit_profile'] = profile
                 
@@ -615,7 +1444,7 @@ async def edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора поля для редактирования"""
     try:
         user_id = update.message.from_user.id
-        user_data = db.get_user(user_id)
+        user_data = await db.get_user(user_id)
         choice = update.message.text
         
         if not user_data:
@@ -642,18 +1471,16 @@ async def edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return EDIT_PSY_NAME
             elif choice == '🎂 Возраст':
                 await update.message.reply_text(
-                    f"Текущий возраст: {profile.get('age', 'Не указано')}\n"
+                    f"Текущий возраст: {profile.get('age') or 'Не указано'}\n"
                     "Введите новый возраст:",
                     reply_markup=ReplyKeyboardRemove()
                 )
                 return EDIT_PSY_AGE
             elif choice == '👫 Пол':
-                keyboard = [['👨 Мужской', '👩 Женский']]
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
                 await update.message.reply_text(
-                    f"Текущий пол: {profile.get('gender', 'Не указано')}\n"
+                    f"Текущий пол: {gender_label(profile.get('gender'))}\n"
                     "Выберите новый пол:",
-                    reply_markup=reply_markup
+                    reply_markup=await create_gender_keyboard()
                 )
                 return EDIT_PSY_GENDER
             elif choice == '🎓 Образование':
@@ -671,16 +1498,7 @@ async def edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return EDIT_PSY_ABOUT
             elif choice == '🧠 Подход':
-                keyboard = [
-                    ['Когнитивно-поведенческая терапия (КПТ)'],
-                    ['Психоанализ'],
-                    ['Гештальт'],
-                    ['Экзистенциально-гуманистическая терапия'],
-                    ['3 волна КПТ (АСТ, ДБТ, CFT, MBCT, схема-терапия)'],
-                    ['Психодрама'],
-                    ['Телесная терапия'],
-                    ['Другое']
-                ]
+                keyboard = [[approach] for approach in APPROACHES] + [['Другое']]
                 reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
                 await update.message.reply_text(
                     f"Текущий подход: {profile.get('approach', 'Не указано')}\n"
@@ -727,18 +1545,16 @@ async def edit_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return EDIT_CLIENT_NAME
             elif choice == '🎂 Возраст':
                 await update.message.reply_text(
-                    f"Текущий возраст: {profile.get('age', 'Не указано')}\n"
+                    f"Текущий возраст: {profile.get('age') or 'Не указано'}\n"
                     "Введите новый возраст:",
                     reply_markup=ReplyKeyboardRemove()
                 )
                 return EDIT_CLIENT_AGE
             elif choice == '👫 Пол':
-                keyboard = [['👨 Мужской', '👩 Женский']]
-                reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
                 await update.message.reply_text(
-                    f"Текущий пол: {profile.get('gender', 'Не указано')}\n"
+                    f"Текущий пол: {gender_label(profile.get('gender'))}\n"
                     "Выберите новый пол:",
-                    reply_markup=reply_markup
+                    reply_markup=await create_gender_keyboard()
                 )
                 return EDIT_CLIENT_GENDER
             elif choice == '🎯 Запрос':
@@ -767,14 +1583,20 @@ async def edit_psy_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def edit_psy_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    new_gender = update.message.text
+    new_gender = parse_gender(update.message.text)
+    if new_gender is None:
+        await ask_gender_again(update)
+        return EDIT_PSY_GENDER
     context.user_data['edit_profile']['gender'] = new_gender
     await update.message.reply_text("✅ Пол обновлен!")
     return await return_to_edit_menu(update, context)
 
 async def edit_psy_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    new_age = update.message.text
+    new_age = parse_age(update.message.text)
+    if new_age is None:
+        await ask_age_again(update)
+        return EDIT_PSY_AGE
     context.user_data['edit_profile']['age'] = new_age
     await update.message.reply_text("✅ Возраст обновлен!")
     return await return_to_edit_menu(update, context)
@@ -837,14 +1659,20 @@ async def edit_client_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def edit_client_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    new_gender = update.message.text
+    new_gender = parse_gender(update.message.text)
+    if new_gender is None:
+        await ask_gender_again(update)
+        return EDIT_CLIENT_GENDER
     context.user_data['edit_profile']['gender'] = new_gender
     await update.message.reply_text("✅ Пол обновлен!")
     return await return_to_edit_menu(update, context)
 
 async def edit_client_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    new_age = update.message.text
+    new_age = parse_age(update.message.text)
+    if new_age is None:
+        await ask_age_again(update)
+        return EDIT_CLIENT_AGE
     context.user_data['edit_profile']['age'] = new_age
     await update.message.reply_text("✅ Возраст обновлен!")
     return await return_to_edit_menu(update, context)
@@ -859,16 +1687,16 @@ async def edit_client_request(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def return_to_edit_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возврат в меню редактирования с сохранением изменений"""
     user_id = update.message.from_user.id
-    user_data = db.get_user(user_id)
+    user_data = await db.get_user(user_id)
     
     # Сохраняем изменения в базу
     profile = context.user_data.get('edit_profile', {})
     if user_data['role'] == 'psychologist':
-        db.save_psychologist_profile(
+        await db.save_psychologist_profile(
             user_id=user_id,
             name=profile.get('name', ''),
-            gender=profile.get('gender', ''),
-            age=profile.get('age', ''),
+            gender=profile.get('gender'),
+            age=profile.get('age'),
             education=profile.get('education', ''),
             about_me=profile.get('about_me', ''),
             approach=profile.get('approach', ''),
@@ -877,17 +1705,188 @@ async def return_to_edit_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
             photo_file_id=profile.get('photo_file_id')
         )
     else:
-        db.save_client_profile(
+        await db.save_client_profile(
             user_id=user_id,
             name=profile.get('name', ''),
-            gender=profile.get('gender', ''),
-            age=profile.get('age', ''),
+            gender=profile.get('gender'),
+            age=profile.get('age'),
             request=profile.get('request', '')
         )
     
     # Возвращаемся в меню редактирования
     return await edit_command(update, context)
 
+# ========== ФИЛЬТРЫ ПРОСМОТРА ==========
+
+FILTER_ANY = 'Любой'
+
+def is_any_choice(text: Optional[str]) -> bool:
+    """Ответ "любой/любая/любое" снимает фильтр"""
+    return (text or '').strip().lower().startswith('люб')
+
+def format_preferences(preferences: Optional[Dict]) -> str:
+    """Текущие фильтры списком для сообщений"""
+    preferences = preferences or {}
+    age_min, age_max = preferences.get('age_min'), preferences.get('age_max')
+    if age_min is not None and age_max is not None:
+        age = f"{age_min}-{age_max}"
+    elif age_min is not None:
+        age = f"от {age_min}"
+    elif age_max is not None:
+        age = f"до {age_max}"
+    else:
+        age = FILTER_ANY.lower()
+    price = preferences.get('price_max')
+    return (
+        f"👫 Пол: {GENDER_LABELS.get(preferences.get('gender'), FILTER_ANY.lower())}\n"
+        f"🎂 Возраст: {age}\n"
+        f"💰 Стоимость: {f'до {price}' if price is not None else 'любая'}\n"
+        f"🧠 Подход: {preferences.get('approach') or FILTER_ANY.lower()}"
+    )
+
+async def filters_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Настройка фильтров просмотра анкет психологов"""
+    try:
+        user_id = update.message.from_user.id
+        user_data = await db.get_user(user_id)
+        
+        if not user_data:
+            await update.message.reply_text("У вас нет анкеты. Используйте /start для создания.")
+            return ConversationHandler.END
+        if user_data['role'] != 'client':
+            await update.message.reply_text("🔎 Фильтры анкет доступны только клиентам.")
+            return ConversationHandler.END
+        
+        context.user_data['filters'] = await db.get_preferences(user_id) or {}
+        return await show_filters_menu(update, context)
+    except Exception as e:
+        logger.error(f"Error in filters_command: {e}")
+        await update.message.reply_text("Ошибка при загрузке фильтров.")
+        return ConversationHandler.END
+
+async def show_filters_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str = "🔎 Фильтры анкет психологов"):
+    """Текущие фильтры и выбор, какой изменить"""
+    keyboard = [
+        ['👫 Пол', '🎂 Возраст'],
+        ['💰 Цена', '🧠 Подход'],
+        ['🧹 Сбросить фильтры', '✅ Готово']
+    ]
+    await update.message.reply_text(
+        f"{message}\n\n{format_preferences(context.user_data.get('filters'))}\n\n"
+        "Выберите, что хотите изменить:",
+        reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=False, resize_keyboard=True)
+    )
+    return FILTER_CHOICE
+
+async def save_filters(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str):
+    """Сохраняет фильтры из user_data и возвращает в меню фильтров"""
+    user_id = update.message.from_user.id
+    preferences = context.user_data.setdefault('filters', {})
+    await db.save_preferences(
+        user_id,
+        gender=preferences.get('gender'),
+        age_min=preferences.get('age_min'),
+        age_max=preferences.get('age_max'),
+        price_max=preferences.get('price_max'),
+        approach=preferences.get('approach')
+    )
+    return await show_filters_menu(update, context, message)
+
+async def filter_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка выбора фильтра"""
+    try:
+        choice = update.message.text
+        
+        if choice == '✅ Готово':
+            context.user_data.pop('filters', None)
+            await update.message.reply_text("✅ Фильтры сохранены!", reply_markup=ReplyKeyboardRemove())
+            await show_main_menu(update, context, "Новые анкеты будут подобраны с учетом фильтров.")
+            return ConversationHandler.END
+        elif choice == '🧹 Сбросить фильтры':
+            context.user_data['filters'] = {}
+            return await save_filters(update, context, "🧹 Фильтры сброшены")
+        elif choice == '👫 Пол':
+            await update.message.reply_text(
+                "Психологов какого пола показывать?",
+                reply_markup=ReplyKeyboardMarkup(
+                    [list(GENDER_LABELS.values()), [FILTER_ANY]], one_time_keyboard=True, resize_keyboard=True
+                )
+            )
+            return FILTER_GENDER
+        elif choice == '🎂 Возраст':
+            await update.message.reply_text(
+                "Укажите возраст психолога: например 30-45, от 30 или до 45.\n"
+                "Чтобы снять фильтр, выберите «Любой».",
+                reply_markup=ReplyKeyboardMarkup([[FILTER_ANY]], one_time_keyboard=True, resize_keyboard=True)
+            )
+            return FILTER_AGE
+        elif choice == '💰 Цена':
+            await update.message.reply_text(
+                "Укажите максимальную стоимость сессии, например 3000 или 5 тыс.\n"
+                "Чтобы снять фильтр, выберите «Любой».",
+                reply_markup=ReplyKeyboardMarkup([[FILTER_ANY]], one_time_keyboard=True, resize_keyboard=True)
+            )
+            return FILTER_PRICE
+        elif choice == '🧠 Подход':
+            await update.message.reply_text(
+                "Выберите подход или напишите ключевые слова, например «КПТ» или «гештальт»:",
+                reply_markup=ReplyKeyboardMarkup(
+                    [[approach] for approach in APPROACHES] + [[FILTER_ANY]],
+                    one_time_keyboard=True, resize_keyboard=True
+                )
+            )
+            return FILTER_APPROACH
+        
+        await update.message.reply_text("Неизвестный выбор. Попробуйте снова.")
+        return FILTER_CHOICE
+        
+    except Exception as e:
+        logger.error(f"Error in filter_choice: {e}")
+        await update.message.reply_text("Ошибка при настройке фильтров.")
+        return ConversationHandler.END
+
+async def filter_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    gender = None if is_any_choice(text) else parse_gender(text)
+    if gender is None and not is_any_choice(text):
+        await ask_gender_again(update)
+        return FILTER_GENDER
+    context.user_data.setdefault('filters', {})['gender'] = gender
+    return await save_filters(update, context, "✅ Фильтр по полу обновлен")
+
+async def filter_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    age_min, age_max = (None, None) if is_any_choice(text) else parse_age_range(text)
+    valid = all(age is None or MIN_AGE <= age <= MAX_AGE for age in (age_min, age_max))
+    if not is_any_choice(text) and (not valid or (age_min is None and age_max is None)):
+        await update.message.reply_text(
+            f"Укажите возраст от {MIN_AGE} до {MAX_AGE}: например 30-45, от 30 или до 45."
+        )
+        return FILTER_AGE
+    preferences = context.user_data.setdefault('filters', {})
+    preferences['age_min'], preferences['age_max'] = age_min, age_max
+    return await save_filters(update, context, "✅ Фильтр по возрасту обновлен")
+
+async def filter_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    price_min, price_max = (None, None) if is_any_choice(text) else parse_price(text)
+    if price_max is None:
+        price_max = price_min
+    if price_max is None and not is_any_choice(text):
+        await update.message.reply_text("Укажите стоимость числом, например 3000.")
+        return FILTER_PRICE
+    context.user_data.setdefault('filters', {})['price_max'] = price_max
+    return await save_filters(update, context, "✅ Фильтр по стоимости обновлен")
+
+async def filter_approach(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text
+    approach = None if is_any_choice(text) else text.strip()[:200]
+    if approach is not None and not tokenize(approach):
+        await update.message.reply_text("Напишите название подхода словами, например «гештальт».")
+        return FILTER_APPROACH
+    context.user_data.setdefault('filters', {})['approach'] = approach
+    return await save_filters(update, context, "✅ Фильтр по подходу обновлен")
+
 # ========== ОСНОВНЫЕ ФУНКЦИИ БОТА ==========
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -900,7 +1899,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         last_name = user.last_name
         
         # Обновляем активность пользователя
-        db.update_last_active(user_id)
+        await db.update_last_active(user_id)
         
         keyboard = [['👨‍⚕️ Психолог', '👤 Клиент']]
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
@@ -928,7 +1927,7 @@ async def role_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if 'Психолог' in choice:
             # Создаем пользователя в базе с сохранением ника
-            db.create_user(user_id, username, first_name, last_name, 'psychologist')
+            await db.create_user(user_id, username, first_name, last_name, 'psychologist')
             
             await update.message.reply_text(
                 '👨‍⚕️ Отлично! Вы психолог. Давайте заполним вашу анкету.\n\n'
@@ -938,7 +1937,7 @@ async def role_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return PSY_NAME
         else:
             # Создаем пользователя в базе с сохранением ника
-            db.create_user(user_id, username, first_name, last_name, 'client')
+            await db.create_user(user_id, username, first_name, last_name, 'client')
             
             await update.message.reply_text(
                 '👤 Отлично! Вы клиент. Давайте заполним вашу анкету.\n\n'
@@ -959,13 +1958,9 @@ async def psy_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
         context.user_data['psy_name'] = update.message.text
         
-        # Клавиатура для выбора пола
-        gender_keyboard = [['👨 Мужской', '👩 Женский']]
-        reply_markup = ReplyKeyboardMarkup(gender_keyboard, one_time_keyboard=True, resize_keyboard=True)
-        
         await update.message.reply_text(
             'Выберите ваш пол:',
-            reply_markup=reply_markup
+            reply_markup=await create_gender_keyboard()
         )
         return PSY_GENDER
     except Exception as e:
@@ -977,7 +1972,11 @@ async def psy_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пол психолога"""
     try:
         user_id = update.message.from_user.id
-        context.user_data['psy_gender'] = update.message.text
+        gender = parse_gender(update.message.text)
+        if gender is None:
+            await ask_gender_again(update)
+            return PSY_GENDER
+        context.user_data['psy_gender'] = gender
         
         await update.message.reply_text(
             'Укажите ваш возраст:',
@@ -993,7 +1992,11 @@ async def psy_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возраст психолога"""
     try:
         user_id = update.message.from_user.id
-        context.user_data['psy_age'] = update.message.text
+        age = parse_age(update.message.text)
+        if age is None:
+            await ask_age_again(update)
+            return PSY_AGE
+        context.user_data['psy_age'] = age
         
         await update.message.reply_text(
             '🎓 Образование + доп. образование:\n\n'
@@ -1034,16 +2037,7 @@ async def psy_about(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
         context.user_data['psy_about'] = update.message.text
         
-        keyboard = [
-            ['Когнитивно-поведенческая терапия (КПТ)'],
-            ['Психоанализ'],
-            ['Гештальт'],
-            ['Экзистенциально-гуманистическая терапия'],
-            ['3 волна КПТ (АСТ, ДБТ, CFT, MBCT, схема-терапия)'],
-            ['Психодрама'],
-            ['Телесная терапия'],
-            ['Другое']
-        ]
+        keyboard = [[approach] for approach in APPROACHES] + [['Другое']]
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
         
         await update.message.reply_text(
@@ -1125,15 +2119,10 @@ async def psy_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.message.from_user.id
         
-        photo_file_id = None
-        if update.message.photo:
-            photo_file_id = update.message.photo[-1].file_id
-            photo_text = "✅ Фото добавлено!"
-        else:
-            photo_text = "❌ Фото не добавлено"
+        photo_file_id = update.message.photo[-1].file_id if update.message.photo else None
         
         # Сохраняем профиль в базу данных
-        db.save_psychologist_profile(
+        await db.save_psychologist_profile(
             user_id=user_id,
             name=context.user_data['psy_name'],
             gender=context.user_data['psy_gender'],
@@ -1146,28 +2135,8 @@ async def psy_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             photo_file_id=photo_file_id
         )
         
-        profile = f"""
-✅ Анкета заполнена!
-
-👤{context.user_data['psy_name']}, пол: {context.user_data['psy_gender']},{context.user_data['psy_age']}
-
-🎓 Образование: {context.user_data['psy_education']}
-
-💫 О себе:{context.user_data['psy_about']}
-
-🧠 Подход:{context.user_data['psy_approach']}
-
-🎯 Работаю с запросами: {context.user_data['psy_requests']}
-
-💰 Стоимость: {context.user_data['psy_price']}
-
-{photo_text}
-        """
-        
-        await update.message.reply_text(profile)
-        
-        if photo_file_id:
-            await update.message.reply_photo(photo=photo_file_id)
+        profile = await db.get_psychologist_profile(user_id)
+        await reply_profile_card(update.message, db.cards.own(profile, 'psychologist', "✅ Анкета заполнена!"))
         
         # Показываем главное меню после завершения анкеты
         await show_main_menu(update, context, "🎉 Регистрация завершена! Теперь вы можете пользоваться ботом:")
@@ -1186,7 +2155,7 @@ async def psy_skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
         
         # Сохраняем профиль в базу данных
-        db.save_psychologist_profile(
+        await db.save_psychologist_profile(
             user_id=user_id,
             name=context.user_data['psy_name'],
             gender=context.user_data['psy_gender'],
@@ -1199,25 +2168,8 @@ async def psy_skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             photo_file_id=None
         )
         
-        profile = f"""
-✅ Анкета заполнена!
-
-👤 {context.user_data['psy_name']}, пол:{context.user_data['psy_gender']}, {context.user_data['psy_age']}
-
-🎓 Образование: {context.user_data['psy_education']}
-
-💫 О себе: {context.user_data['psy_about']}
-
-🧠 Подход: {context.user_data['psy_approach']}
-
-🎯 Работаю с запросами: {context.user_data['psy_requests']}
-
-💰 Стоимость: {context.user_data['psy_price']}
-
-❌ Фото не добавлено
-        """
-        
-        await update.message.reply_text(profile)
+        profile = await db.get_psychologist_profile(user_id)
+        await reply_profile_card(update.message, db.cards.own(profile, 'psychologist', "✅ Анкета заполнена!"))
         
         # Показываем главное меню после завершения анкеты
         await show_main_menu(update, context, "🎉 Регистрация завершена! Теперь вы можете пользоваться ботом:")
@@ -1238,13 +2190,9 @@ async def client_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.message.from_user.id
         context.user_data['client_name'] = update.message.text
         
-        # Клавиатура для выбора пола клиента
-        gender_keyboard = [['👨 Мужской', '👩 Женский']]
-        reply_markup = ReplyKeyboardMarkup(gender_keyboard, one_time_keyboard=True, resize_keyboard=True)
-        
         await update.message.reply_text(
             'Выберите ваш пол:',
-            reply_markup=reply_markup
+            reply_markup=await create_gender_keyboard()
         )
         return CLIENT_GENDER
     except Exception as e:
@@ -1256,7 +2204,11 @@ async def client_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пол клиента"""
     try:
         user_id = update.message.from_user.id
-        context.user_data['client_gender'] = update.message.text
+        gender = parse_gender(update.message.text)
+        if gender is None:
+            await ask_gender_again(update)
+            return CLIENT_GENDER
+        context.user_data['client_gender'] = gender
         
         await update.message.reply_text(
             'Укажите ваш возраст:',
@@ -1272,7 +2224,11 @@ async def client_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возраст клиента"""
     try:
         user_id = update.message.from_user.id
-        context.user_data['client_age'] = update.message.text
+        age = parse_age(update.message.text)
+        if age is None:
+            await ask_age_again(update)
+            return CLIENT_AGE
+        context.user_data['client_age'] = age
         
         await update.message.reply_text(
             '🎯 Опишите ваш запрос к психологу:\n'
@@ -1291,7 +2247,7 @@ async def client_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['client_request'] = update.message.text
         
         # Сохраняем профиль в базу данных
-        db.save_client_profile(
+        await db.save_client_profile(
             user_id=user_id,
             name=context.user_data['client_name'],
             gender=context.user_data['client_gender'],
@@ -1299,14 +2255,8 @@ async def client_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
             request=context.user_data['client_request']
         )
         
-        profile = f"""
-✅ Ваш профиль клиента заполнен!
-
-👤 Имя: {context.user_data['client_name']}, Пол: {context.user_data['client_gender']}, Возраст: {context.user_data['client_age']}
-🎯 Ваш запрос: {context.user_data['client_request']}
-        """
-        
-        await update.message.reply_text(profile)
+        profile = await db.get_client_profile(user_id)
+        await reply_profile_card(update.message, db.cards.own(profile, 'client', "✅ Ваш профиль клиента заполнен!"))
         
         # Показываем главное меню после завершения анкеты
         await show_main_menu(update, context, "🎉 Регистрация завершена! Теперь вы можете пользоваться ботом:")
@@ -1321,6 +2271,7 @@ async def client_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ========== СИСТЕМА ЛАЙКОВ И ПРОСМОТРА ==========
 
+@instrument_button
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на кнопки - УЛУЧШЕННАЯ ВЕРСИЯ"""
     try:
@@ -1338,6 +2289,17 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif query.data == "view_matches":
             await show_matches(update, context, user_id)
         
+        elif query.data == "view_inbox":
+            await show_likes_inbox(update, context, user_id)
+        
+        elif query.data.startswith(("matches_", "inbox_")):
+            section, direction, like_id = query.data.split("_")
+            cursor = {'after_id': int(like_id)} if direction == "next" else {'before_id': int(like_id)}
+            if section == "matches":
+                await show_matches(update, context, user_id, **cursor)
+            else:
+                await show_likes_inbox(update, context, user_id, **cursor)
+        
         elif query.data == "tech_functions":
             await show_tech_menu(update, context)
         
@@ -1360,6 +2322,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             target_id = int(query.data.split("_")[1])
             await like_profile(update, context, user_id, target_id)
         
+        elif query.data.startswith("search_page_"):
+            page = int(query.data.split("_")[2])
+            await show_search_results(update, context, user_id, page)
+        
+        elif query.data.startswith("search_like_"):
+            target_id = int(query.data.split("_")[2])
+            await like_profile(update, context, user_id, target_id, show_next=False)
+        
         elif query.data.startswith("skip_"):
             await show_next_profile(update, context, user_id)
         
@@ -1388,7 +2358,7 @@ async def edit_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         query = update.callback_query
         await query.answer()
         
-        user_data = db.get_user(user_id)
+        user_data = await db.get_user(user_id)
         
         if not user_data:
             await query.edit_message_text("У вас нет анкеты. Используйте /start для создания.")
@@ -1396,7 +2366,7 @@ async def edit_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE, u
         
         # Отправляем новое сообщение вместо редактирования текущего
         if user_data['role'] == 'psychologist':
-            profile = db.get_psychologist_profile(user_id)
+            profile = await db.get_psychologist_profile(user_id)
             if profile:
                 context.user_data['edit_profile'] = profile
                 
@@ -1420,7 +2390,7 @@ async def edit_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE, u
                 await query.edit_message_text("Профиль не найден. Используйте /start для создания анкеты.")
                 return ConversationHandler.END
         else:
-            profile = db.get_client_profile(user_id)
+            profile = await db.get_client_profile(user_id)
             if profile:
                 context.user_data['edit_profile'] = profile
                 
@@ -1454,17 +2424,7 @@ async def restart_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.answer()
         
         # Сбрасываем данные пользователя
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM psychologist_profiles WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM client_profiles WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?', (user_id, user_id))
-        cursor.execute('DELETE FROM profiles_viewed WHERE user_id = ? OR viewed_user_id = ?', (user_id, user_id))
-        
-        conn.commit()
-        conn.close()
+        await db.delete_user_data(user_id)
         
         # Очищаем user_data
         context.user_data.clear()
@@ -1490,7 +2450,7 @@ async def restart_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_global_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Показать общую статистику бота"""
     try:
-        stats = db.get_statistics()
+        stats = await db.get_statistics()
         stats_text = f"""
 📈 Общая статистика бота:
 
@@ -1507,13 +2467,13 @@ async def show_global_stats(update: Update, context: ContextTypes.DEFAULT_TYPE,
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Показать статистику пользователя"""
     try:
-        user_data = db.get_user(user_id)
+        user_data = await db.get_user(user_id)
         if not user_data:
             await update.callback_query.edit_message_text("Сначала заполните анкету через /start")
             return
         
-        user_likes = db.get_user_likes(user_id)
-        mutual_likes = db.get_mutual_likes(user_id)
+        user_likes = await db.get_user_likes(user_id)
+        matches_count = await db.count_matches(user_id)
         
         if user_data['role'] == 'psychologist':
             role_text = "психолог"
@@ -1527,7 +2487,7 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id
 
 👤 Ваш профиль: {role_text}
 ❤️ Вы лайкнули: {len(user_likes)} {target_role}
-💝 Взаимные лайки: {len(mutual_likes)} {target_role}
+💝 Взаимные лайки: {matches_count} {target_role}
         """
         
         await update.callback_query.edit_message_text(stats_text, reply_markup=await create_main_keyboard())
@@ -1539,7 +2499,7 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id
 async def reset_viewed_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Сброс просмотренных профилей"""
     try:
-        db.reset_viewed_profiles(user_id)
+        await db.reset_viewed_profiles(user_id)
         
         await update.callback_query.edit_message_text(
             "✅ Список просмотренных анкет очищен! Теперь вы снова увидите все анкеты.",
@@ -1553,34 +2513,32 @@ async def reset_viewed_profiles(update: Update, context: ContextTypes.DEFAULT_TY
 async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Показать следующую анкету - УЛУЧШЕННАЯ ВЕРСИЯ С ОБРАБОТКОЙ ОШИБОК"""
     try:
-        current_user = db.get_user(user_id)
+        current_user = await db.get_user(user_id)
         if not current_user:
-            await update.callback_query.edit_message_text(
+            await edit_or_reply(
+                update,
                 "❌ Ваш профиль не найден. Используйте /start для создания анкеты.",
                 reply_markup=await create_main_keyboard()
             )
             return
         
-        # Определяем какие анкеты показывать
-        if current_user['role'] == 'psychologist':
-            # Психологам показываем клиентов
-            target_users = db.get_all_clients()
-        else:
-            # Клиентам показываем психологов
-            target_users = db.get_all_psychologists()
-        
-        # Исключаем уже просмотренные и лайкнутые
-        viewed = db.get_viewed_profiles(user_id)
-        user_likes = db.get_user_likes(user_id)
-        
-        available_users = [user for user in target_users 
-                          if user['user_id'] != user_id 
-                          and user['user_id'] not in viewed 
-                          and user['user_id'] not in user_likes]
-        
-        if not available_users:
+        # Психологам показываем клиентов, клиентам - психологов,
+        # исключая уже просмотренные и лайкнутые анкеты
+        target_user = await db.next_candidate(user_id, current_user['role'])
+        
+        if not target_user:
+            if current_user['role'] == 'client' and await db.get_preferences(user_id):
+                await edit_or_reply(
+                    update,
+                    "🔎 Больше нет анкет, подходящих под ваши фильтры.\n\n"
+                    "Измените или сбросьте фильтры командой /filters.",
+                    reply_markup=await create_main_keyboard()
+                )
+                return
+            
             # УЛУЧШЕННАЯ ОБРАБОТКА: нет доступных анкет
-            await update.callback_query.edit_message_text(
+            await edit_or_reply(
+                update,
                 "🎉 Вы просмотрели все анкеты!\n\n"
                 "Больше нет новых анкет для просмотра. "
                 "Вы можете сбросить список просмотренных анкет в технических функциях "
@@ -1589,78 +2547,33 @@ async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE,
             )
             return
         
-        # Берем первую доступную анкету
-        target_user = available_users[0]
-        
-        # Формируем анкету для показа
-        if current_user['role'] == 'client':  # Клиентам показываем психологов
-            profile_text = f"""
-👨‍⚕️ Анкета психолога:
-
-👤 {target_user.get('name', 'Не указано')}, {target_user.get('gender', 'Не указано')}, {target_user.get('age', 'Не указано')}
-🎓 Образование: {target_user.get('education', 'Не указано')}
-💫 О себе: {target_user.get('about_me', 'Не указано')}
-🧠 Подход: {target_user.get('approach', 'Не указано')}
-🎯 Работает с: {target_user.get('work_requests', 'Не указано')}
-💰 Стоимость: {target_user.get('price', 'Не указано')}
-            """
-        else:  # Психологам показываем клиентов
-            profile_text = f"""
-👤 Анкета клиента:
-
-👤 {target_user.get('name', 'Не указано')}, {target_user.get('gender', 'Не указано')}, {target_user.get('age', 'Не указано')}
-🎯 Запрос: {target_user.get('request', 'Не указано')}
-            """
-        
-        # Клавиатура с действиями
-        keyboard = [
-            [
-                InlineKeyboardButton("❤️ Лайк", callback_data=f"like_{target_user['user_id']}"),
-                InlineKeyboardButton("➡️ Дальше", callback_data=f"skip_{target_user['user_id']}")
-            ],
-            [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Клиентам показываем психологов, психологам - клиентов; карточка с кнопками
+        # берется из кэша, пока анкета не изменится
+        target_role = 'psychologist' if current_user['role'] == 'client' else 'client'
+        card = db.cards.candidate(target_user, target_role)
         
-        # Отправляем новое сообщение вместо редактирования
-        if target_user.get('photo_file_id'):
-            # Сначала отправляем фото как отдельное сообщение
-            await update.callback_query.message.reply_photo(
-                photo=target_user['photo_file_id']
-            )
-            # Затем отправляем текстовое сообщение с анкетой и кнопками
-            await update.callback_query.message.reply_text(
-                profile_text,
-                reply_markup=reply_markup
-            )
-        else:
-            # Если фото нет, редактируем текущее сообщение с обработкой ошибок
-            try:
-                await update.callback_query.edit_message_text(
-                    profile_text,
-                    reply_markup=reply_markup
-                )
-            except BadRequest as e:
-                if "Message is not modified" in str(e):
-                    # Игнорируем ошибку, если сообщение не изменилось
-                    await update.callback_query.answer()
-                else:
-                    raise
+        # Одно сообщение: фото с анкетой в подписи и кнопками
+        await show_profile_card(update, card)
         
         # Добавляем в просмотренные
-        db.add_viewed_profile(user_id, target_user['user_id'])
+        await db.add_viewed_profile(user_id, target_user['user_id'])
         
     except Exception as e:
         logger.error(f"Error in show_next_profile: {e}")
-        await update.callback_query.edit_message_text(
+        await edit_or_reply(
+            update,
             "Произошла ошибка при загрузке анкеты. Попробуйте еще раз.",
             reply_markup=await create_main_keyboard()
         )
 
-async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, target_id: int):
-    """Обработка лайка - ИСПРАВЛЕННАЯ ВЕРСИЯ БЕЗ ДУБЛИРОВАНИЯ"""
+async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, target_id: int,
+                       show_next: bool = True):
+    """Обработка лайка - ИСПРАВЛЕННАЯ ВЕРСИЯ БЕЗ ДУБЛИРОВАНИЯ
+    
+    show_next=False - лайк из результатов поиска, следующая анкета не показывается.
+    """
     try:
-        success, is_mutual = db.create_like(user_id, target_id)
+        success, is_mutual = await db.create_like(user_id, target_id)
         
         if not success:
             # Отправляем новое сообщение вместо редактирования
@@ -1668,66 +2581,30 @@ async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_
             return
         
         # Получаем информацию о пользователе, которого лайкнули
-        target_user = db.get_user(target_id)
+        target_user = await db.get_user(target_id)
         target_profile = None
         
         if target_user['role'] == 'psychologist':
-            target_profile = db.get_psychologist_profile(target_id)
+            target_profile = await db.get_psychologist_profile(target_id)
         else:
-            target_profile = db.get_client_profile(target_id)
+            target_profile = await db.get_client_profile(target_id)
         
         target_name = target_profile.get('name', 'пользователь') if target_profile else 'пользователь'
-        target_username = target_user.get('username')
         
         if is_mutual:
             # ВЗАИМНЫЙ ЛАЙК - отправляем уведомления ОДИН РАЗ каждому пользователю
             
             # Получаем информацию о текущем пользователе для уведомления второму
-            current_user = db.get_user(user_id)
-            current_profile = None
-            
+            current_user = await db.get_user(user_id)
             if current_user['role'] == 'psychologist':
-                current_profile = db.get_psychologist_profile(user_id)
+                current_profile = await db.get_psychologist_profile(user_id)
             else:
-                current_profile = db.get_client_profile(user_id)
+                current_profile = await db.get_client_profile(user_id)
             
-            current_name = current_profile.get('name', 'пользователь') if current_profile else 'пользователь'
-            current_username = current_user.get('username')
-
-            # Формируем сообщение для текущего пользователя
-            if target_username:
-                current_user_msg = (
-                    f"💞 У вас взаимный лайк с {target_name}!\n\n"
-                    f"👤 Username: @{target_username}\n"
-                    "💌 Можете написать друг другу и начать общение!"
-                )
-            else:
-                current_user_msg = (
-                    f"💞 У вас взаимный лайк с {target_name}!\n\n"
-                    f"👤 Имя: {target_name}\n"
-                    "❌ К сожалению, у этого пользователя не указан username.\n"
-                    "Вы можете связаться через другие контакты, если они указаны в анкете."
-                )
-
-            # Формируем сообщение для целевого пользователя
-            if current_username:
-                target_user_msg = (
-                    f"💞 У вас взаимный лайк с {current_name}!\n\n"
-                    f"👤 Username: @{current_username}\n"
-                    "💌 Можете написать друг другу и начать общение!"
-                )
-            else:
-                target_user_msg = (
-                    f"💞 У вас взаимный лайк с {current_name}!\n\n"
-                    f"👤 Имя: {current_name}\n"
-                    "❌ К сожалению, у пользователя не указан username.\n"
-                    "Вы можете связаться через другие контакты, если они указаны в анкете."
-                )
-
-            # Отправляем уведомление текущему пользователю
-            await context.bot.send_message(chat_id=user_id, text=current_user_msg)
-            # Отправляем уведомление целевому пользователю
-            await context.bot.send_message(chat_id=target_id, text=target_user_msg)
+            # Ставим в очередь уведомления текущему и целевому пользователю: каждому - карточка второго
+            for chat_id, profile in ((user_id, target_profile), (target_id, current_profile)):
+                card = db.cards.match(profile) if profile else Card("💞 У вас взаимный лайк!")
+                notifications.enqueue(chat_id=chat_id, text=card.text, entities=card.entities)
             
         else:
             # Если лайк не взаимный, просто уведомляем текущего пользователя
@@ -1738,19 +2615,61 @@ async def like_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_
             # И отправляем уведомление о лайке целевому пользователю
             await send_like_notification(context, user_id, target_id)
         
-        # Показываем следующую анкету через 1 секунду
-        import asyncio
-        await asyncio.sleep(1)
-        await show_next_profile(update, context, user_id)
+        if not show_next:
+            return
+        
+        # Показываем следующую анкету с небольшой задержкой, не занимая обработчик
+        next_profile_actions.schedule(
+            user_id, NEXT_PROFILE_DELAY,
+            lambda: show_next_profile(update, context, user_id)
+        )
         
     except Exception as e:
         logger.error(f"Error in like_profile: {e}")
         await update.callback_query.message.reply_text("Ошибка при обработке лайка")
 
-async def show_matches(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Показать мэтчи пользователя"""
+def format_like_line(like: Dict) -> str:
+    """Строка списка мэтчей или лайков: имя, username и роль"""
+    name = (like.get('name') or 'Не указано')[:64]
+    username = like.get('username')
+    role = "психолог" if like.get('role') == 'psychologist' else "клиент"
+    
+    if username:
+        return f"👤 {name} (@{username}) - {role}"
+    return f"👤 {name} (нет username) - {role}"
+
+async def create_page_keyboard(prefix: str, page: List[Dict], has_more: bool,
+                               after_id: Optional[int], before_id: Optional[int]) -> InlineKeyboardMarkup:
+    """Клавиатура страницы: кнопки листания над основной клавиатурой.
+    
+    Новые записи идут первыми, поэтому "назад" ведет к более новым, "дальше" - к более старым.
+    """
+    if before_id is not None:
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = after_id is not None, has_more
+    
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}_prev_{page[0]['id']}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"{prefix}_next_{page[-1]['id']}"))
+    
+    keyboard = await create_main_keyboard()
+    if not navigation:
+        return keyboard
+    return InlineKeyboardMarkup([navigation, *keyboard.inline_keyboard])
+
+async def show_matches(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int,
+                       after_id: Optional[int] = None, before_id: Optional[int] = None):
+    """Показать мэтчи пользователя постранично"""
     try:
-        mutual_likes = db.get_mutual_likes(user_id)
+        mutual_likes, has_more = await db.get_mutual_likes_page(user_id, after_id=after_id, before_id=before_id)
+        
+        if not mutual_likes and (after_id is not None or before_id is not None):
+            # Мэтч-курсор удален (например, после перезапуска анкеты) - начинаем сначала
+            after_id = before_id = None
+            mutual_likes, has_more = await db.get_mutual_likes_page(user_id)
         
         if not mutual_likes:
             await update.callback_query.edit_message_text(
@@ -1761,23 +2680,49 @@ async def show_matches(update: Update, context: ContextTypes.DEFAULT_TYPE, user_
             return
         
         matches_text = "💞 Ваши взаимные лайки:\n\n"
+        matches_text += "\n".join(format_like_line(match) for match in mutual_likes)
         
-        for match in mutual_likes:
-            username = match.get('username')
-            name = match.get('name', 'Не указано')
-            role = "психолог" if match.get('role') == 'psychologist' else "клиент"
-            
-            if username:
-                matches_text += f"👤 {name} (@{username}) - {role}\n"
-            else:
-                matches_text += f"👤 {name} (нет username) - {role}\n"
-        
-        await update.callback_query.edit_message_text(matches_text, reply_markup=await create_main_keyboard())
+        await update.callback_query.edit_message_text(
+            matches_text,
+            reply_markup=await create_page_keyboard("matches", mutual_likes, has_more, after_id, before_id)
+        )
         
     except Exception as e:
         logger.error(f"Error in show_matches: {e}")
         await update.callback_query.edit_message_text("Ошибка при загрузке мэтчей")
 
+async def show_likes_inbox(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int,
+                           after_id: Optional[int] = None, before_id: Optional[int] = None):
+    """Показать входящие лайки пользователя постранично"""
+    try:
+        likes, has_more = await db.get_likes_page(user_id, after_id=after_id, before_id=before_id)
+        
+        if not likes and (after_id is not None or before_id is not None):
+            after_id = before_id = None
+            likes, has_more = await db.get_likes_page(user_id)
+        
+        if not likes:
+            await update.callback_query.edit_message_text(
+                "Вас пока никто не лайкнул 😔\n\n"
+                "Заполненная анкета привлекает больше внимания!",
+                reply_markup=await create_main_keyboard()
+            )
+            return
+        
+        likes_text = "📥 Вас лайкнули:\n\n"
+        likes_text += "\n".join(
+            format_like_line(like) + (" 💞" if like.get('is_mutual') else "") for like in likes
+        )
+        
+        await update.callback_query.edit_message_text(
+            likes_text,
+            reply_markup=await create_page_keyboard("inbox", likes, has_more, after_id, before_id)
+        )
+        
+    except Exception as e:
+        logger.error(f"Error in show_likes_inbox: {e}")
+        await update.callback_query.edit_message_text("Ошибка при загрузке лайков")
+
 # ========== ОБЩИЕ ФУНКЦИИ ==========
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1792,44 +2737,23 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать профиль пользователя"""
     try:
         user_id = update.message.from_user.id
-        user_data = db.get_user(user_id)
+        user_data = await db.get_user(user_id)
         
         if not user_data:
             await update.message.reply_text('У вас нет заполненного профиля. Используйте /start')
             return
         
         if user_data['role'] == 'psychologist':
-            profile = db.get_psychologist_profile(user_id)
-            if profile:
-                text = f"""
-👨‍⚕️ Ваш профиль психолога:
-
-👤 Имя: {profile.get('name', 'Не указано')}
-🎂 Возраст: {profile.get('age', 'Не указано')}
-🧠 Подход: {profile.get('approach', 'Не указано')}
-💰 Стоимость: {profile.get('price', 'Не указано')}
-                """
-                
-                if profile.get('photo_file_id'):
-                    await update.message.reply_photo(
-                        photo=profile['photo_file_id']
-                    )
-            else:
-                text = "Профиль психолога не найден"
+            profile = await db.get_psychologist_profile(user_id)
+            title, missing = "👨‍⚕️ Ваш профиль психолога:", "Профиль психолога не найден"
         else:
-            profile = db.get_client_profile(user_id)
-            if profile:
-                text = f"""
-👤 Ваш профиль клиента:
-
-👤 Имя: {profile.get('name', 'Не указано')}
-🎂 Возраст: {profile.get('age', 'Не указано')}
-🎯 Запрос: {profile.get('request', 'Не указано')}
-                """
-            else:
-                text = "Профиль клиента не найден"
+            profile = await db.get_client_profile(user_id)
+            title, missing = "👤 Ваш профиль клиента:", "Профиль клиента не найден"
         
-        await update.message.reply_text(text)
+        if not profile:
+            await update.message.reply_text(missing)
+            return
+        await reply_profile_card(update.message, db.cards.own(profile, user_data['role'], title))
             
     except Exception as e:
         logger.error(f"Error in show_profile: {e}")
@@ -1838,7 +2762,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать общую статистику"""
     try:
-        stats = db.get_statistics()
+        stats = await db.get_statistics()
         stats_text = f"""
 📈 Общая статистика бота:
 
@@ -1853,120 +2777,385 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Ошибка при загрузке статистики")
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда для поиска анкет"""
-    await show_main_menu(update, context, "🔍 Начните просмотр анкет:")
+    """Поиск психологов по тексту анкет: /search <запрос>"""
+    if not context.args:
+        await show_main_menu(
+            update, context,
+            "🔍 Поиск психологов по подходу и запросам:\n"
+            "/search КПТ тревога\n\n"
+            "Или начните просмотр анкет:"
+        )
+        return
+    
+    context.user_data['search_query'] = ' '.join(context.args)[:200]
+    await show_search_results(update, context, update.message.from_user.id)
+
+async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, page: int = 0):
+    """Страница результатов поиска по запросу из user_data"""
+    query = update.callback_query
+    
+    async def reply(text: str, reply_markup: InlineKeyboardMarkup):
+        if query:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup)
+    
+    try:
+        current_user = await db.get_user(user_id)
+        if not current_user:
+            await reply("❌ Ваш профиль не найден. Используйте /start для создания анкеты.",
+                        await create_main_keyboard())
+            return
+        if current_user['role'] != 'client':
+            await reply("🔍 Поиск психологов доступен только клиентам", await create_main_keyboard())
+            return
+        
+        search_query = context.user_data.get('search_query')
+        if not search_query:
+            await reply("Запрос устарел. Повторите поиск: /search <запрос>", await create_main_keyboard())
+            return
+        
+        results, has_more = await db.search_psychologists(
+            search_query, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE
+        )
+        if not results:
+            await reply(
+                f"По запросу «{search_query}» ничего не найдено 😔\n\n"
+                "Попробуйте другие слова, например подход или тему запроса.",
+                await create_main_keyboard()
+            )
+            return
+        
+        lines = [f"🔍 Результаты по запросу «{search_query}»:\n"]
+        keyboard = []
+        for number, result in enumerate(results, start=page * SEARCH_PAGE_SIZE + 1):
+            name = (result.get('name') or 'Не указано')[:64]
+            lines.append(
+                f"{number}. 👤 {name}, {result.get('age') or 'Не указано'}\n"
+                f"🧠 {result.get('approach') or 'Не указано'}\n"
+                f"💰 {result.get('price') or 'Не указано'}\n"
+                f"💬 {result.get('snippet') or ''}\n"
+            )
+            keyboard.append([InlineKeyboardButton(f"❤️ {name}", callback_data=f"search_like_{result['user_id']}")])
+        
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page_{page - 1}"))
+        if has_more:
+            navigation.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"search_page_{page + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")])
+        
+        await reply("\n".join(lines), InlineKeyboardMarkup(keyboard))
+        
+    except Exception as e:
+        logger.error(f"Error in show_search_results: {e}")
+        await reply("Ошибка при поиске анкет", await create_main_keyboard())
+
+async def cancel_delayed_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Любой новый апдейт пользователя отменяет запланированный показ следующей анкеты,
+    иначе она показалась бы вдобавок к ответу на этот апдейт"""
+    if update.effective_user:
+        next_profile_actions.cancel(update.effective_user.id)
+
+async def restore_conversations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подгружает сохраненные состояния диалогов пользователя до того, как их проверит ConversationHandler"""
+    persistence = context.application.persistence
+    if update.effective_user and isinstance(persistence, SQLitePersistence):
+        await persistence.refresh_conversations(context.application, update.effective_user.id)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ошибок"""
     logger.error(f"Exception while handling an update: {context.error}")
 
+async def on_startup(application: Application):
+    """Запуск фоновых служб после инициализации бота"""
+    notifications.start(application.bot)
+    await db.load_ranking_index()
+    if metrics.enabled:
+        metrics.gauge('psymatch_cache_hits', 'Попадания в кэш пользователей и анкет', lambda: db.cache.hits)
+        metrics.gauge('psymatch_cache_misses', 'Промахи кэша пользователей и анкет', lambda: db.cache.misses)
+        metrics.gauge('psymatch_card_cache_hits', 'Попадания в кэш карточек анкет', lambda: db.cards.hits)
+        metrics.gauge('psymatch_card_cache_misses', 'Промахи кэша карточек анкет', lambda: db.cards.misses)
+        metrics.gauge('psymatch_notify_queue_size', 'Уведомлений в очереди',
+                      lambda: notifications._queue.qsize() if notifications._queue else 0)
+        await metrics.start_server()
+
+async def on_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    await metrics.stop_server()
+    await next_profile_actions.shutdown()
+    await notifications.stop()
+    db.close()
+    logger.info("Database closed")
+
+# ========== ОБРАБОТКА АПДЕЙТОВ ==========
+
+class PendingUpdateQueue(asyncio.Queue):
+    """Очередь апдейтов Application, ограниченная числом необработанных апдейтов.
+    
+    Application забирает апдейт из очереди сразу и создает под него задачу,
+    поэтому maxsize обычной очереди почти никогда не достигается. Здесь апдейт
+    занимает место до task_done(), который Application вызывает после обработки:
+    put() ждет, пока обработанных станет достаточно. Апдейты не отбрасываются -
+    пока очередь полна, polling не забирает новые, и они ждут на стороне Telegram.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_UPDATES):
+        super().__init__()
+        self.max_pending = max_pending
+        self.pending = 0
+        self._has_room = asyncio.Event()
+
+    async def put(self, item):
+        while self.pending >= self.max_pending:
+            self._has_room.clear()
+            await self._has_room.wait()
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        if self.pending >= self.max_pending:
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+        self.pending += 1
+
+    def task_done(self):
+        super().task_done()
+        self.pending -= 1
+        self._has_room.set()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных пользователей.
+    
+    Апдейты одного пользователя обрабатываются строго по очереди, поэтому
+    состояния ConversationHandler и context.user_data остаются согласованными.
+    Одновременно выполняется не больше max_concurrent_updates обработчиков.
+    Общее число принятых апдейтов ограничивает PendingUpdateQueue.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user_id -> [блокировка, число апдейтов, ожидающих или держащих ее]
+        self._user_locks: Dict[int, list] = {}
+
+    @property
+    def pending(self) -> int:
+        """Апдейты пользователей, которые обрабатываются или ждут своей очереди"""
+        return sum(entry[1] for entry in self._user_locks.values())
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable):
+        # Без общего семафора BaseUpdateProcessor: апдейты, ждущие своего пользователя,
+        # не должны занимать места обработчиков других пользователей
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+        
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def add_handlers(app: Application):
+    """Регистрирует все обработчики бота в приложении"""
+    # Добавляем обработчики ошибок
+    app.add_error_handler(error_handler)
+    
+    # Основной ConversationHandler для создания анкеты
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            # Общее состояние выбора роли
+            ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, role_choice)],
+            
+            # Состояния для психолога
+            PSY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_name)],
+            PSY_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_gender)],
+            PSY_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_age)],
+            PSY_EDUCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_education)],
+            PSY_ABOUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_about)],
+            PSY_APPROACH: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_approach)],
+            PSY_REQUESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_requests)],
+            PSY_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_price)],
+            PSY_PHOTO: [
+                MessageHandler(filters.PHOTO, psy_photo),
+                CommandHandler('skip', psy_skip_photo)
+            ],
+            
+            # Состояния для клиента
+            CLIENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_name)],
+            CLIENT_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_gender)],
+            CLIENT_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_age)],
+            CLIENT_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_request)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='registration',
+        persistent=True
+    )
+    
+    # ConversationHandler для редактирования анкеты
+    edit_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('edit', edit_command)],
+        states={
+            EDIT_CHOICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_choice)],
+            
+            # Редактирование для психолога
+            EDIT_PSY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_name)],
+            EDIT_PSY_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_gender)],
+            EDIT_PSY_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_age)],
+            EDIT_PSY_EDUCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_education)],
+            EDIT_PSY_ABOUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_about)],
+            EDIT_PSY_APPROACH: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_approach)],
+            EDIT_PSY_REQUESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_requests)],
+            EDIT_PSY_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_price)],
+            EDIT_PSY_PHOTO: [
+                MessageHandler(filters.PHOTO, edit_psy_photo),
+                CommandHandler('skip', edit_psy_photo)
+            ],
+            
+            # Редактирование для клиента
+            EDIT_CLIENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_name)],
+            EDIT_CLIENT_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_gender)],
+            EDIT_CLIENT_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_age)],
+            EDIT_CLIENT_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_request)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='edit_profile',
+        persistent=True
+    )
+    
+    # ConversationHandler для фильтров просмотра
+    filters_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('filters', filters_command)],
+        states={
+            FILTER_CHOICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_choice)],
+            FILTER_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_gender)],
+            FILTER_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_age)],
+            FILTER_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_price)],
+            FILTER_APPROACH: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_approach)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='filters',
+        persistent=True
+    )
+    
+    # Добавляем все обработчики
+    app.add_handler(TypeHandler(Update, restore_conversations), group=-2)
+    app.add_handler(TypeHandler(Update, cancel_delayed_actions), group=-1)
+    app.add_handler(conv_handler)
+    app.add_handler(edit_conv_handler)
+    app.add_handler(filters_conv_handler)
+    app.add_handler(CommandHandler('profile', show_profile))
+    app.add_handler(CommandHandler('stats', stats_command))
+    app.add_handler(CommandHandler('search', search_command))
+    app.add_handler(CommandHandler('restart', restart_command))
+    app.add_handler(CommandHandler('help', help_command))
+    app.add_handler(CallbackQueryHandler(button_handler))
+
 def main():
+    """Запускает бота и перезапускает его через 10 секунд после сбоя"""
+    global db
+    while not run_bot():
+        time.sleep(10)
+        # on_shutdown закрывает базу, поэтому перед перезапуском открываем ее заново
+        if db.closed:
+            db = AsyncDatabase(Database())
+
+def run_bot() -> bool:
+    """Один запуск бота; False, если бот упал и его нужно перезапустить"""
     try:
         # Проверяем токен
         if not BOT_TOKEN:
             print("❌ ОШИБКА: BOT_TOKEN не найден!")
             print("💡 Решение: Добавьте BOT_TOKEN в Secrets Replit")
             print("🔄 Перезапуск через 10 секунд...")
-            import time
-            time.sleep(10)
-            main()
-            return
+            return False
         
         # Создаем приложение
-        app = Application.builder().token(BOT_TOKEN).build()
-        
-        # Добавляем обработчики ошибок
-        app.add_error_handler(error_handler)
-        
-        # Основной ConversationHandler для создания анкеты
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
-            states={
-                # Общее состояние выбора роли
-                ROLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, role_choice)],
-                
-                # Состояния для психолога
-                PSY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_name)],
-                PSY_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_gender)],
-                PSY_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_age)],
-                PSY_EDUCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_education)],
-                PSY_ABOUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_about)],
-                PSY_APPROACH: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_approach)],
-                PSY_REQUESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_requests)],
-                PSY_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, psy_price)],
-                PSY_PHOTO: [
-                    MessageHandler(filters.PHOTO, psy_photo),
-                    CommandHandler('skip', psy_skip_photo)
-                ],
-                
-                # Состояния для клиента
-                CLIENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_name)],
-                CLIENT_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_gender)],
-                CLIENT_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_age)],
-                CLIENT_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, client_request)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel)]
-        )
-        
-        # ConversationHandler для редактирования анкеты
-        edit_conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('edit', edit_command)],
-            states={
-                EDIT_CHOICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_choice)],
-                
-                # Редактирование для психолога
-                EDIT_PSY_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_name)],
-                EDIT_PSY_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_gender)],
-                EDIT_PSY_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_age)],
-                EDIT_PSY_EDUCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_education)],
-                EDIT_PSY_ABOUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_about)],
-                EDIT_PSY_APPROACH: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_approach)],
-                EDIT_PSY_REQUESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_requests)],
-                EDIT_PSY_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_psy_price)],
-                EDIT_PSY_PHOTO: [
-                    MessageHandler(filters.PHOTO, edit_psy_photo),
-                    CommandHandler('skip', edit_psy_photo)
-                ],
-                
-                # Редактирование для клиента
-                EDIT_CLIENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_name)],
-                EDIT_CLIENT_GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_gender)],
-                EDIT_CLIENT_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_age)],
-                EDIT_CLIENT_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_client_request)],
-            },
-            fallbacks=[CommandHandler('cancel', cancel)]
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .update_queue(PendingUpdateQueue(MAX_PENDING_UPDATES))
+            .persistence(SQLitePersistence(db))
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
         )
+        if metrics.enabled:
+            # Размер пула как у запроса по умолчанию в ApplicationBuilder
+            builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+        if CONCURRENT_UPDATES > 1:
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        app = builder.build()
         
-        # Добавляем все обработчики
-        app.add_handler(conv_handler)
-        app.add_handler(edit_conv_handler)
-        app.add_handler(CommandHandler('profile', show_profile))
-        app.add_handler(CommandHandler('stats', stats_command))
-        app.add_handler(CommandHandler('search', search_command))
-        app.add_handler(CommandHandler('restart', restart_command))
-        app.add_handler(CommandHandler('help', help_command))
-        app.add_handler(CallbackQueryHandler(button_handler))
+        add_handlers(app)
         
         print("=" * 50)
         print("🤖 Бот запускается на Replit...")
         print("📞 Токен:", "✅ Установлен" if BOT_TOKEN else "❌ Отсутствует")
         print("🕒 Время:", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        print("📡 Режим:", BOT_MODE)
         print("=" * 50)
         
         # Запускаем бота
-        app.run_polling(
-            poll_interval=3,
-            drop_pending_updates=True,
-            timeout=60
-        )
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL:
+                raise ValueError("WEBHOOK_URL не задан для режима webhook")
+            if not WEBHOOK_SECRET:
+                logger.warning("WEBHOOK_SECRET не задан: запросы к вебхуку не проверяются")
+            
+            # Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token,
+            # запросы без него отклоняются с кодом 403
+            app.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=True
+            )
+        else:
+            app.run_polling(
+                poll_interval=POLL_INTERVAL,
+                drop_pending_updates=True,
+                timeout=60
+            )
+        return True
         
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
         print(f"🔴 Критическая ошибка: {e}")
         print("🔄 Перезапуск через 10 секунд...")
-        import time
-        time.sleep(10)
-        main()  # Рекурсивный перезапуск
+        return False
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,1335 @@
+"""Хранилище psymatch на SQLite: схема, миграции и синхронный доступ к данным.
+
+Модуль не зависит от Telegram и при импорте ничего не открывает и не запускает,
+поэтому его используют и бот, и утилиты вроде psymatch_io.py.
+"""
+import os
+import re
+import logging
+import sqlite3
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple, Iterable, Iterator
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Настройки базы данных
+DB_PATH = os.environ.get('DB_PATH', 'psymatch.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL')
+DB_CACHE_SIZE = int(os.environ.get('DB_CACHE_SIZE', '-16000'))  # отрицательное значение - в КиБ
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', '5000'))  # мс
+
+# Отложенная запись просмотров и активности
+WRITE_BEHIND_INTERVAL_MS = int(os.environ.get('WRITE_BEHIND_INTERVAL_MS', '500'))
+WRITE_BEHIND_MAX_ROWS = int(os.environ.get('WRITE_BEHIND_MAX_ROWS', '500'))
+
+# Размер страницы в списках мэтчей и входящих лайков
+LIKES_PAGE_SIZE = int(os.environ.get('LIKES_PAGE_SIZE', '20'))
+
+# Сколько лучших результатов полнотекстового поиска можно пролистать
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '100'))
+
+# ========== АТРИБУТЫ АНКЕТ ==========
+
+# Пол хранится кодом, подписи нужны только для показа и клавиатуры
+GENDER_LABELS = {'male': '👨 Мужской', 'female': '👩 Женский'}
+MIN_AGE, MAX_AGE = 14, 100
+# Число и следующая за ним единица: множитель ("2,5к", "5 тыс") или длительность ("50 мин").
+# Пробел считается разделителем разрядов только в записи вида "3 000" или "12 000 000",
+# поэтому "2000 3000" - это два числа
+PRICE_PATTERN = re.compile(
+    r'((?:\d{1,3}(?:[ \u00a0]\d{3})+(?!\d)|\d+)(?:[.,]\d+)?)\s*(тыс|к(?![а-я])|k(?![a-z])|мин|час|ч(?![а-я]))?'
+)
+PRICE_MULTIPLIERS = ('тыс', 'к', 'k')
+
+def parse_gender(value: Optional[str]) -> Optional[str]:
+    """Код пола по подписи кнопки или ответу текстом: 👩 Женский, жен, ж -> female"""
+    text = str(value or '').strip().lower()
+    if text in GENDER_LABELS:
+        return text
+    if 'жен' in text or text in ('ж', 'f'):
+        return 'female'
+    if 'муж' in text or text in ('м', 'm'):
+        return 'male'
+    return None
+
+def gender_label(gender: Optional[str]) -> str:
+    return GENDER_LABELS.get(gender, 'Не указано')
+
+def parse_age(value) -> Optional[int]:
+    """Возраст в годах из ответа вида "35" или "35 лет"; None, если его нет или он вне MIN_AGE..MAX_AGE"""
+    if isinstance(value, int):
+        age = value
+    else:
+        match = re.search(r'\d+', str(value or ''))
+        if not match:
+            return None
+        age = int(match.group())
+    return age if MIN_AGE <= age <= MAX_AGE else None
+
+def parse_age_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Диапазон возраста: "30-45" -> (30, 45), "от 30" -> (30, None), "до 45" -> (None, 45)"""
+    text = str(value or '').lower()
+    ages = [int(age) for age in re.findall(r'\d+', text)]
+    if len(ages) >= 2:
+        return min(ages[:2]), max(ages[:2])
+    if len(ages) == 1:
+        if re.search(r'\bдо\b', text):
+            return None, ages[0]
+        if re.search(r'\bот\b', text):
+            return ages[0], None
+        return ages[0], ages[0]
+    return None, None
+
+def parse_price(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Самая низкая и самая высокая из названных цен сессии в рублях.
+    
+    "2000-3000 руб./сессия" -> (2000, 3000), "от 2500" -> (2500, None),
+    "до 3000" -> (None, 3000), "3000" -> (3000, 3000). Длительность
+    ("50 минут", "1,5 часа") и числа меньше 100 ценой не считаются,
+    без цен - (None, None).
+    """
+    text = str(value or '').lower()
+    matches = [match for match in PRICE_PATTERN.finditer(text)
+               if match.group(2) is None or match.group(2) in PRICE_MULTIPLIERS]
+    # Множитель относится ко всем числам: "3-5 тыс" -> 3000 и 5000
+    thousands = any(match.group(2) for match in matches)
+    prices = []
+    for match in matches:
+        price = float(re.sub(r'[ \u00a0]', '', match.group(1)).replace(',', '.'))
+        if thousands and price < 1000:
+            price *= 1000
+        price = int(price)
+        if price >= 100:
+            prices.append((match.start(), price))
+    
+    if not prices:
+        return None, None
+    if len(prices) == 1:
+        start, price = prices[0]
+        if re.search(r'\bот\s*$', text[:start]):
+            return price, None
+        if re.search(r'\bдо\s*$', text[:start]):
+            return None, price
+        return price, price
+    values = [price for _, price in prices]
+    return min(values), max(values)
+
+# ========== МИГРАЦИИ СХЕМЫ ==========
+
+def _execute_script(cursor: sqlite3.Cursor, script: str):
+    """Выполняет несколько SQL-выражений по одному.
+    
+    В отличие от executescript не делает COMMIT, поэтому скрипт выполняется
+    внутри текущей транзакции миграции.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            cursor.execute(statement)
+            statement = ''
+    if statement.strip():
+        cursor.execute(statement)
+
+def _migration_initial_schema(cursor: sqlite3.Cursor):
+    """Основные таблицы"""
+    # Таблица пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            role TEXT NOT NULL,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Таблица профилей психологов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS psychologist_profiles (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            gender TEXT,
+            age INTEGER,
+            education TEXT,
+            about_me TEXT,
+            approach TEXT,
+            work_requests TEXT,
+            price TEXT,
+            photo_file_id TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # Таблица профилей клиентов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_profiles (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            gender TEXT,
+            age INTEGER,
+            request TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # Таблица лайков
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS likes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER NOT NULL,
+            to_user_id INTEGER NOT NULL,
+            liked_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_mutual INTEGER DEFAULT 0,
+            UNIQUE(from_user_id, to_user_id),
+            FOREIGN KEY (from_user_id) REFERENCES users(user_id),
+            FOREIGN KEY (to_user_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # Таблица просмотренных профилей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profiles_viewed (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            viewed_user_id INTEGER NOT NULL,
+            viewed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, viewed_user_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (viewed_user_id) REFERENCES users(user_id)
+        )
+    ''')
+
+def backfill_stats_counters(cursor: sqlite3.Cursor):
+    """Пересчитывает счетчики статистики по таблицам"""
+    cursor.execute('''
+        INSERT OR REPLACE INTO stats_counters (name, value)
+        SELECT 'users_psychologist', COUNT(*) FROM users WHERE role = 'psychologist'
+        UNION ALL SELECT 'users_client', COUNT(*) FROM users WHERE role = 'client'
+        UNION ALL SELECT 'likes_total', COUNT(*) FROM likes
+        UNION ALL SELECT 'matches', COUNT(*) FROM likes
+                  WHERE is_mutual = 1 AND from_user_id < to_user_id
+    ''')
+
+def _migration_stats_counters(cursor: sqlite3.Cursor):
+    """Индекс выбора анкет и счетчики статистики с триггерами"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, user_id)')
+    
+    # Счетчики общей статистики, поддерживаются триггерами. Взаимная пара -
+    # это два лайка, совпадение считаем по одному из них (from_user_id < to_user_id)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _execute_script(cursor, '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_' || NEW.role;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users_' || OLD.role;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_update AFTER UPDATE OF role ON users
+        WHEN OLD.role IS NOT NEW.role
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users_' || OLD.role;
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users_' || NEW.role;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_insert AFTER INSERT ON likes
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'likes_total';
+            UPDATE stats_counters SET value = value + 1
+            WHERE name = 'matches' AND NEW.is_mutual = 1 AND NEW.from_user_id < NEW.to_user_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_delete AFTER DELETE ON likes
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'likes_total';
+            UPDATE stats_counters SET value = value - 1
+            WHERE name = 'matches' AND OLD.is_mutual = 1 AND OLD.from_user_id < OLD.to_user_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_likes_stats_update AFTER UPDATE OF is_mutual ON likes
+        WHEN (OLD.is_mutual = 1) IS NOT (NEW.is_mutual = 1) AND NEW.from_user_id < NEW.to_user_id
+        BEGIN
+            UPDATE stats_counters
+            SET value = value + CASE WHEN NEW.is_mutual = 1 THEN 1 ELSE -1 END
+            WHERE name = 'matches';
+        END;
+    ''')
+    
+    # Первичное заполнение счетчиков после создания триггеров: записи,
+    # сделанные между этими шагами, попадут в COUNT и не будут учтены дважды
+    backfill_stats_counters(cursor)
+
+def _migration_lookup_indexes(cursor: sqlite3.Cursor):
+    """Индексы для входящих лайков и удаления просмотров"""
+    _execute_script(cursor, '''
+        CREATE INDEX IF NOT EXISTS idx_likes_to_user ON likes(to_user_id, liked_date);
+        CREATE INDEX IF NOT EXISTS idx_profiles_viewed_viewed_user ON profiles_viewed(viewed_user_id);
+    ''')
+
+def _migration_persistence(cursor: sqlite3.Cursor):
+    """Таблицы для состояний диалогов и user_data"""
+    _execute_script(cursor, '''
+        CREATE TABLE IF NOT EXISTS persistence_conversations (
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (user_id, name, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS persistence_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    ''')
+
+def backfill_matches(cursor: sqlite3.Cursor):
+    """Заполняет matches по взаимным лайкам; временем мэтча считается второй лайк пары"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO matches (min_id, max_id, matched_at)
+        SELECT l1.from_user_id, l1.to_user_id, MAX(l1.liked_date, l2.liked_date) AS matched_at
+        FROM likes l1
+        JOIN likes l2 ON l2.from_user_id = l1.to_user_id AND l2.to_user_id = l1.from_user_id
+        WHERE l1.from_user_id < l1.to_user_id AND l1.is_mutual = 1
+        ORDER BY matched_at
+    ''')
+
+def _migration_matches(cursor: sqlite3.Cursor):
+    """Таблица мэтчей с канонической парой (min_id, max_id)"""
+    _execute_script(cursor, '''
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(min_id, max_id),
+            CHECK (min_id < max_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_matches_min ON matches(min_id, matched_at);
+        CREATE INDEX IF NOT EXISTS idx_matches_max ON matches(max_id, matched_at);
+    ''')
+    
+    backfill_matches(cursor)
+
+def rebuild_profile_search(cursor: sqlite3.Cursor):
+    """Строит полнотекстовый индекс заново по текущим анкетам психологов"""
+    cursor.execute("INSERT INTO psychologist_search (psychologist_search) VALUES ('rebuild')")
+
+def _migration_profile_search(cursor: sqlite3.Cursor):
+    """Полнотекстовый индекс FTS5 по анкетам психологов"""
+    # Таблица с внешним содержимым: текст хранится только в psychologist_profiles,
+    # FTS5 держит инвертированный индекс. Поиск идет по префиксам основ слов
+    # (см. build_search_query), поэтому индексы префиксов ускоряют такие запросы
+    _execute_script(cursor, '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS psychologist_search USING fts5(
+            about_me, approach, work_requests, education,
+            content = 'psychologist_profiles', content_rowid = 'user_id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '3 4 5'
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_psychologist_search_insert AFTER INSERT ON psychologist_profiles
+        BEGIN
+            INSERT INTO psychologist_search (rowid, about_me, approach, work_requests, education)
+            VALUES (NEW.user_id, NEW.about_me, NEW.approach, NEW.work_requests, NEW.education);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_psychologist_search_delete AFTER DELETE ON psychologist_profiles
+        BEGIN
+            INSERT INTO psychologist_search (psychologist_search, rowid, about_me, approach, work_requests, education)
+            VALUES ('delete', OLD.user_id, OLD.about_me, OLD.approach, OLD.work_requests, OLD.education);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_psychologist_search_update AFTER UPDATE ON psychologist_profiles
+        BEGIN
+            INSERT INTO psychologist_search (psychologist_search, rowid, about_me, approach, work_requests, education)
+            VALUES ('delete', OLD.user_id, OLD.about_me, OLD.approach, OLD.work_requests, OLD.education);
+            INSERT INTO psychologist_search (rowid, about_me, approach, work_requests, education)
+            VALUES (NEW.user_id, NEW.about_me, NEW.approach, NEW.work_requests, NEW.education);
+        END;
+    ''')
+    
+    # Подход и запросы важнее для поиска, чем образование
+    cursor.execute('''
+        INSERT INTO psychologist_search (psychologist_search, rank)
+        VALUES ('rank', 'bm25(1.0, 2.0, 2.0, 0.5)')
+    ''')
+    rebuild_profile_search(cursor)
+
+def _select_chunks(cursor: sqlite3.Cursor, query: str, chunk: int) -> Iterator[List[sqlite3.Row]]:
+    """Строки query порциями по возрастанию user_id; query принимает параметры :after и :limit"""
+    after = -(1 << 63)
+    while True:
+        cursor.execute(query, {'after': after, 'limit': chunk})
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        after = rows[-1]['user_id']
+        yield rows
+
+def backfill_profile_attributes(cursor: sqlite3.Cursor, chunk: int = 1000):
+    """Приводит пол и возраст анкет к кодам и числам и заполняет диапазон цен по тексту стоимости.
+    
+    Читаются только анкеты, где есть что приводить, порциями по chunk строк,
+    поэтому память не зависит от числа анкет, а на уже приведенной базе
+    (повторный импорт) ничего не перезаписывается.
+    """
+    untyped = '''
+        (gender IS NOT NULL AND gender NOT IN ('male', 'female'))
+        OR (age IS NOT NULL AND typeof(age) != 'integer')
+    '''
+    for rows in _select_chunks(cursor, f'''
+        SELECT user_id, gender, age, price FROM psychologist_profiles
+        WHERE user_id > :after
+          AND ({untyped} OR (price_min IS NULL AND price_max IS NULL AND price != ''))
+        ORDER BY user_id
+        LIMIT :limit
+    ''', chunk):
+        cursor.executemany('''
+            UPDATE psychologist_profiles SET gender = ?, age = ?, price_min = ?, price_max = ?
+            WHERE user_id = ?
+        ''', [(parse_gender(row['gender']), parse_age(row['age']), *parse_price(row['price']), row['user_id'])
+              for row in rows])
+    
+    for rows in _select_chunks(cursor, f'''
+        SELECT user_id, gender, age FROM client_profiles
+        WHERE user_id > :after AND ({untyped})
+        ORDER BY user_id
+        LIMIT :limit
+    ''', chunk):
+        cursor.executemany('UPDATE client_profiles SET gender = ?, age = ? WHERE user_id = ?',
+                           [(parse_gender(row['gender']), parse_age(row['age']), row['user_id'])
+                            for row in rows])
+
+def _migration_typed_attributes(cursor: sqlite3.Cursor):
+    """Пол кодом, возраст числом, диапазон цен и индексы для фильтров по ним"""
+    # Поисковый индекс обновляется только при изменении проиндексированного текста
+    _execute_script(cursor, '''
+        DROP TRIGGER IF EXISTS trg_psychologist_search_update;
+        CREATE TRIGGER trg_psychologist_search_update
+        AFTER UPDATE OF about_me, approach, work_requests, education ON psychologist_profiles
+        BEGIN
+            INSERT INTO psychologist_search (psychologist_search, rowid, about_me, approach, work_requests, education)
+            VALUES ('delete', OLD.user_id, OLD.about_me, OLD.approach, OLD.work_requests, OLD.education);
+            INSERT INTO psychologist_search (rowid, about_me, approach, work_requests, education)
+            VALUES (NEW.user_id, NEW.about_me, NEW.approach, NEW.work_requests, NEW.education);
+        END;
+        ALTER TABLE psychologist_profiles ADD COLUMN price_min INTEGER;
+        ALTER TABLE psychologist_profiles ADD COLUMN price_max INTEGER;
+    ''')
+    
+    backfill_profile_attributes(cursor)
+    
+    # "женщина, 30-45, до 3000 ₽": равенство по полу и диапазон по возрасту,
+    # цена проверяется по тому же индексу без чтения строк таблицы. Ценой для
+    # фильтра служит самая низкая известная цена: у "до 3000" это 3000
+    _execute_script(cursor, '''
+        CREATE INDEX IF NOT EXISTS idx_psychologist_profiles_gender_age
+        ON psychologist_profiles(gender, age, COALESCE(price_min, price_max));
+        CREATE INDEX IF NOT EXISTS idx_psychologist_profiles_price
+        ON psychologist_profiles(COALESCE(price_min, price_max), age);
+        CREATE INDEX IF NOT EXISTS idx_client_profiles_gender_age
+        ON client_profiles(gender, age);
+    ''')
+
+def _migration_user_preferences(cursor: sqlite3.Cursor):
+    """Сохраненные фильтры просмотра анкет"""
+    _execute_script(cursor, '''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id INTEGER PRIMARY KEY,
+            gender TEXT,
+            age_min INTEGER,
+            age_max INTEGER,
+            price_max INTEGER,
+            approach TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_psychologist_profiles_age
+        ON psychologist_profiles(age, COALESCE(price_min, price_max));
+    ''')
+
+def _migration_profile_versions(cursor: sqlite3.Cursor):
+    """Версия анкеты для кэша отрисованных карточек"""
+    _execute_script(cursor, '''
+        ALTER TABLE psychologist_profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE client_profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    ''')
+
+# Версия схемы хранится в PRAGMA user_version: миграция с номером N (с единицы)
+# применяется, если версия базы меньше N. Новые миграции добавляются только в конец.
+MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_stats_counters,
+    _migration_lookup_indexes,
+    _migration_persistence,
+    _migration_matches,
+    _migration_profile_search,
+    _migration_typed_attributes,
+    _migration_user_preferences,
+    _migration_profile_versions,
+]
+
+# ========== ОСНОВЫ СЛОВ ==========
+
+STOP_WORDS = {
+    'для', 'что', 'как', 'или', 'это', 'при', 'без', 'под', 'над', 'все', 'так', 'его', 'она', 'они',
+    'мне', 'меня', 'мой', 'моя', 'мои', 'свой', 'быть', 'есть', 'очень', 'хочу', 'другое', 'работаю',
+}
+# Окончания, которые отрезаются перед усечением слова до основы, по длине
+WORD_ENDINGS = {
+    4: {'ость', 'ости'},
+    3: {'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях', 'ией'},
+    2: {'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей', 'ий', 'ый', 'ом', 'ем', 'ах', 'ях', 'ов', 'ев', 'ам', 'ям'},
+    1: {'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'},
+}
+STEM_LENGTH = 5
+
+def stem_word(word: str) -> str:
+    """Грубая основа русского слова: тревога, тревожность -> трево"""
+    for length, endings in WORD_ENDINGS.items():
+        if len(word) - length >= 4 and word[-length:] in endings:
+            word = word[:-length]
+            break
+    return word[:STEM_LENGTH]
+
+def tokenize(text: Optional[str]) -> set:
+    """Множество основ слов текста без стоп-слов и коротких слов"""
+    if not text:
+        return set()
+    words = re.findall(r'[а-яёa-z0-9]+', text.lower().replace('ё', 'е'))
+    return {stem_word(word) for word in words if len(word) >= 3 and word not in STOP_WORDS}
+
+def build_search_query(stems: Iterable[str]) -> str:
+    """Запрос FTS5 по основам слов (см. tokenize): любая из основ как префикс.
+    
+    unicode61 не знает русской морфологии, поэтому "тревожность" ищется как
+    префикс "трево*" и находит "тревога" и "тревожный". Кавычки экранируют
+    основу, так что синтаксис FTS5 из текста пользователя не интерпретируется.
+    """
+    return ' OR '.join(f'"{stem}"*' for stem in stems)
+
+# ========== БАЗА ДАННЫХ SQLite ==========
+
+class Database:
+    def __init__(self, db_path: str = DB_PATH, pool_size: int = DB_POOL_SIZE,
+                 synchronous: str = DB_SYNCHRONOUS, cache_size: int = DB_CACHE_SIZE,
+                 mmap_size: int = DB_MMAP_SIZE, busy_timeout: int = DB_BUSY_TIMEOUT,
+                 write_behind_interval_ms: int = WRITE_BEHIND_INTERVAL_MS,
+                 write_behind_max_rows: int = WRITE_BEHIND_MAX_ROWS):
+        if synchronous.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f"Unknown synchronous mode: {synchronous}")
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.synchronous = synchronous.upper()
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        
+        # Пул долгоживущих соединений
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pool_lock = threading.Lock()
+        self._created_connections = 0
+        self._closed = False
+        
+        # Буфер отложенной записи: просмотры анкет и время последней активности
+        self.write_behind_interval_ms = write_behind_interval_ms
+        self.write_behind_max_rows = write_behind_max_rows
+        self._pending_views: Dict[Tuple[int, int], str] = {}
+        self._pending_active: Dict[int, str] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stop_flusher = threading.Event()
+        
+        self.init_db()
+        
+        self._flusher = threading.Thread(target=self._flusher_loop, name='db-write-behind', daemon=True)
+        self._flusher.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+            conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+            conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+            conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+            # INSERT OR REPLACE должен запускать DELETE-триггеры (счетчики статистики)
+            conn.execute('PRAGMA recursive_triggers = ON')
+            return conn
+        except sqlite3.Error as e:
+            logger.error(f"Database connection error: {e}")
+            raise
+    
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database is closed")
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            can_create = self._created_connections < self.pool_size
+            if can_create:
+                self._created_connections += 1
+        
+        if can_create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._pool_lock:
+                    self._created_connections -= 1
+                raise
+        
+        # Все соединения заняты - ждем освобождения
+        try:
+            return self._pool.get(timeout=self.busy_timeout / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a free database connection")
+    
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._pool.put_nowait(conn)
+    
+    @contextmanager
+    def get_connection(self):
+        """Берет соединение из пула и возвращает его обратно после использования"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+    
+    def close(self):
+        """Сбрасывает буфер отложенной записи и закрывает все соединения пула"""
+        self._stop_flusher.set()
+        self._flush_requested.set()
+        self._flusher.join()
+        self.flush()
+        self._closed = True
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+        logger.info("Database connections closed")
+    
+    # ----- Отложенная запись -----
+    
+    @staticmethod
+    def _now() -> str:
+        # Тот же формат и часовой пояс (UTC), что у CURRENT_TIMESTAMP
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    
+    def _pending_count(self) -> int:
+        return len(self._pending_views) + len(self._pending_active)
+    
+    def _flusher_loop(self):
+        while not self._stop_flusher.is_set():
+            self._flush_requested.wait(self.write_behind_interval_ms / 1000)
+            self._flush_requested.clear()
+            if self._stop_flusher.is_set():
+                break
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Write-behind flush error: {e}")
+    
+    def flush(self):
+        """Записывает накопленные просмотры и активность одной транзакцией"""
+        with self._flush_lock:
+            with self._pending_lock:
+                views, self._pending_views = self._pending_views, {}
+                active, self._pending_active = self._pending_active, {}
+            if not views and not active:
+                return
+            
+            try:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('BEGIN')
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO profiles_viewed (user_id, viewed_user_id, viewed_date)
+                        VALUES (?, ?, ?)
+                    ''', [(user_id, viewed_user_id, viewed_date)
+                          for (user_id, viewed_user_id), viewed_date in views.items()])
+                    cursor.executemany('''
+                        UPDATE users SET last_active = ?
+                        WHERE user_id = ?
+                    ''', [(last_active, user_id) for user_id, last_active in active.items()])
+                    conn.commit()
+            except sqlite3.Error:
+                # Возвращаем строки в буфер, более новые значения не перетираем
+                with self._pending_lock:
+                    self._pending_views = {**views, **self._pending_views}
+                    self._pending_active = {**active, **self._pending_active}
+                raise
+    
+    def _drop_pending_views(self, user_id: int, include_viewed: bool = False):
+        with self._pending_lock:
+            self._pending_views = {
+                key: viewed_date for key, viewed_date in self._pending_views.items()
+                if key[0] != user_id and not (include_viewed and key[1] == user_id)
+            }
+    
+    def _pending_viewed_ids(self, user_id: int) -> List[int]:
+        with self._pending_lock:
+            return [viewed_user_id for (viewer_id, viewed_user_id) in self._pending_views if viewer_id == user_id]
+    
+    def init_db(self):
+        """Применяет недостающие миграции схемы"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Блокировка на запись: параллельно запущенные процессы
+            # не применят одну и ту же миграцию дважды
+            cursor.execute('BEGIN IMMEDIATE')
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            
+            for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {target_version}')
+                logger.info(f"Database migrated to version {target_version}: {migration.__doc__}")
+            
+            conn.commit()
+        logger.info("Database initialized successfully")
+    
+    def create_user(self, user_id: int, username: Optional[str], first_name: Optional[str], last_name: Optional[str], role: str):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, role)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, username, first_name, last_name, role))
+                conn.commit()
+                logger.info(f"User created: {user_id}, role: {role}")
+            except sqlite3.Error as e:
+                logger.error(f"Error creating user: {e}")
+    
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        
+        user = dict(row)
+        with self._pending_lock:
+            if user_id in self._pending_active:
+                user['last_active'] = self._pending_active[user_id]
+        return user
+    
+    def update_last_active(self, user_id: int):
+        """Откладывает обновление активности до следующего сброса буфера"""
+        with self._pending_lock:
+            self._pending_active[user_id] = self._now()
+            if self._pending_count() >= self.write_behind_max_rows:
+                self._flush_requested.set()
+    
+    def save_psychologist_profile(self, user_id: int, name: str, gender: Optional[str], age: Optional[int], 
+                                education: str, about_me: str, approach: str, 
+                                work_requests: str, price: str, photo_file_id: Optional[str] = None):
+        """Сохраняет анкету; пол и возраст приводятся к коду и числу, цены разбираются из текста.
+        
+        Каждое сохранение увеличивает версию анкеты - ключ кэша карточек.
+        """
+        price_min, price_max = parse_price(price)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO psychologist_profiles 
+                (user_id, name, gender, age, education, about_me, approach, work_requests, price,
+                 price_min, price_max, photo_file_id, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        COALESCE((SELECT version FROM psychologist_profiles WHERE user_id = ?), 0) + 1)
+            ''', (user_id, name, parse_gender(gender), parse_age(age), education, about_me, approach,
+                  work_requests, price, price_min, price_max, photo_file_id, user_id))
+            conn.commit()
+        logger.info(f"Psychologist profile saved: {user_id}")
+    
+    def save_client_profile(self, user_id: int, name: str, gender: Optional[str], age: Optional[int], request: str):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO client_profiles 
+                (user_id, name, gender, age, request, version)
+                VALUES (?, ?, ?, ?, ?, COALESCE((SELECT version FROM client_profiles WHERE user_id = ?), 0) + 1)
+            ''', (user_id, name, parse_gender(gender), parse_age(age), request, user_id))
+            conn.commit()
+        logger.info(f"Client profile saved: {user_id}")
+    
+    def get_psychologist_profile(self, user_id: int) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.*, u.username, u.first_name, u.last_name 
+                FROM psychologist_profiles p
+                LEFT JOIN users u ON p.user_id = u.user_id
+                WHERE p.user_id = ?
+            ''', (user_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def get_client_profile(self, user_id: int) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*, u.username, u.first_name, u.last_name 
+                FROM client_profiles c
+                LEFT JOIN users u ON c.user_id = u.user_id
+                WHERE c.user_id = ?
+            ''', (user_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def get_all_psychologists(self) -> List[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.*, u.username, u.first_name, u.last_name 
+                FROM psychologist_profiles p
+                JOIN users u ON p.user_id = u.user_id
+                WHERE u.role = 'psychologist'
+            ''')
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_all_clients(self) -> List[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*, u.username, u.first_name, u.last_name 
+                FROM client_profiles c
+                JOIN users u ON c.user_id = u.user_id
+                WHERE u.role = 'client'
+            ''')
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _filter_clause(role: str, preferences: Optional[Dict], by_ids: bool = False) -> Tuple[str, List, str]:
+        """Условия фильтров клиента по анкете психолога p, их параметры и порядок обхода.
+        
+        Порядок совпадает с индексом, по которому отбираются анкеты: тогда SQLite
+        читает только подходящие строки индекса и останавливается на LIMIT, а не
+        перебирает всех психологов, отбрасывая неподходящих. Поэтому даже очень
+        узкие фильтры стоят не больше просмотра без фильтров. by_ids - проверка
+        короткого списка анкет: подход сверяется по rowid каждой из них, без
+        выборки всех совпадений полнотекстового индекса.
+        """
+        if role != 'client' or not preferences:
+            return '', [], 'u.user_id'
+        
+        # Цена для фильтра - выражение из индексов анкет психологов (см. _migration_typed_attributes)
+        price = 'COALESCE(p.price_min, p.price_max)'
+        conditions, params = [], []
+        if preferences.get('gender'):
+            conditions.append('p.gender = ?')
+            params.append(preferences['gender'])
+        if preferences.get('age_min') is not None:
+            conditions.append('p.age >= ?')
+            params.append(preferences['age_min'])
+        if preferences.get('age_max') is not None:
+            conditions.append('p.age <= ?')
+            params.append(preferences['age_max'])
+        if preferences.get('price_max') is not None:
+            conditions.append(f'{price} <= ?')
+            params.append(preferences['price_max'])
+        if preferences.get('gender') or preferences.get('age_min') is not None or preferences.get('age_max') is not None:
+            # idx_psychologist_profiles_gender_age или idx_psychologist_profiles_age
+            order = f'p.age, {price}, p.user_id'
+        elif preferences.get('price_max') is not None:
+            # idx_psychologist_profiles_price
+            order = f'{price}, p.age, p.user_id'
+        else:
+            order = 'p.user_id'
+        
+        stems = sorted(tokenize(preferences.get('approach')))
+        if stems and by_ids:
+            conditions.append('EXISTS (SELECT 1 FROM psychologist_search s '
+                              'WHERE s.psychologist_search MATCH ? AND s.rowid = p.user_id)')
+            params.append(f'approach : ({build_search_query(stems)})')
+        elif stems:
+            # Унарный плюс не дает планировщику начать с полнотекстового списка
+            # и сортировать все совпадения: обход идет по индексу фильтров выше
+            column = '+p.user_id' if conditions else 'p.user_id'
+            conditions.append(f'{column} IN (SELECT rowid FROM psychologist_search WHERE psychologist_search MATCH ?)')
+            params.append(f'approach : ({build_search_query(stems)})')
+        return ''.join(f' AND {condition}' for condition in conditions), params, order
+    
+    def get_next_candidates(self, user_id: int, role: str, limit: int = 1,
+                            exclude_ids: Iterable[int] = (), preferences: Optional[Dict] = None) -> List[Dict]:
+        """Следующие непросмотренные и не лайкнутые анкеты для пользователя с ролью role.
+        
+        Психологам подбираются клиенты, клиентам - психологи. Просмотренные и
+        лайкнутые анкеты отсекаются анти-джойнами по уникальным индексам,
+        exclude_ids - анкеты, которые уже загружены, но еще не показаны.
+        preferences - сохраненные фильтры клиента (см. get_preferences).
+        """
+        if role == 'psychologist':
+            target_role, profile_table = 'client', 'client_profiles'
+        else:
+            target_role, profile_table = 'psychologist', 'psychologist_profiles'
+        
+        # Просмотры из буфера отложенной записи еще не попали в profiles_viewed
+        exclude_ids = list(exclude_ids) + self._pending_viewed_ids(user_id)
+        exclude_clause = ''
+        if exclude_ids:
+            exclude_clause = f"AND u.user_id NOT IN ({', '.join('?' * len(exclude_ids))})"
+        filter_clause, filter_params, order = self._filter_clause(role, preferences)
+        # С фильтрами обход ведет индекс анкет: унарный плюс не дает планировщику
+        # начать с индекса по роли, который без ANALYZE выглядит выгоднее диапазона
+        role_column = '+u.role' if filter_clause else 'u.role'
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.*, u.username, u.first_name, u.last_name
+                FROM users u
+                JOIN {profile_table} p ON p.user_id = u.user_id
+                WHERE {role_column} = ? AND u.user_id != ?
+                  {exclude_clause}{filter_clause}
+                  AND NOT EXISTS (
+                      SELECT 1 FROM profiles_viewed v
+                      WHERE v.user_id = ? AND v.viewed_user_id = u.user_id
+                  )
+                  AND NOT EXISTS (
+                      SELECT 1 FROM likes l
+                      WHERE l.from_user_id = ? AND l.to_user_id = u.user_id
+                  )
+                ORDER BY {order}
+                LIMIT ?
+            ''', (target_role, user_id, *exclude_ids, *filter_params, user_id, user_id, limit))
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_candidates_by_ids(self, user_id: int, role: str, candidate_ids: List[int],
+                              preferences: Optional[Dict] = None) -> List[Dict]:
+        """Анкеты из candidate_ids, доступные пользователю, в порядке candidate_ids.
+        
+        Те же условия, что в get_next_candidates, но по заранее выбранному
+        списку: так проверяется очередная порция ранжированных кандидатов.
+        """
+        if role == 'psychologist':
+            target_role, profile_table = 'client', 'client_profiles'
+        else:
+            target_role, profile_table = 'psychologist', 'psychologist_profiles'
+        
+        pending = set(self._pending_viewed_ids(user_id))
+        candidate_ids = [candidate_id for candidate_id in candidate_ids if candidate_id not in pending]
+        if not candidate_ids:
+            return []
+        filter_clause, filter_params, _ = self._filter_clause(role, preferences, by_ids=True)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.*, u.username, u.first_name, u.last_name
+                FROM users u
+                JOIN {profile_table} p ON p.user_id = u.user_id
+                WHERE u.user_id IN ({', '.join('?' * len(candidate_ids))})
+                  AND u.role = ? AND u.user_id != ?{filter_clause}
+                  AND NOT EXISTS (
+                      SELECT 1 FROM profiles_viewed v
+                      WHERE v.user_id = ? AND v.viewed_user_id = u.user_id
+                  )
+                  AND NOT EXISTS (
+                      SELECT 1 FROM likes l
+                      WHERE l.from_user_id = ? AND l.to_user_id = u.user_id
+                  )
+            ''', (*candidate_ids, target_role, user_id, *filter_params, user_id, user_id))
+            rows = {row['user_id']: dict(row) for row in cursor.fetchall()}
+        return [rows[candidate_id] for candidate_id in candidate_ids if candidate_id in rows]
+    
+    def get_ranking_profiles(self, user_id: Optional[int] = None) -> List[Dict]:
+        """Поля анкет для индекса ранжирования: всех пользователей или одного"""
+        user_clause = 'AND u.user_id = ?' if user_id is not None else ''
+        params = (user_id, user_id) if user_id is not None else ()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT u.user_id, u.role, u.last_active, p.gender, p.age,
+                       COALESCE(p.price_min, p.price_max) AS price,
+                       COALESCE(p.work_requests, '') || ' ' || COALESCE(p.approach, '') AS text
+                FROM users u JOIN psychologist_profiles p ON p.user_id = u.user_id
+                WHERE u.role = 'psychologist' {user_clause}
+                UNION ALL
+                SELECT u.user_id, u.role, u.last_active, c.gender, c.age, NULL AS price,
+                       COALESCE(c.request, '') AS text
+                FROM users u JOIN client_profiles c ON c.user_id = u.user_id
+                WHERE u.role = 'client' {user_clause}
+            ''', params)
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    def create_like(self, from_user_id: int, to_user_id: int) -> Tuple[bool, bool]:
+        """Создает лайк и проверяет взаимность в одной транзакции.
+        
+        BEGIN IMMEDIATE сразу берет блокировку на запись, поэтому два встречных
+        лайка, поставленных одновременно, выполняются по очереди, и второй
+        из них гарантированно видит первый.
+        
+        Возвращает (создан ли лайк, взаимный ли он).
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute('''
+                INSERT INTO likes (from_user_id, to_user_id)
+                VALUES (?, ?)
+                ON CONFLICT(from_user_id, to_user_id) DO NOTHING
+            ''', (from_user_id, to_user_id))
+            if cursor.rowcount == 0:
+                # Лайк уже был
+                conn.rollback()
+                return False, False
+            
+            # Помечаем обе записи взаимными, если есть встречный лайк
+            cursor.execute('''
+                UPDATE likes SET is_mutual = 1
+                WHERE ((from_user_id = ? AND to_user_id = ?) OR (from_user_id = ? AND to_user_id = ?))
+                  AND EXISTS (SELECT 1 FROM likes WHERE from_user_id = ? AND to_user_id = ?)
+            ''', (from_user_id, to_user_id, to_user_id, from_user_id, to_user_id, from_user_id))
+            is_mutual = cursor.rowcount > 0
+            
+            if is_mutual:
+                cursor.execute('''
+                    INSERT INTO matches (min_id, max_id) VALUES (?, ?)
+                    ON CONFLICT(min_id, max_id) DO NOTHING
+                ''', (min(from_user_id, to_user_id), max(from_user_id, to_user_id)))
+            
+            conn.commit()
+        logger.info(f"Like created: {from_user_id} -> {to_user_id}, mutual: {is_mutual}")
+        return True, is_mutual
+    
+    def get_likes_for_user(self, user_id: int) -> List[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT l.*, u.username, u.first_name, u.last_name, u.role
+                FROM likes l
+                JOIN users u ON l.from_user_id = u.user_id
+                WHERE l.to_user_id = ?
+                ORDER BY l.liked_date DESC
+            ''', (user_id,))
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    def _fetch_page(self, query: str, params: Dict, limit: int,
+                    after_id: Optional[int], before_id: Optional[int], keyset: str) -> Tuple[List[Dict], bool]:
+        """Страница по ключу (время, id), от новых к старым.
+        
+        query - запрос с именованными параметрами и местами {keyset} под условие ключа,
+        {order} под направление сортировки и параметром :limit.
+        keyset - условие ключа с местом {cmp} и параметром :cursor.
+        after_id - id последней записи уже показанной страницы (листаем к старым),
+        before_id - id первой записи показанной страницы (листаем к новым).
+        Ключ берется из строки по первичному ключу, поэтому в callback_data
+        достаточно одного id, а стоимость страницы не зависит от ее номера.
+        
+        Возвращает строки страницы и признак того, что в направлении листания есть еще.
+        """
+        params = dict(params, limit=limit + 1)
+        if before_id is not None:
+            condition = keyset.format(cmp='>')
+            order = 'ASC'
+            params['cursor'] = before_id
+        elif after_id is not None:
+            condition = keyset.format(cmp='<')
+            order = 'DESC'
+            params['cursor'] = after_id
+        else:
+            condition = ''
+            order = 'DESC'
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query.format(keyset=condition, order=order), params)
+            rows = cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        page = [dict(row) for row in rows[:limit]]
+        if before_id is not None:
+            page.reverse()
+        return page, has_more
+    
+    def get_likes_page(self, user_id: int, limit: int = LIKES_PAGE_SIZE,
+                       after_id: Optional[int] = None, before_id: Optional[int] = None) -> Tuple[List[Dict], bool]:
+        """Страница входящих лайков пользователя"""
+        return self._fetch_page('''
+            SELECT l.id, l.liked_date, l.is_mutual,
+                   u.user_id, u.username, u.first_name, u.last_name, u.role,
+                   CASE 
+                     WHEN u.role = 'psychologist' THEN p.name
+                     WHEN u.role = 'client' THEN c.name
+                   END as name
+            FROM likes l
+            JOIN users u ON l.from_user_id = u.user_id
+            LEFT JOIN psychologist_profiles p ON u.user_id = p.user_id
+            LEFT JOIN client_profiles c ON u.user_id = c.user_id
+            WHERE l.to_user_id = :user_id {keyset}
+            ORDER BY l.liked_date {order}, l.id {order}
+            LIMIT :limit
+        ''', {'user_id': user_id}, limit, after_id, before_id,
+            'AND (l.liked_date, l.id) {cmp} (SELECT liked_date, id FROM likes WHERE id = :cursor)')
+    
+    # Мэтчи пользователя лежат в двух диапазонах индексов: где он min_id и где max_id.
+    # Каждая ветка UNION ALL читает только свой диапазон, уже упорядоченный по matched_at
+    _MATCHES_QUERY = '''
+        SELECT m.id, m.matched_at,
+               u.user_id, u.username, u.first_name, u.last_name, u.role,
+               CASE 
+                 WHEN u.role = 'psychologist' THEN p.name
+                 WHEN u.role = 'client' THEN c.name
+               END as name
+        FROM (
+            SELECT id, matched_at, max_id AS partner_id FROM matches
+            WHERE min_id = :user_id {keyset}
+            UNION ALL
+            SELECT id, matched_at, min_id AS partner_id FROM matches
+            WHERE max_id = :user_id {keyset}
+            ORDER BY matched_at {order}, id {order}
+            LIMIT :limit
+        ) m
+        JOIN users u ON m.partner_id = u.user_id
+        LEFT JOIN psychologist_profiles p ON u.user_id = p.user_id
+        LEFT JOIN client_profiles c ON u.user_id = c.user_id
+        ORDER BY m.matched_at {order}, m.id {order}
+    '''
+    _MATCHES_KEYSET = 'AND (matched_at, id) {cmp} (SELECT matched_at, id FROM matches WHERE id = :cursor)'
+    
+    def get_mutual_likes_page(self, user_id: int, limit: int = LIKES_PAGE_SIZE,
+                              after_id: Optional[int] = None, before_id: Optional[int] = None) -> Tuple[List[Dict], bool]:
+        """Страница мэтчей пользователя"""
+        return self._fetch_page(self._MATCHES_QUERY, {'user_id': user_id}, limit,
+                                after_id, before_id, self._MATCHES_KEYSET)
+    
+    def get_mutual_likes(self, user_id: int) -> List[Dict]:
+        """Все мэтчи пользователя, от новых к старым"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._MATCHES_QUERY.format(keyset='', order='DESC'), {'user_id': user_id, 'limit': -1})
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    def count_matches(self, user_id: int) -> int:
+        """Число мэтчей пользователя"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT (SELECT COUNT(*) FROM matches WHERE min_id = ?)
+                     + (SELECT COUNT(*) FROM matches WHERE max_id = ?) AS count
+            ''', (user_id, user_id))
+            result = cursor.fetchone()
+        return result['count']
+    
+    def search_psychologist_ids(self, stems: List[str], limit: int = SEARCH_MAX_RESULTS) -> List[int]:
+        """Id анкет психологов по основам слов запроса, по убыванию BM25.
+        
+        Веса основ дает сам bm25() FTS5: основы, которые есть в половине анкет
+        и больше, получают почти нулевой idf, и анкеты только с ними оказываются
+        в конце. Запрос один, без отдельного подсчета частоты каждой основы;
+        BM25 считается для каждого совпадения, поэтому список кэширует
+        AsyncDatabase.search_psychologists.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT rowid FROM psychologist_search
+                WHERE psychologist_search MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (build_search_query(stems), limit))
+            rows = cursor.fetchall()
+        return [row[0] for row in rows]
+    
+    def get_search_results(self, match: str, user_ids: List[int]) -> List[Dict]:
+        """Анкеты страницы результатов с фрагментом совпавшего текста, в порядке user_ids"""
+        if not user_ids:
+            return []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.user_id, p.name, p.age, p.approach, p.price, u.username,
+                       snippet(psychologist_search, -1, '', '', '…', 10) AS snippet
+                FROM psychologist_search s
+                JOIN psychologist_profiles p ON p.user_id = s.rowid
+                JOIN users u ON u.user_id = p.user_id
+                WHERE psychologist_search MATCH ? AND s.rowid IN ({', '.join('?' * len(user_ids))})
+                  AND u.role = 'psychologist'
+            ''', (match, *user_ids))
+            rows = {row['user_id']: dict(row) for row in cursor.fetchall()}
+        return [rows[user_id] for user_id in user_ids if user_id in rows]
+    
+    def get_preferences(self, user_id: int) -> Optional[Dict]:
+        """Сохраненные фильтры пользователя или None"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT gender, age_min, age_max, price_max, approach
+                FROM user_preferences WHERE user_id = ?
+            ''', (user_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def save_preferences(self, user_id: int, gender: Optional[str] = None, age_min: Optional[int] = None,
+                         age_max: Optional[int] = None, price_max: Optional[int] = None,
+                         approach: Optional[str] = None):
+        """Сохраняет фильтры; если ни один не задан, удаляет их"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if all(value is None for value in (gender, age_min, age_max, price_max, approach)):
+                cursor.execute('DELETE FROM user_preferences WHERE user_id = ?', (user_id,))
+            else:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_preferences
+                    (user_id, gender, age_min, age_max, price_max, approach, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, gender, age_min, age_max, price_max, approach))
+            conn.commit()
+        logger.info(f"Preferences saved: {user_id}")
+    
+    def add_viewed_profile(self, user_id: int, viewed_user_id: int):
+        """Откладывает запись просмотра до следующего сброса буфера"""
+        with self._pending_lock:
+            self._pending_views.setdefault((user_id, viewed_user_id), self._now())
+            if self._pending_count() >= self.write_behind_max_rows:
+                self._flush_requested.set()
+    
+    def get_viewed_profiles(self, user_id: int) -> List[int]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT viewed_user_id FROM profiles_viewed 
+                WHERE user_id = ?
+            ''', (user_id,))
+            rows = cursor.fetchall()
+        viewed = [row['viewed_user_id'] for row in rows]
+        viewed_set = set(viewed)
+        viewed.extend(v for v in self._pending_viewed_ids(user_id) if v not in viewed_set)
+        return viewed
+    
+    def get_user_likes(self, user_id: int) -> List[int]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT to_user_id FROM likes 
+                WHERE from_user_id = ?
+            ''', (user_id,))
+            rows = cursor.fetchall()
+        return [row['to_user_id'] for row in rows]
+    
+    def check_mutual_like(self, user1_id: int, user2_id: int) -> bool:
+        """Проверяет, есть ли взаимный лайк между двумя пользователями"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM matches WHERE min_id = ? AND max_id = ?
+            ''', (min(user1_id, user2_id), max(user1_id, user2_id)))
+            result = cursor.fetchone()
+        return result is not None
+    
+    def get_statistics(self) -> Dict:
+        """Общая статистика из счетчиков, которые триггеры обновляют вместе с данными"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, value FROM stats_counters')
+            counters = {row['name']: row['value'] for row in cursor.fetchall()}
+        
+        return {
+            'psychologists_count': counters.get('users_psychologist', 0),
+            'clients_count': counters.get('users_client', 0),
+            'mutual_matches': counters.get('matches', 0),
+            'total_likes': counters.get('likes_total', 0)
+        }
+    
+    def reset_viewed_profiles(self, user_id: int):
+        """Сброс просмотренных профилей"""
+        # Блокировка сброса буфера: уже забранные из буфера просмотры
+        # не должны записаться после удаления
+        with self._flush_lock, self.get_connection() as conn:
+            self._drop_pending_views(user_id)
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM profiles_viewed WHERE user_id = ?', (user_id,))
+            conn.commit()
+        logger.info(f"Viewed profiles reset for user: {user_id}")
+
+    def delete_user_data(self, user_id: int):
+        """Удаление всех данных пользователя (используется при перезапуске)"""
+        with self._flush_lock, self.get_connection() as conn:
+            self._drop_pending_views(user_id, include_viewed=True)
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM psychologist_profiles WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM client_profiles WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?', (user_id, user_id))
+            cursor.execute('DELETE FROM matches WHERE min_id = ? OR max_id = ?', (user_id, user_id))
+            cursor.execute('DELETE FROM profiles_viewed WHERE user_id = ? OR viewed_user_id = ?', (user_id, user_id))
+            cursor.execute('DELETE FROM user_preferences WHERE user_id = ?', (user_id,))
+            conn.commit()
+        logger.info(f"User data deleted: {user_id}")
+
+    # ----- Состояния диалогов и user_data -----
+    
+    def load_user_conversations(self, user_id: int) -> Dict[str, Dict[Tuple, object]]:
+        """Сохраненные состояния диалогов пользователя: {имя диалога: {ключ: состояние}}"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, key, state FROM persistence_conversations WHERE user_id = ?', (user_id,))
+            rows = cursor.fetchall()
+        conversations: Dict[str, Dict[Tuple, object]] = {}
+        for row in rows:
+            conversations.setdefault(row['name'], {})[tuple(json.loads(row['key']))] = json.loads(row['state'])
+        return conversations
+    
+    def load_user_data(self, user_id: int) -> Optional[Dict]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT data FROM persistence_user_data WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+        return json.loads(row['data']) if row else None
+    
+    def save_persistence_batch(self, conversations: Dict[Tuple[str, int, str], Optional[str]],
+                               user_data: Dict[int, Optional[str]]):
+        """Записывает накопленные изменения одной транзакцией.
+        
+        Состояния диалогов передаются по ключу (имя диалога, user_id, ключ в JSON).
+        Значения уже сериализованы в JSON; None означает удаление записи.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            cursor.executemany('''
+                INSERT INTO persistence_conversations (user_id, name, key, state) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, name, key) DO UPDATE SET state = excluded.state
+            ''', [(user_id, name, key, state) for (name, user_id, key), state in conversations.items()
+                  if state is not None])
+            cursor.executemany(
+                'DELETE FROM persistence_conversations WHERE user_id = ? AND name = ? AND key = ?',
+                [(user_id, name, key) for (name, user_id, key), state in conversations.items() if state is None]
+            )
+            cursor.executemany('''
+                INSERT INTO persistence_user_data (user_id, data) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data = excluded.data
+            ''', [(user_id, data) for user_id, data in user_data.items() if data is not None])
+            cursor.executemany(
+                'DELETE FROM persistence_user_data WHERE user_id = ?',
+                [(user_id,) for user_id, data in user_data.items() if data is None]
+            )
+            conn.commit()
@@ -0,0 +1,224 @@
+"""Импорт и экспорт данных psymatch.db в JSON Lines или CSV.
+
+Пользователи, анкеты, лайки, просмотры и фильтры читаются и пишутся потоково,
+порциями по --chunk строк, поэтому память не зависит от размера файлов.
+Каждая таблица - отдельный файл <таблица>.jsonl или <таблица>.csv в каталоге.
+
+    python psymatch_io.py export --db psymatch.db --dir dump --format jsonl
+    python psymatch_io.py import --db staging.db --dir dump --format jsonl --defer-indexes
+
+В CSV пустое поле означает NULL.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, Iterator, List
+
+from psymatch_db import (Database, backfill_matches, backfill_profile_attributes, backfill_stats_counters,
+                         rebuild_profile_search)
+
+# Порядок важен при импорте: лайки и просмотры ссылаются на пользователей
+TABLES = ['users', 'psychologist_profiles', 'client_profiles', 'likes', 'profiles_viewed', 'user_preferences']
+
+logger = logging.getLogger('psymatch_io')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('export', 'import'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--db', default=os.environ.get('DB_PATH', 'psymatch.db'), help='файл базы данных')
+        sub.add_argument('--dir', required=True, help='каталог с файлами таблиц')
+        sub.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+        sub.add_argument('--tables', default=','.join(TABLES), help='таблицы через запятую')
+        sub.add_argument('--chunk', type=int, default=10000, help='строк в одной порции')
+
+    import_parser = subparsers.choices['import']
+    import_parser.add_argument('--commit-rows', type=int, default=500000,
+                               help='строк в одной транзакции')
+    import_parser.add_argument('--replace', action='store_true',
+                               help='заменять существующие строки (по умолчанию пропускать)')
+    import_parser.add_argument('--defer-indexes', action='store_true',
+                               help='отключить индексы и триггеры таблиц на время загрузки')
+
+    args = parser.parse_args()
+    args.tables = [table.strip() for table in args.tables.split(',') if table.strip()]
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error(f"неизвестные таблицы: {', '.join(sorted(unknown))}")
+    return args
+
+def table_columns(conn, table: str) -> List[str]:
+    return [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def table_path(directory: str, table: str, fmt: str) -> str:
+    return os.path.join(directory, f'{table}.{fmt}')
+
+# ========== ЭКСПОРТ ==========
+
+def export_table(conn, table: str, path: str, fmt: str, chunk: int) -> int:
+    """Выгружает таблицу в файл, читая порциями через fetchmany"""
+    columns = table_columns(conn, table)
+    cursor = conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY rowid')
+    count = 0
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(tuple('' if value is None else value for value in row) for row in rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+def export_data(database, args):
+    os.makedirs(args.dir, exist_ok=True)
+    with database.get_connection() as conn:
+        # Одна читающая транзакция - согласованный снимок всех таблиц
+        conn.execute('BEGIN')
+        for table in args.tables:
+            start = time.perf_counter()
+            count = export_table(conn, table, table_path(args.dir, table, args.format), args.format, args.chunk)
+            logger.info(f"Exported {table}: {count} rows in {time.perf_counter() - start:.1f}s")
+        conn.rollback()
+
+# ========== ИМПОРТ ==========
+
+def read_records(path: str, fmt: str) -> Iterator[Dict]:
+    """Построчно читает записи из файла"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for record in csv.DictReader(f):
+                yield {key: (value if value != '' else None) for key, value in record.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def drop_schema_objects(conn, kind: str, tables: List[str]) -> List[str]:
+    """Удаляет индексы или триггеры таблиц и возвращает их определения"""
+    placeholders = ', '.join('?' for _ in tables)
+    rows = conn.execute(f'''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = ? AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+    ''', [kind, *tables]).fetchall()
+    for row in rows:
+        conn.execute(f'DROP {kind.upper()} {row["name"]}')
+    return [row['sql'] for row in rows]
+
+def restore_deferred(conn, deferred_sql: List[str], tables: List[str]):
+    """Строит заново отложенные индексы и триггеры и пересчитывает то, что они поддерживали"""
+    start = time.perf_counter()
+    conn.execute('BEGIN')
+    for sql in deferred_sql:
+        conn.execute(sql)
+    # Пока триггеров не было, счетчики статистики и поисковый индекс не менялись -
+    # строим их один раз по таблицам
+    backfill_stats_counters(conn.cursor())
+    if 'psychologist_profiles' in tables:
+        rebuild_profile_search(conn.cursor())
+    conn.commit()
+    logger.info(f"Rebuilt {len(deferred_sql)} indexes and triggers in {time.perf_counter() - start:.1f}s")
+
+def import_table(conn, table: str, path: str, args) -> int:
+    """Загружает файл в таблицу через executemany, фиксируя транзакцию каждые --commit-rows строк"""
+    records = read_records(path, args.format)
+    first = next(records, None)
+    if first is None:
+        return 0
+
+    # Колонки берутся из первой записи: отсутствующие в файле получают значения по умолчанию
+    known = set(table_columns(conn, table))
+    columns = [column for column in first if column in known]
+    verb = 'INSERT OR REPLACE' if args.replace else 'INSERT OR IGNORE'
+    sql = f'{verb} INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+    count = 0
+    in_transaction = 0
+    for chunk in chunked(itertools.chain([first], records), args.chunk):
+        if not in_transaction:
+            conn.execute('BEGIN')
+        conn.executemany(sql, (tuple(record.get(column) for column in columns) for record in chunk))
+        count += len(chunk)
+        in_transaction += len(chunk)
+        if in_transaction >= args.commit_rows:
+            conn.commit()
+            in_transaction = 0
+            logger.info(f"Imported {table}: {count} rows")
+    if in_transaction:
+        conn.commit()
+    return count
+
+def import_data(database, args):
+    tables = [table for table in TABLES if table in args.tables]
+    with database.get_connection() as conn:
+        deferred_sql = []
+        if args.defer_indexes:
+            # Без построчных триггеров вставка не обновляет счетчики и поисковый индекс на каждой строке
+            conn.execute('BEGIN')
+            deferred_sql = drop_schema_objects(conn, 'index', tables) + drop_schema_objects(conn, 'trigger', tables)
+            conn.commit()
+            logger.info(f"Dropped {len(deferred_sql)} indexes and triggers until the load is finished")
+
+        try:
+            for table in tables:
+                path = table_path(args.dir, table, args.format)
+                if not os.path.exists(path):
+                    logger.warning(f"Skipping {table}: {path} not found")
+                    continue
+                start = time.perf_counter()
+                count = import_table(conn, table, path, args)
+                logger.info(f"Imported {table}: {count} rows in {time.perf_counter() - start:.1f}s")
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if deferred_sql:
+                restore_deferred(conn, deferred_sql, tables)
+
+        if {'psychologist_profiles', 'client_profiles'} & set(tables):
+            # Выгрузки старых версий содержат пол и возраст текстом и не содержат диапазона цен
+            conn.execute('BEGIN')
+            backfill_profile_attributes(conn.cursor(), args.chunk)
+            conn.commit()
+        
+        if 'likes' in tables:
+            # Мэтчи не выгружаются: они однозначно восстанавливаются по взаимным лайкам
+            conn.execute('BEGIN')
+            backfill_matches(conn.cursor())
+            conn.commit()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    database = Database(args.db)
+
+    try:
+        if args.command == 'export':
+            export_data(database, args)
+        else:
+            import_data(database, args)
+    finally:
+        database.close()
+
+if __name__ == '__main__':
+    main()
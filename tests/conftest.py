@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# При импорте psymatch2 создается глобальная база по DB_PATH - уводим ее во временный каталог
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='psymatch-tests-'), 'psymatch.db'))
+
+import psymatch2  # noqa: E402
+
+@pytest.fixture
+def database(tmp_path):
+    database = psymatch2.Database(str(tmp_path / 'psymatch.db'))
+    yield database
+    database.close()
+
+def add_psychologist(database, user_id: int, work_requests: str = 'тревога', **fields):
+    database.create_user(user_id, f'psy{user_id}', f'Психолог {user_id}', None, 'psychologist')
+    profile = dict(name=f'Психолог {user_id}', gender='female', age=35, education='МГУ',
+                   about_me='Опыт 10 лет', approach='Гештальт', work_requests=work_requests,
+                   price='2000-3000 руб./сессия')
+    profile.update(fields)
+    database.save_psychologist_profile(user_id, **profile)
+
+def add_client(database, user_id: int, request: str = 'тревога'):
+    database.create_user(user_id, f'client{user_id}', f'Клиент {user_id}', None, 'client')
+    database.save_client_profile(user_id, f'Клиент {user_id}', 'male', 30, request)
@@ -0,0 +1,120 @@
+"""Подмена Telegram для тестов и бенчмарков: ответы Bot API без сети и апдейты в формате Telegram"""
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+class FakeRequest(BaseRequest):
+    """Отвечает на вызовы Bot API локально и запоминает последний текст и inline-клавиатуру в каждом чате
+    и то, было ли сообщение с клавиатурой фотографией"""
+
+    BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'PsyMatch', 'username': 'psymatch_test_bot'}
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.keyboards: Dict[int, List[str]] = {}
+        self.texts: Dict[int, str] = {}
+        self.photo_keyboards: set = set()
+        self._message_ids = iter(range(1, 1 << 62))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        parameters = request_data.parameters if request_data else {}
+
+        chat_id = parameters.get('chat_id')
+        markup = parameters.get('reply_markup')
+        if chat_id is not None and 'text' in parameters:
+            self.texts[int(chat_id)] = parameters['text']
+        elif chat_id is not None and 'caption' in parameters:
+            self.texts[int(chat_id)] = parameters['caption']
+        if chat_id is not None and isinstance(markup, dict) and 'inline_keyboard' in markup:
+            self.keyboards[int(chat_id)] = [
+                button['callback_data'] for row in markup['inline_keyboard'] for button in row
+                if 'callback_data' in button
+            ]
+            if endpoint in ('sendPhoto', 'editMessageMedia'):
+                self.photo_keyboards.add(int(chat_id))
+            else:
+                self.photo_keyboards.discard(int(chat_id))
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == 'getMe':
+            result = self.BOT_USER
+        elif endpoint.startswith(('send', 'edit')) and chat_id is not None:
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'},
+                'from': self.BOT_USER,
+                'text': str(parameters.get('text', '')),
+            }
+            if endpoint in ('sendPhoto', 'editMessageMedia'):
+                del result['text']
+                result['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 640, 'height': 640}]
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+class UpdateFactory:
+    """Строит апдейты в том виде, в каком их присылает Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = iter(range(1, 1 << 62))
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': f'user{user_id}'}
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = next(self._update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str, photo: bool = False) -> Update:
+        """Нажатие кнопки; photo - кнопка под фотографией, а не под текстом"""
+        update_id = next(self._update_ids)
+        message = {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': FakeRequest.BOT_USER,
+        }
+        if photo:
+            message['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 640, 'height': 640}]
+        else:
+            message['text'] = '...'
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': message,
+            },
+        }, self.bot)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import psymatch2
+from conftest import add_psychologist
+
+def test_ttl_cache_expires_and_evicts_least_recent():
+    cache = psymatch2.TTLCache(max_size=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    # 'b' дольше всех не читали - он и вытесняется
+    cache.set('c', 3)
+    assert cache.get('b') is psymatch2.TTLCache._MISSING
+    assert cache.get('c') == 3
+
+    time.sleep(0.06)
+    assert cache.get('a') is psymatch2.TTLCache._MISSING
+    assert cache.stats() == {'size': 1, 'hits': 2, 'misses': 2, 'hit_rate': 0.5}
+
+def test_profile_reads_are_cached_until_the_profile_changes(database):
+    add_psychologist(database, 101)
+    adb = psymatch2.AsyncDatabase(database)
+    calls = []
+    load = database.get_psychologist_profile
+
+    def counting_load(user_id):
+        calls.append(user_id)
+        return load(user_id)
+
+    database.get_psychologist_profile = counting_load
+
+    async def scenario():
+        profile = await adb.get_psychologist_profile(101)
+        # Обработчик меняет полученный словарь - в кэше он остается прежним
+        profile['name'] = 'Изменено'
+        assert (await adb.get_psychologist_profile(101))['name'] == 'Психолог 101'
+        assert calls == [101]
+
+        await adb.save_psychologist_profile(101, 'Новое имя', 'female', 40, 'МГУ', 'Опыт 15 лет',
+                                            'Гештальт', 'тревога', '3000 руб./сессия')
+        assert (await adb.get_psychologist_profile(101))['name'] == 'Новое имя'
+        assert calls == [101, 101]
+
+        # Загрузка, во время которой анкету сбросили, в кэш не попадает
+        adb.cache.invalidate(('psychologist', 101))
+        loading = asyncio.ensure_future(adb.get_psychologist_profile(101))
+        await asyncio.sleep(0)
+        adb.invalidate_user_cache(101)
+        await loading
+        assert adb.cache.get(('psychologist', 101)) is psymatch2.TTLCache._MISSING
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
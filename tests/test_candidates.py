@@ -0,0 +1,72 @@
+import asyncio
+
+import psymatch2
+from conftest import add_client, add_psychologist
+
+def queued_ids(adb, user_id):
+    return [candidate['user_id'] for candidate in adb._candidates.get(user_id, ())]
+
+def test_profile_change_invalidates_only_affected_queues(database):
+    for user_id in (101, 102, 103, 104):
+        add_psychologist(database, user_id)
+    for user_id in (1, 2):
+        add_client(database, user_id)
+    adb = psymatch2.AsyncDatabase(database, prefetch_size=4)
+
+    async def scenario():
+        await adb.next_candidate(1, 'client')
+        await adb.next_candidate(2, 'client')
+        assert 102 in queued_ids(adb, 1) and 102 in queued_ids(adb, 2)
+
+        # Анкета психолога изменилась: она уходит из чужих очередей, остальное остается
+        before = queued_ids(adb, 1)
+        await adb.save_psychologist_profile(102, 'Психолог 102', 'female', 40, 'МГУ', 'Опыт 15 лет',
+                                            'Гештальт', 'тревога', '3000 руб./сессия')
+        assert queued_ids(adb, 1) == [user_id for user_id in before if user_id != 102]
+        assert 102 not in queued_ids(adb, 2)
+
+        # Изменение анкеты клиента не трогает очереди других клиентов
+        queue = adb._candidates[2]
+        await adb.save_client_profile(1, 'Клиент 1', 'male', 31, 'депрессия')
+        assert 1 not in adb._candidates
+        assert adb._candidates[2] is queue
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
+
+def test_queue_state_is_bounded(database):
+    for user_id in range(101, 106):
+        add_psychologist(database, user_id)
+    for user_id in range(1, 11):
+        add_client(database, user_id)
+    adb = psymatch2.AsyncDatabase(database, prefetch_size=2, prefetch_max_users=3)
+
+    async def scenario():
+        await adb.load_ranking_index()
+        assert adb.ranking.loaded
+        for user_id in range(1, 11):
+            assert await adb.next_candidate(user_id, 'client')
+            adb.invalidate_candidates(user_id)
+            await adb.next_candidate(user_id, 'client')
+        await asyncio.gather(*adb._refills.values())
+        await asyncio.sleep(0)
+
+        assert len(adb._candidates) <= 3
+        assert len(adb._ranked) <= 3
+        assert adb._candidate_generations == {}
+
+        # Сброс во время дозагрузки по-прежнему отбрасывает ее результат
+        adb.invalidate_candidates(1)
+        refill = adb._schedule_refill(1, 'client')
+        await asyncio.sleep(0)
+        adb.invalidate_candidates(1)
+        await refill
+        assert 1 not in adb._candidates
+        assert adb._candidate_generations == {}
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
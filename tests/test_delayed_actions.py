@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, TypeHandler
+
+import psymatch2
+from conftest import add_client, add_psychologist
+from fakes import FakeRequest, UpdateFactory
+
+DELAY = 0.2
+
+def test_actions_run_concurrently_and_cancel_before_delay():
+    actions = psymatch2.DelayedActions()
+    done = []
+
+    def action(user_id):
+        async def run():
+            done.append((user_id, time.monotonic()))
+        return run
+
+    async def scenario():
+        started = time.monotonic()
+        for user_id in range(50):
+            actions.schedule(user_id, DELAY, action(user_id))
+        # Отмененные до истечения задержки действия не выполняются
+        for user_id in range(0, 50, 5):
+            assert actions.cancel(user_id)
+        assert not actions.cancel(1000)
+        await asyncio.sleep(DELAY * 2)
+        return started
+
+    started = asyncio.run(scenario())
+
+    assert sorted(user_id for user_id, _ in done) == [user_id for user_id in range(50) if user_id % 5]
+    # Действия ждут одновременно: все завершились примерно через одну задержку, а не через 40
+    assert all(DELAY * 0.95 <= at - started < DELAY * 1.5 for _, at in done)
+    assert actions._tasks == {}
+
+def test_new_action_replaces_pending_one_and_shutdown_cancels_all():
+    actions = psymatch2.DelayedActions()
+    done = []
+
+    def action(name):
+        async def run():
+            done.append(name)
+        return run
+
+    async def scenario():
+        actions.schedule(1, DELAY, action('first'))
+        actions.schedule(1, DELAY, action('second'))
+        actions.schedule(2, DELAY * 10, action('late'))
+        await asyncio.sleep(DELAY * 1.5)
+        await actions.shutdown()
+
+    asyncio.run(scenario())
+    assert done == ['second']
+
+def test_next_update_cancels_the_delayed_profile(database, monkeypatch):
+    add_client(database, 1)
+    for user_id in (101, 102, 103, 104):
+        add_psychologist(database, user_id)
+    adb = psymatch2.AsyncDatabase(database)
+    monkeypatch.setattr(psymatch2, 'db', adb)
+    monkeypatch.setattr(psymatch2, 'notifications', psymatch2.NotificationDispatcher())
+    monkeypatch.setattr(psymatch2, 'NEXT_PROFILE_DELAY', DELAY)
+
+    shown = []
+    show_next_profile = psymatch2.show_next_profile
+
+    async def counting_show_next_profile(update, context, user_id):
+        shown.append(update.update_id)
+        await show_next_profile(update, context, user_id)
+
+    monkeypatch.setattr(psymatch2, 'show_next_profile', counting_show_next_profile)
+
+    request = FakeRequest()
+    app = Application.builder().token('123:TEST').request(request).updater(None).build()
+    app.add_handler(TypeHandler(Update, psymatch2.cancel_delayed_actions), group=-1)
+    app.add_handler(CallbackQueryHandler(psymatch2.button_handler))
+    updates = UpdateFactory(app.bot)
+
+    def like_button():
+        return next(data for data in request.keyboards[1] if data.startswith('like_'))
+
+    async def scenario():
+        await app.initialize()
+        psymatch2.notifications.start(app.bot)
+        try:
+            await app.process_update(updates.callback(1, 'view_profiles'))
+            assert len(shown) == 1
+
+            # Лайк не ждет задержку в обработчике: следующая анкета приходит позже сама
+            await app.process_update(updates.callback(1, like_button()))
+            assert len(shown) == 1
+            await asyncio.sleep(DELAY * 1.5)
+            assert len(shown) == 2
+
+            # Пользователь нажал "Пропустить" раньше, чем пришла анкета после лайка:
+            # показывается одна следующая анкета, а не две подряд
+            await app.process_update(updates.callback(1, like_button()))
+            skip = next(data for data in request.keyboards[1] if data.startswith('skip_'))
+            await app.process_update(updates.callback(1, skip))
+            await asyncio.sleep(DELAY * 1.5)
+            assert len(shown) == 3
+
+            # Любое сообщение тоже отменяет отложенный показ
+            await app.process_update(updates.callback(1, like_button()))
+            await app.process_update(updates.message(1, 'привет'))
+            await asyncio.sleep(DELAY * 1.5)
+            assert len(shown) == 3
+        finally:
+            await psymatch2.next_profile_actions.shutdown()
+            await psymatch2.notifications.stop()
+            await app.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
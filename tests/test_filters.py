@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import psymatch2
+from conftest import add_client, add_psychologist
+
+def add_filter_psychologists(database):
+    add_psychologist(database, 101, gender='female', age=35, price='2000-3000 руб./сессия')
+    add_psychologist(database, 102, gender='male', age=35)
+    add_psychologist(database, 103, gender='female', age=50)
+    add_psychologist(database, 104, gender='female', age=40, price='5000 руб')
+    # Назван только потолок цены: он и сравнивается с бюджетом
+    add_psychologist(database, 105, gender='female', age=32, price='до 3000')
+    add_psychologist(database, 106, gender='female', age=38, price='договорная')
+    add_psychologist(database, 107, gender='female', age=36, price='2500', approach='КПТ')
+
+async def served_ids(adb, user_id):
+    """Все анкеты, которые клиент увидит до конца очереди"""
+    served = []
+    while (candidate := await adb.next_candidate(user_id, 'client')) is not None:
+        served.append(candidate['user_id'])
+        await adb.add_viewed_profile(user_id, candidate['user_id'])
+    return served
+
+@pytest.mark.parametrize('ranked', [False, True])
+def test_saved_filters_limit_served_profiles(database, ranked):
+    add_filter_psychologists(database)
+    add_client(database, 1)
+    adb = psymatch2.AsyncDatabase(database, prefetch_size=2)
+
+    async def scenario():
+        if ranked:
+            await adb.load_ranking_index()
+        await adb.save_preferences(1, gender='female', age_min=30, age_max=45, price_max=3000)
+        assert await adb.get_preferences(1) == {
+            'gender': 'female', 'age_min': 30, 'age_max': 45, 'price_max': 3000, 'approach': None
+        }
+        assert sorted(await served_ids(adb, 1)) == [101, 105, 107]
+
+        # Новые фильтры сбрасывают очередь, собранную по старым
+        await adb.reset_viewed_profiles(1)
+        await adb.save_preferences(1, price_max=3000, approach='гештальт')
+        assert sorted(await served_ids(adb, 1)) == [101, 102, 103, 105]
+
+        # Без фильтров снова видны все анкеты
+        await adb.reset_viewed_profiles(1)
+        await adb.save_preferences(1)
+        assert await adb.get_preferences(1) is None
+        assert sorted(await served_ids(adb, 1)) == list(range(101, 108))
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
+
+def test_filters_are_ignored_for_psychologists(database):
+    add_filter_psychologists(database)
+    for user_id in (1, 2):
+        add_client(database, user_id)
+    preferences = {'gender': 'female', 'age_min': 60}
+    assert [row['user_id'] for row in database.get_next_candidates(101, 'psychologist', 5, preferences=preferences)] == [1, 2]
@@ -0,0 +1,69 @@
+import argparse
+
+import pytest
+
+import psymatch_io
+from psymatch_db import Database
+from conftest import add_client, add_psychologist
+
+def table_rows(database, table):
+    with database.get_connection() as conn:
+        return [tuple(row) for row in conn.execute(f'SELECT * FROM {table} ORDER BY rowid')]
+
+def schema_objects(database):
+    with database.get_connection() as conn:
+        return sorted((row['type'], row['name']) for row in conn.execute(
+            "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+        ))
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_export_import_round_trip(database, tmp_path, fmt, monkeypatch):
+    for user_id in range(101, 106):
+        add_psychologist(database, user_id, price=None if user_id == 105 else '2000 руб.')
+    for user_id in range(1, 6):
+        add_client(database, user_id)
+    for client_id in range(1, 6):
+        for psychologist_id in range(101, 101 + client_id):
+            database.create_like(client_id, psychologist_id)
+            database.add_viewed_profile(client_id, psychologist_id)
+    for user_id in (101, 102):
+        database.create_like(user_id, 3)
+    database.flush()
+
+    dump = str(tmp_path / 'dump')
+    args = argparse.Namespace(dir=dump, format=fmt, tables=psymatch_io.TABLES, chunk=4)
+    psymatch_io.export_data(database, args)
+
+    copy = Database(str(tmp_path / 'copy.db'))
+    try:
+        # Во время загрузки у таблиц нет ни индексов, ни построчных триггеров счетчиков и поиска
+        loaded_with = []
+        import_table = psymatch_io.import_table
+        def tracing_import_table(conn, table, path, args):
+            loaded_with.append(conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                (table,)
+            ).fetchone()[0])
+            return import_table(conn, table, path, args)
+        monkeypatch.setattr(psymatch_io, 'import_table', tracing_import_table)
+
+        args = argparse.Namespace(dir=dump, format=fmt, tables=psymatch_io.TABLES, chunk=4,
+                                  commit_rows=6, replace=False, defer_indexes=True)
+        psymatch_io.import_data(copy, args)
+
+        assert loaded_with == [0] * len(psymatch_io.TABLES)
+        for table in psymatch_io.TABLES:
+            assert table_rows(copy, table) == table_rows(database, table), table
+        # Мэтчи не выгружаются, а восстанавливаются по взаимным лайкам
+        assert sorted(row[1:3] for row in table_rows(copy, 'matches')) == [(3, 101), (3, 102)]
+        assert schema_objects(copy) == schema_objects(database)
+        # Поисковый индекс построен заново по загруженным анкетам
+        assert copy.search_psychologist_ids(['трево']) == database.search_psychologist_ids(['трево'])
+        assert len(copy.search_psychologist_ids(['трево'])) == 5
+        # Счетчики пересчитаны один раз после загрузки и дальше снова ведутся триггерами
+        assert copy.get_statistics() == database.get_statistics()
+        assert copy.get_statistics()['mutual_matches'] == 2
+        copy.create_like(103, 3)
+        assert copy.get_statistics()['mutual_matches'] == 3
+    finally:
+        copy.close()
@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+
+import psymatch2
+from conftest import add_client, add_psychologist
+
+PAIRS = 20
+REPEATS = 3
+
+def test_concurrent_opposing_likes_make_one_match(tmp_path):
+    database = psymatch2.Database(str(tmp_path / 'likes.db'), pool_size=16)
+    pairs = [(100 + i, 200 + i) for i in range(PAIRS)]
+    for client_id, psychologist_id in pairs:
+        add_client(database, client_id)
+        add_psychologist(database, psychologist_id)
+
+    # Каждый лайк в обе стороны ставится несколько раз из разных потоков одновременно
+    calls = [(a, b) for client_id, psychologist_id in pairs for _ in range(REPEATS)
+             for a, b in ((client_id, psychologist_id), (psychologist_id, client_id))]
+    results = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(len(calls))
+
+    def like(from_user_id, to_user_id):
+        start.wait()
+        try:
+            result = database.create_like(from_user_id, to_user_id)
+        except sqlite3.Error as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            results.append(((from_user_id, to_user_id), result))
+
+    threads = [threading.Thread(target=like, args=call) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    try:
+        assert errors == []
+        for client_id, psychologist_id in pairs:
+            pair_results = [result for call, result in results if set(call) == {client_id, psychologist_id}]
+            # Ровно два лайка создано, и ровно один из них сообщил о взаимности
+            assert pair_results.count((True, False)) == 1
+            assert pair_results.count((True, True)) == 1
+            assert pair_results.count((False, False)) == 2 * REPEATS - 2
+            assert database.check_mutual_like(client_id, psychologist_id)
+            assert database.count_matches(client_id) == 1
+
+        with database.get_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM likes').fetchone()[0] == 2 * PAIRS
+            assert conn.execute('SELECT COUNT(*) FROM matches').fetchone()[0] == PAIRS
+            assert conn.execute('SELECT COUNT(*) FROM likes WHERE is_mutual = 1').fetchone()[0] == 2 * PAIRS
+    finally:
+        database.close()
@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+import psymatch2
+from conftest import add_client
+
+async def http_get(port: int, path: str) -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    response = await reader.read()
+    writer.close()
+    head, body = response.decode().split('\r\n\r\n', 1)
+    return head.split('\r\n')[0], body
+
+def test_histograms_are_served_on_metrics_endpoint(database, monkeypatch):
+    metrics = psymatch2.Metrics(enabled=True)
+    monkeypatch.setattr(psymatch2, 'metrics', metrics)
+    add_client(database, 1)
+    adb = psymatch2.AsyncDatabase(database)
+
+    async def press(update, context):
+        await asyncio.sleep(0.003)
+
+    async def scenario():
+        await adb.get_user(1)
+        await adb.get_user(1)
+        handler = psymatch2.instrument_button(press)
+        for data in ('like_42', 'matches_next_7', 'unexpected'):
+            await handler(SimpleNamespace(callback_query=SimpleNamespace(data=data)), None)
+        metrics.gauge('psymatch_cache_hits', 'Попадания в кэш', lambda: adb.cache.hits)
+
+        await metrics.start_server('127.0.0.1', 0)
+        port = metrics._server.sockets[0].getsockname()[1]
+        try:
+            return await http_get(port, '/metrics'), await http_get(port, '/other')
+        finally:
+            await metrics.stop_server()
+
+    try:
+        (status, body), (missing_status, _) = asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
+
+    assert status == 'HTTP/1.1 200 OK'
+    assert missing_status == 'HTTP/1.1 404 Not Found'
+    lines = body.splitlines()
+    # Второй get_user взят из кэша и до пула потоков не дошел
+    assert 'psymatch_db_seconds_count{method="get_user"} 1' in lines
+    assert 'psymatch_cache_hits 1' in lines
+    # Идентификаторы в метках отброшены, неизвестные кнопки собраны в other
+    for label in ('like', 'matches_next', 'other'):
+        assert f'psymatch_button_seconds_count{{callback="{label}"}} 1' in lines
+        assert f'psymatch_button_seconds_bucket{{callback="{label}",le="0.001"}} 0' in lines
+        assert f'psymatch_button_seconds_bucket{{callback="{label}",le="+Inf"}} 1' in lines
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from telegram.error import RetryAfter
+
+import psymatch2
+
+GLOBAL_RATE = 40
+CHAT_RATE = 10
+CHAT_BURST = 2
+RETRY_AFTER = 0.3
+
+class StubBot:
+    """Запоминает вызовы send_message; первый вызов отклоняется флуд-контролем"""
+
+    def __init__(self):
+        self.calls = []
+        self.delivered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        self.calls.append((now, chat_id, text))
+        if len(self.calls) == 1:
+            raise RetryAfter(RETRY_AFTER)
+        self.delivered.append((now, chat_id, text))
+
+def assert_rate(times, rate, capacity):
+    """В любом окне отправок их не больше, чем выдает корзина: capacity + rate * длина окна"""
+    for i in range(len(times)):
+        for j in range(i, len(times)):
+            assert j - i + 1 <= capacity + rate * (times[j] - times[i]) + 1e-6, (i, j)
+
+def test_dispatcher_retries_after_flood_limit_and_keeps_rates():
+    bot = StubBot()
+    dispatcher = psymatch2.NotificationDispatcher(workers=8, queue_size=100, global_rate=GLOBAL_RATE,
+                                                  chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_retries=3)
+    messages = [(chat_id, f'{chat_id}:{n}') for n in range(8) for chat_id in (1, 2, 3, 4)]
+
+    async def scenario():
+        dispatcher.start(bot)
+        for chat_id, text in messages:
+            assert dispatcher.enqueue(chat_id, text)
+        await dispatcher.stop(timeout=10)
+
+    asyncio.run(scenario())
+
+    # Ничего не потеряно и не отправлено дважды
+    assert sorted(text for _, _, text in bot.delivered) == sorted(text for _, text in messages)
+
+    # Отклоненное сообщение повторено, и до конца паузы не отправлялось ничего
+    failed_at, failed_chat, failed_text = bot.calls[0]
+    retried_at = next(at for at, _, text in bot.delivered if text == failed_text)
+    assert retried_at >= failed_at + RETRY_AFTER
+    assert all(at >= failed_at + RETRY_AFTER for at, _, _ in bot.calls[1:])
+
+    assert_rate([at for at, _, _ in bot.calls], GLOBAL_RATE, GLOBAL_RATE)
+    by_chat = defaultdict(list)
+    for at, chat_id, _ in bot.calls:
+        by_chat[chat_id].append(at)
+    for times in by_chat.values():
+        assert_rate(times, CHAT_RATE, CHAT_BURST)
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from telegram.ext import Application, CallbackQueryHandler
+
+import psymatch2
+import psymatch_db
+from conftest import add_client, add_psychologist
+from fakes import FakeRequest, UpdateFactory
+
+LIKERS = range(101, 126)
+
+@pytest.fixture
+def inbox(database):
+    """Клиент 1 с 25 входящими лайками; у 15 из них одинаковое время, 10 из них взаимные"""
+    add_client(database, 1)
+    for user_id in LIKERS:
+        add_psychologist(database, user_id)
+        database.create_like(user_id, 1)
+    for user_id in LIKERS[::2][:10]:
+        database.create_like(1, user_id)
+    with database.get_connection() as conn:
+        conn.execute("UPDATE likes SET liked_date = '2024-01-01 00:00:00' WHERE from_user_id BETWEEN 105 AND 119")
+        conn.execute("UPDATE likes SET liked_date = '2023-01-01 00:00:00' WHERE from_user_id > 119")
+        conn.execute("UPDATE matches SET matched_at = '2024-01-01 00:00:00' WHERE max_id BETWEEN 105 AND 113")
+        conn.commit()
+    return database
+
+def expected_order(database, where, table='likes', date='liked_date'):
+    with database.get_connection() as conn:
+        rows = conn.execute(f'SELECT id FROM {table} WHERE {where} ORDER BY {date} DESC, id DESC').fetchall()
+    return [row[0] for row in rows]
+
+def walk(fetch, limit):
+    """Все страницы вперед до конца, затем обратно к первой"""
+    pages = []
+    page, has_more = fetch(limit=limit)
+    pages.append([like['id'] for like in page])
+    while has_more:
+        page, has_more = fetch(limit=limit, after_id=page[-1]['id'])
+        pages.append([like['id'] for like in page])
+
+    back = [pages[-1]]
+    page_ids = pages[-1]
+    while True:
+        page, has_more = fetch(limit=limit, before_id=page_ids[0])
+        if not page:
+            break
+        page_ids = [like['id'] for like in page]
+        back.append(page_ids)
+        if not has_more:
+            break
+    return pages, back[::-1]
+
+@pytest.mark.parametrize('limit', [1, 4, 7, 25, 30])
+def test_inbox_pages_cover_equal_dates_both_ways(inbox, limit):
+    pages, back = walk(lambda **kwargs: inbox.get_likes_page(1, **kwargs), limit)
+    expected = expected_order(inbox, 'to_user_id = 1')
+    # Страницы идут без пропусков и повторов даже внутри группы с одинаковым liked_date
+    assert [like_id for page in pages for like_id in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+    # Листание назад возвращает те же страницы
+    assert back == pages
+
+def test_matches_pages_cover_equal_dates_both_ways(inbox):
+    pages, back = walk(lambda **kwargs: inbox.get_mutual_likes_page(1, **kwargs), 3)
+    assert [match_id for page in pages for match_id in page] == expected_order(
+        inbox, '1 IN (min_id, max_id)', 'matches', 'matched_at')
+    assert len(pages) == 4
+    assert back == pages
+
+def test_first_and_last_pages(inbox):
+    expected = expected_order(inbox, 'to_user_id = 1')
+    first, has_more = inbox.get_likes_page(1, limit=10)
+    assert has_more and [like['id'] for like in first] == expected[:10]
+    # Новее первой страницы ничего нет
+    assert inbox.get_likes_page(1, limit=10, before_id=first[0]['id']) == ([], False)
+
+    last, has_more = inbox.get_likes_page(1, limit=10, after_id=expected[19])
+    assert not has_more and [like['id'] for like in last] == expected[20:]
+    assert inbox.get_likes_page(1, limit=10, after_id=last[-1]['id']) == ([], False)
+
+    # Назад с последней страницы - полная предыдущая страница, за ней есть еще более новые
+    previous, has_more = inbox.get_likes_page(1, limit=10, before_id=last[0]['id'])
+    assert has_more and [like['id'] for like in previous] == expected[10:20]
+
+def test_inbox_buttons_and_message_length(database, monkeypatch):
+    add_client(database, 1)
+    # Самые длинные имена и username, какие допускает Telegram
+    for user_id in range(101, 101 + 3 * psymatch_db.LIKES_PAGE_SIZE):
+        database.create_user(user_id, 'u' * 32, 'Имя', None, 'psychologist')
+        database.save_psychologist_profile(user_id, '👩‍⚕️' * 100, 'female', 35, 'МГУ', 'Опыт', 'Гештальт',
+                                           'тревога', '2000 руб./сессия')
+        database.create_like(user_id, 1)
+        database.create_like(1, user_id)
+    adb = psymatch2.AsyncDatabase(database)
+    monkeypatch.setattr(psymatch2, 'db', adb)
+
+    request = FakeRequest()
+    app = Application.builder().token('1:x').request(request).updater(None).build()
+    app.add_handler(CallbackQueryHandler(psymatch2.button_handler))
+    updates = UpdateFactory(app.bot)
+
+    def navigation():
+        return [data for data in request.keyboards[1] if data.startswith(('inbox_', 'matches_'))]
+
+    async def scenario():
+        await app.initialize()
+        try:
+            for section, view in (('inbox', 'view_inbox'), ('matches', 'view_matches')):
+                await app.process_update(updates.callback(1, view))
+                # Первая страница: только "дальше"
+                assert [data.split('_')[1] for data in navigation()] == ['next']
+                lengths = [len(request.texts[1].encode('utf-16-le')) // 2]
+
+                await app.process_update(updates.callback(1, navigation()[0]))
+                assert [data.split('_')[1] for data in navigation()] == ['prev', 'next']
+                await app.process_update(updates.callback(1, navigation()[1]))
+                # Последняя страница: только "назад"
+                assert [data.split('_')[1] for data in navigation()] == ['prev']
+                assert all(data.startswith(section) for data in navigation())
+                lengths.append(len(request.texts[1].encode('utf-16-le')) // 2)
+
+                assert max(lengths) <= 4096
+        finally:
+            await app.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+
+import psymatch2
+from fakes import FakeRequest, UpdateFactory
+
+NAME, AGE = range(2)
+
+def build_app(adb, replies):
+    persistence = psymatch2.SQLitePersistence(adb, write_delay=3600)
+    app = Application.builder().token('1:x').request(FakeRequest()).updater(None).persistence(persistence).build()
+
+    async def start(update, context):
+        replies.append((update.effective_user.id, 'start'))
+        return NAME
+
+    async def name(update, context):
+        context.user_data['name'] = update.message.text
+        replies.append((update.effective_user.id, 'name'))
+        return AGE
+
+    async def age(update, context):
+        replies.append((update.effective_user.id, 'age'))
+        return ConversationHandler.END
+
+    app.add_handler(TypeHandler(Update, psymatch2.restore_conversations), group=-2)
+    app.add_handler(ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, name)],
+            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, age)],
+        },
+        fallbacks=[],
+        name='registration',
+        persistent=True
+    ))
+    return app, persistence
+
+def test_conversation_survives_restart_and_loads_per_user(database):
+    adb = psymatch2.AsyncDatabase(database)
+    replies = []
+
+    async def scenario():
+        app, persistence = build_app(adb, replies)
+        updates = UpdateFactory(app.bot)
+        await app.initialize()
+        for user_id in (1, 2, 3):
+            await app.process_update(updates.message(user_id, '/start'))
+        await app.process_update(updates.message(1, 'Анна'))
+        await app.update_persistence()
+        await persistence.flush()
+        await app.shutdown()
+
+        # Перезапуск: при старте ничего не загружается, состояние пользователя
+        # подгружается его первым апдейтом
+        app, persistence = build_app(adb, replies)
+        updates = UpdateFactory(app.bot)
+        await app.initialize()
+        conversation = next(handler for handler in app.handlers[0] if isinstance(handler, ConversationHandler))
+        assert dict(conversation._conversations) == {}
+
+        replies.clear()
+        await app.process_update(updates.message(1, '35'))
+        await app.process_update(updates.message(2, 'Борис'))
+        assert replies == [(1, 'age'), (2, 'name')]
+        assert set(conversation._conversations) == {(2, 2)}
+        assert 3 not in persistence._loaded_conversations
+        await app.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
+
+def test_values_outside_json_are_rejected(database):
+    adb = psymatch2.AsyncDatabase(database)
+    persistence = psymatch2.SQLitePersistence(adb, write_delay=3600)
+
+    async def scenario():
+        with pytest.raises(TypeError):
+            await persistence.update_user_data(1, {'registered': datetime(2024, 1, 1)})
+        with pytest.raises(ValueError):
+            await persistence.update_user_data(1, {'score': float('nan')})
+        assert persistence._pending_user_data == {}
+
+        await persistence.update_user_data(1, {'name': 'Анна', 'age': 35, 'tags': ['тревога']})
+        await persistence.flush()
+        user_data = {}
+        await psymatch2.SQLitePersistence(adb).refresh_user_data(1, user_data)
+        assert user_data == {'name': 'Анна', 'age': 35, 'tags': ['тревога']}
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
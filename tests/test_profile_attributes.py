@@ -0,0 +1,89 @@
+import pytest
+
+import psymatch_db
+from conftest import add_client, add_psychologist
+
+@pytest.mark.parametrize('text, expected', [
+    ('2000-3000 руб./сессия', (2000, 3000)),
+    ('3 000 – 5 000 ₽', (3000, 5000)),
+    ('1\u00a0500 руб', (1500, 1500)),
+    ('2000 3000', (2000, 3000)),
+    ('120 минут - 3500 руб', (3500, 3500)),
+    ('1,5 часа 4000', (4000, 4000)),
+    ('3500 руб за 50 мин', (3500, 3500)),
+    ('от 2500', (2500, None)),
+    ('до 3000', (None, 3000)),
+    ('от 2000 до 3000', (2000, 3000)),
+    ('2,5к', (2500, 2500)),
+    ('3-5 тыс', (3000, 5000)),
+    ('договорная', (None, None)),
+    ('50', (None, None)),
+    (None, (None, None)),
+])
+def test_parse_price(text, expected):
+    assert psymatch_db.parse_price(text) == expected
+
+@pytest.mark.parametrize('value, expected', [
+    ('35', 35), ('35 лет', 35), (35, 35), (' 14', 14), ('100', 100),
+    ('7', None), ('150', None), ('много', None), ('', None), (None, None),
+])
+def test_parse_age(value, expected):
+    assert psymatch_db.parse_age(value) == expected
+
+@pytest.mark.parametrize('text, expected', [
+    ('30-45', (30, 45)), ('45 - 30', (30, 45)), ('от 30 до 45', (30, 45)),
+    ('от 30', (30, None)), ('до 45', (None, 45)), ('40', (40, 40)),
+    ('любой', (None, None)), (None, (None, None)),
+])
+def test_parse_age_range(text, expected):
+    assert psymatch_db.parse_age_range(text) == expected
+
+@pytest.mark.parametrize('value, expected', [
+    ('👩 Женский', 'female'), ('жен', 'female'), ('Ж', 'female'), ('female', 'female'),
+    ('👨 Мужской', 'male'), ('Мужчина', 'male'), ('м', 'male'), ('male', 'male'),
+    ('другое', None), ('', None), (None, None),
+])
+def test_parse_gender(value, expected):
+    assert psymatch_db.parse_gender(value) == expected
+
+
+def test_backfill_types_only_legacy_rows_in_chunks(database):
+    for user_id in range(101, 111):
+        add_psychologist(database, user_id)
+    for user_id in range(1, 11):
+        add_client(database, user_id)
+
+    with database.get_connection() as conn:
+        # Строки из выгрузки старой версии: пол и возраст текстом, диапазона цен нет
+        conn.execute('''
+            UPDATE psychologist_profiles SET gender = '👩 Женский', age = '35 лет',
+                   price = '2-3 тыс', price_min = NULL, price_max = NULL
+            WHERE user_id % 2 = 0
+        ''')
+        conn.execute("UPDATE client_profiles SET gender = 'муж', age = '30' WHERE user_id <= 5")
+        conn.commit()
+
+        updates = []
+        conn.set_trace_callback(lambda statement: updates.append(statement)
+                                if statement.lstrip().startswith('UPDATE') else None)
+        conn.execute('BEGIN')
+        psymatch_db.backfill_profile_attributes(conn.cursor(), chunk=2)
+        conn.commit()
+        conn.set_trace_callback(None)
+
+        # Переписаны только строки, где было что приводить
+        assert len(updates) == 5 + 5
+        rows = conn.execute('''
+            SELECT gender, age, typeof(age), price_min, price_max FROM psychologist_profiles
+        ''').fetchall()
+        assert {tuple(row) for row in rows} == {('female', 35, 'integer', 2000, 3000)}
+        rows = conn.execute('SELECT user_id, gender, age FROM client_profiles WHERE user_id <= 5').fetchall()
+        assert {(row['gender'], row['age']) for row in rows} == {('male', 30)}
+
+        # Повторный запуск на приведенной базе ничего не пишет
+        updates.clear()
+        conn.set_trace_callback(lambda statement: updates.append(statement)
+                                if statement.lstrip().startswith('UPDATE') else None)
+        psymatch_db.backfill_profile_attributes(conn.cursor(), chunk=2)
+        conn.set_trace_callback(None)
+        assert updates == []
@@ -0,0 +1,130 @@
+import asyncio
+
+from telegram import MessageEntity
+from telegram.ext import Application, CallbackQueryHandler
+
+import psymatch2
+from conftest import add_client, add_psychologist
+from fakes import FakeRequest, UpdateFactory
+from profile_cards import Card, CardRenderer, CardTemplate, candidate_keyboard, split_caption, telegram_length
+
+def entity_spans(entities):
+    return [(entity.type, entity.offset, entity.length) for entity in entities]
+
+def test_bold_entity_offsets_are_in_utf16_units():
+    text, entities = CardTemplate('😀 {name} **{title}** 👍 **конец**').render({'name': 'Анна', 'title': '*жирный*'})
+    # Значения подставляются как есть, разметка в них не разбирается
+    assert text == '😀 Анна *жирный* 👍 конец'
+    # 😀 и 👍 - по две кодовые единицы UTF-16, поэтому смещения больше, чем в символах
+    assert entity_spans(entities) == [(MessageEntity.BOLD, 8, 8), (MessageEntity.BOLD, 20, 5)]
+
+def test_caption_length_is_counted_in_utf16_units():
+    # По числу символов строка поместилась бы в подпись
+    caption, rest = split_caption(Card('😀' * 6 + '\nx'), limit=10)
+    assert (caption.text, rest.text) == ('😀' * 5, '😀\nx')
+
+    caption, rest = split_caption(Card('😀' * 5 + '\nbbb'), limit=10)
+    assert (caption.text, rest.text) == ('😀' * 5, 'bbb')
+    card = Card('😀' * 5)
+    assert split_caption(card, limit=10) == (card, None)
+
+def test_caption_split_carries_entities_and_keyboard():
+    keyboard = candidate_keyboard(101)
+    # Жирный участок "один\nдва" начинается после эмодзи и пересекает границу подписи
+    card = Card('😀 один\nдва\nтри', (MessageEntity(MessageEntity.BOLD, 3, 8),), keyboard, 'photo101')
+    caption, rest = split_caption(card, limit=7)
+    assert (caption.text, entity_spans(caption.entities)) == ('😀 один', [(MessageEntity.BOLD, 3, 4)])
+    assert (rest.text, entity_spans(rest.entities)) == ('два\nтри', [(MessageEntity.BOLD, 0, 3)])
+    # Фото остается у подписи, кнопки - у последнего сообщения
+    assert (caption.photo_file_id, caption.reply_markup) == ('photo101', None)
+    assert (rest.photo_file_id, rest.reply_markup) == (None, keyboard)
+
+def test_long_caption_is_split_on_line_boundary():
+    lines = [f'🎯 Строка {index}: ' + ' '.join(['текст'] * 20) for index in range(20)]
+    caption, rest = split_caption(Card('\n'.join(lines)))
+    assert telegram_length(caption.text) <= 1024
+    # В подпись входит столько целых строк, сколько помещается
+    count = len(caption.text.split('\n'))
+    assert caption.text == '\n'.join(lines[:count])
+    assert telegram_length('\n'.join(lines[:count + 1])) > 1024
+    assert rest.text == '\n'.join(lines[count:])
+
+def test_card_cache_is_keyed_by_profile_version(database):
+    for user_id in (101, 102, 103):
+        add_psychologist(database, user_id)
+    adb = psymatch2.AsyncDatabase(database, cards=CardRenderer(max_size=2))
+    renderer = adb.cards
+
+    card = renderer.candidate(database.get_psychologist_profile(101), 'psychologist')
+    assert renderer.candidate(database.get_psychologist_profile(101), 'psychologist') is card
+    assert (renderer.hits, renderer.misses) == (1, 1)
+
+    # Сохранение увеличивает версию анкеты: старая карточка больше не показывается,
+    # даже если ее запись в кэше не сбросили
+    add_psychologist(database, 101, about_me='Новый опыт')
+    updated = renderer.candidate(database.get_psychologist_profile(101), 'psychologist')
+    assert 'Новый опыт' in updated.text and 'Новый опыт' not in card.text
+
+    # Сохранение через AsyncDatabase сразу выбрасывает карточки пользователя
+    try:
+        asyncio.run(adb.save_psychologist_profile(101, 'Психолог 101', 'female', 36, 'МГУ', 'Опыт 11 лет',
+                                                  'Гештальт', 'тревога', '2000 руб.'))
+    finally:
+        adb._executor.shutdown(wait=True)
+    assert 101 not in renderer._data
+
+    # Кэш ограничен: лишние карточки вытесняются по LRU
+    for user_id in (101, 102, 103):
+        renderer.candidate(database.get_psychologist_profile(user_id), 'psychologist')
+    assert list(renderer._data) == [102, 103]
+
+def test_profile_cards_use_one_photo_message(database, monkeypatch):
+    add_client(database, 1)
+    add_psychologist(database, 101, photo_file_id='photo101')
+    add_psychologist(database, 102, photo_file_id='photo102')
+    add_psychologist(database, 103, photo_file_id='photo103', about_me='Опыт работы. ' * 100)
+    add_psychologist(database, 104)
+    adb = psymatch2.AsyncDatabase(database)
+    monkeypatch.setattr(psymatch2, 'db', adb)
+
+    request = FakeRequest()
+    app = Application.builder().token('123:TEST').request(request).updater(None).build()
+    app.add_handler(CallbackQueryHandler(psymatch2.button_handler))
+    updates = UpdateFactory(app.bot)
+
+    async def press(data):
+        request.calls.clear()
+        await app.process_update(updates.callback(1, data, photo=1 in request.photo_keyboards))
+
+    def skip():
+        return next(data for data in request.keyboards[1] if data.startswith('skip_'))
+
+    async def scenario():
+        await app.initialize()
+        try:
+            # Фото, анкета в подписи и кнопки - одним сообщением
+            await press('view_profiles')
+            assert request.calls['sendPhoto'] == 1 and request.calls['sendMessage'] == 0
+            assert skip() == 'skip_101' and 1 in request.photo_keyboards
+
+            # Следующее фото заменяет предыдущее в том же сообщении
+            await press(skip())
+            assert request.calls['editMessageMedia'] == 1 and request.calls['sendPhoto'] == 0
+            assert skip() == 'skip_102'
+
+            # Анкета длиннее подписи: остаток текста и кнопки - вторым сообщением
+            await press(skip())
+            assert request.calls['sendPhoto'] == 1 and request.calls['sendMessage'] == 1
+            assert skip() == 'skip_103' and 1 not in request.photo_keyboards
+
+            # Анкета без фото под текстовым сообщением редактирует его текст
+            await press(skip())
+            assert request.calls['editMessageText'] == 1
+            assert skip() == 'skip_104'
+        finally:
+            await app.shutdown()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        adb._executor.shutdown(wait=True)
@@ -0,0 +1,110 @@
+import re
+
+import pytest
+
+import psymatch2
+from conftest import add_client, add_psychologist
+
+class TracingDatabase(psymatch2.Database):
+    """Database, запоминающая каждый выполненный запрос с подставленными параметрами"""
+
+    def __init__(self, *args, **kwargs):
+        self.statements = []
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+@pytest.fixture
+def traced(tmp_path):
+    database = TracingDatabase(str(tmp_path / 'plans.db'), pool_size=1)
+    for user_id in range(101, 111):
+        add_psychologist(database, user_id)
+    for user_id in range(1, 6):
+        add_client(database, user_id)
+    for user_id in range(101, 106):
+        database.create_like(user_id, 1)
+    database.create_like(1, 101)
+    database.create_like(1, 102)
+    database.add_viewed_profile(1, 103)
+    database.flush()
+    yield database
+    database.close()
+
+def query_plans(database, call):
+    """Планы всех SELECT, выполненных внутри call()"""
+    database.statements.clear()
+    call()
+    selects = [s for s in database.statements if s.lstrip().upper().startswith(('SELECT', 'WITH'))]
+    assert selects
+    with database.get_connection() as conn:
+        conn.set_trace_callback(None)
+        try:
+            return [(s, [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {s}')]) for s in selects]
+        finally:
+            conn.set_trace_callback(database.statements.append)
+
+FTS_MATCH = re.compile(r'VIRTUAL TABLE INDEX \d+:=?M')
+
+def assert_indexed(plans):
+    for statement, plan in plans:
+        # Полный проход разрешен только по уже отобранным строкам подзапроса,
+        # по строке без FROM и по полнотекстовому индексу через MATCH
+        derived = {match.group(2) for line in plan
+                   for match in [re.match(r'(MATERIALIZE|CO-ROUTINE) (\S+)', line)] if match}
+        for line in plan:
+            if not line.startswith('SCAN ') or line == 'SCAN CONSTANT ROW':
+                continue
+            name = line.split()[1]
+            assert name in derived or FTS_MATCH.search(line), (line, statement)
+        assert any(re.match(r'SEARCH \S+ USING ((COVERING )?INDEX|INTEGER PRIMARY KEY)', line) or FTS_MATCH.search(line)
+                   for line in plan), (plan, statement)
+
+@pytest.mark.parametrize('role, user_id', [('client', 1), ('psychologist', 101)])
+def test_candidate_queries_use_indexes(traced, role, user_id):
+    assert_indexed(query_plans(traced, lambda: traced.get_next_candidates(user_id, role, 5, [104])))
+    candidate_ids = [1, 2, 3] if role == 'psychologist' else [101, 103, 105, 107]
+    assert_indexed(query_plans(traced, lambda: traced.get_candidates_by_ids(user_id, role, candidate_ids)))
+    assert_indexed(query_plans(traced, lambda: traced.get_ranking_profiles(user_id)))
+
+@pytest.mark.parametrize('preferences, index', [
+    ({'gender': 'female', 'age_min': 30, 'age_max': 45, 'price_max': 3000}, 'idx_psychologist_profiles_gender_age'),
+    ({'age_max': 45, 'price_max': 3000}, 'idx_psychologist_profiles_age'),
+    ({'price_max': 3000}, 'idx_psychologist_profiles_price'),
+    ({'gender': 'female', 'approach': 'гештальт'}, 'idx_psychologist_profiles_gender_age'),
+])
+def test_filtered_candidate_queries_walk_filter_index(traced, preferences, index):
+    plans = query_plans(traced, lambda: traced.get_next_candidates(1, 'client', 5, [104], preferences))
+    assert_indexed(plans)
+    (_, plan), = plans
+    # Анкеты читаются по индексу фильтров в его порядке, без сортировки всех подходящих
+    assert any(f'USING INDEX {index}' in line for line in plan), plan
+    assert not any('TEMP B-TREE' in line for line in plan), plan
+    assert_indexed(query_plans(traced, lambda: traced.get_candidates_by_ids(1, 'client', [101, 103, 105], preferences)))
+
+def test_likes_queries_use_indexes(traced):
+    assert_indexed(query_plans(traced, lambda: traced.get_likes_for_user(1)))
+    assert_indexed(query_plans(traced, lambda: traced.get_user_likes(1)))
+    assert_indexed(query_plans(traced, lambda: traced.get_mutual_likes(1)))
+    assert_indexed(query_plans(traced, lambda: traced.check_mutual_like(1, 101)))
+    assert_indexed(query_plans(traced, lambda: traced.count_matches(1)))
+
+def test_pagination_queries_use_indexes(traced):
+    page, _ = traced.get_likes_page(1, limit=2)
+    assert_indexed(query_plans(traced, lambda: traced.get_likes_page(1, limit=2)))
+    assert_indexed(query_plans(traced, lambda: traced.get_likes_page(1, limit=2, after_id=page[-1]['id'])))
+    assert_indexed(query_plans(traced, lambda: traced.get_likes_page(1, limit=2, before_id=page[-1]['id'])))
+
+    page, _ = traced.get_mutual_likes_page(1, limit=1)
+    assert_indexed(query_plans(traced, lambda: traced.get_mutual_likes_page(1, limit=1)))
+    assert_indexed(query_plans(traced, lambda: traced.get_mutual_likes_page(1, limit=1, after_id=page[-1]['id'])))
+    assert_indexed(query_plans(traced, lambda: traced.get_mutual_likes_page(1, limit=1, before_id=page[-1]['id'])))
+
+def test_search_queries_use_indexes(traced):
+    stems = sorted(psymatch2.tokenize('тревожность КПТ'))
+    user_ids = traced.search_psychologist_ids(stems)
+    assert user_ids
+    assert_indexed(query_plans(traced, lambda: traced.search_psychologist_ids(stems)))
+    assert_indexed(query_plans(traced, lambda: traced.get_search_results(psymatch2.build_search_query(stems), user_ids[:3])))
@@ -0,0 +1,15 @@
+import psymatch2
+from conftest import add_psychologist
+
+def test_search_ranks_rare_stems_above_common_ones(database):
+    # "опыт" есть во всех анкетах, "одиночество" - только в одной
+    for user_id in range(101, 111):
+        add_psychologist(database, user_id, work_requests='тревога' if user_id != 105 else 'одиночество',
+                         about_me='Опыт работы 10 лет')
+
+    ids = database.search_psychologist_ids(sorted(psymatch2.tokenize('опыт одиночество')))
+    assert ids[0] == 105
+    assert sorted(ids) == list(range(101, 111))
+
+    assert database.search_psychologist_ids(sorted(psymatch2.tokenize('одиночество'))) == [105]
+    assert len(database.search_psychologist_ids(sorted(psymatch2.tokenize('тревога')), limit=3)) == 3
@@ -0,0 +1,53 @@
+import psymatch2
+from conftest import add_client, add_psychologist
+
+def counted_statistics(database):
+    """Та же статистика, посчитанная по самим таблицам"""
+    with database.get_connection() as conn:
+        count = lambda query: conn.execute(query).fetchone()[0]
+        return {
+            'psychologists_count': count("SELECT COUNT(*) FROM users WHERE role = 'psychologist'"),
+            'clients_count': count("SELECT COUNT(*) FROM users WHERE role = 'client'"),
+            'mutual_matches': count('SELECT COUNT(*) FROM matches'),
+            'total_likes': count('SELECT COUNT(*) FROM likes')
+        }
+
+def test_counters_follow_likes_restarts_and_deletes(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    database = psymatch2.Database(path)
+    for user_id in (101, 102):
+        add_psychologist(database, user_id)
+    for user_id in (1, 2):
+        add_client(database, user_id)
+    assert database.get_statistics() == {'psychologists_count': 2, 'clients_count': 2,
+                                         'mutual_matches': 0, 'total_likes': 0}
+
+    database.create_like(1, 101)
+    database.create_like(1, 102)
+    assert database.get_statistics()['total_likes'] == 2
+    assert database.get_statistics()['mutual_matches'] == 0
+
+    database.create_like(101, 1)
+    database.create_like(1, 101)  # повторный лайк ничего не меняет
+    assert database.get_statistics() == {'psychologists_count': 2, 'clients_count': 2,
+                                         'mutual_matches': 1, 'total_likes': 3}
+    assert database.get_statistics() == counted_statistics(database)
+
+    # Перезапуск с другой ролью: INSERT OR REPLACE переносит пользователя между счетчиками
+    database.create_user(2, 'client2', 'Клиент 2', None, 'psychologist')
+    assert database.get_statistics()['psychologists_count'] == 3
+    assert database.get_statistics()['clients_count'] == 1
+
+    # После перезапуска бота счетчики не пересчитываются заново и не сбиваются
+    database.close()
+    database = psymatch2.Database(path)
+    try:
+        assert database.get_statistics() == counted_statistics(database)
+
+        # Удаление пользователя снимает и его лайки, и совпадение
+        database.delete_user_data(101)
+        assert database.get_statistics() == {'psychologists_count': 2, 'clients_count': 1,
+                                             'mutual_matches': 0, 'total_likes': 1}
+        assert database.get_statistics() == counted_statistics(database)
+    finally:
+        database.close()
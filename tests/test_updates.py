@@ -0,0 +1,168 @@
+import asyncio
+import json
+import socket
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import psymatch2
+from fakes import FakeRequest, UpdateFactory
+
+def build_app(processor, max_pending):
+    return (Application.builder().token('1:x').request(FakeRequest()).get_updates_request(FakeRequest())
+            .update_queue(psymatch2.PendingUpdateQueue(max_pending)).concurrent_updates(processor).build())
+
+def test_flood_waits_for_free_slots_without_dropping():
+    processor = psymatch2.PerUserUpdateProcessor(4)
+    handled = []
+
+    async def scenario():
+        app = build_app(processor, max_pending=8)
+        release = asyncio.Event()
+
+        async def handler(update, context):
+            handled.append((update.effective_user.id, update.update_id))
+            await release.wait()
+
+        app.add_handler(TypeHandler(Update, handler))
+        await app.initialize()
+        await app.start()
+        try:
+            factory = UpdateFactory(app.bot)
+
+            async def poll():
+                # Как Updater: следующий апдейт кладется только после того, как принят предыдущий
+                for _ in range(500):
+                    await app.update_queue.put(factory.message(1, 'Дальше'))
+
+            feeder = asyncio.create_task(poll())
+            await asyncio.sleep(0.1)
+
+            # Принято не больше 8 апдейтов, остальные ждут свободного места, а не копят задачи
+            assert app.update_queue.pending == 8
+            assert processor.pending == 8
+            assert not feeder.done()
+            assert len(asyncio.all_tasks()) < 30
+            assert len(handled) == 1
+
+            release.set()
+            await asyncio.wait_for(feeder, 5)
+            await asyncio.wait_for(app.update_queue.join(), 5)
+            assert app.update_queue.pending == 0
+            assert processor.pending == 0
+        finally:
+            release.set()
+            await app.stop()
+            await app.shutdown()
+
+    asyncio.run(scenario())
+    # Ни один апдейт не потерян, и все обработаны в порядке поступления
+    assert [update_id for _, update_id in handled] == sorted(update_id for _, update_id in handled)
+    assert len(handled) == 500
+
+def test_updates_of_one_user_are_ordered_and_users_run_in_parallel():
+    processor = psymatch2.PerUserUpdateProcessor(8)
+    handled = {user_id: [] for user_id in range(1, 6)}
+    running = {user_id: 0 for user_id in handled}
+    max_running = {'total': 0, 'user': 0}
+
+    async def scenario():
+        app = build_app(processor, max_pending=64)
+
+        async def handler(update, context):
+            user_id = update.effective_user.id
+            running[user_id] += 1
+            max_running['user'] = max(max_running['user'], running[user_id])
+            max_running['total'] = max(max_running['total'], sum(running.values()))
+            # Первые апдейты пользователя обрабатываются дольше последующих
+            await asyncio.sleep(0.02 if len(handled[user_id]) < 2 else 0.001)
+            handled[user_id].append(update.update_id)
+            running[user_id] -= 1
+
+        app.add_handler(TypeHandler(Update, handler))
+        await app.initialize()
+        await app.start()
+        try:
+            factory = UpdateFactory(app.bot)
+            sent = {user_id: [] for user_id in handled}
+            for _ in range(10):
+                for user_id in handled:
+                    update = factory.message(user_id, 'Дальше')
+                    sent[user_id].append(update.update_id)
+                    await app.update_queue.put(update)
+            await asyncio.wait_for(app.update_queue.join(), 5)
+        finally:
+            await app.stop()
+            await app.shutdown()
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert handled == sent
+    assert max_running['user'] == 1
+    assert max_running['total'] > 1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_webhook_checks_secret_and_holds_requests_while_updates_pending():
+    handled = []
+
+    async def scenario():
+        app = build_app(psymatch2.PerUserUpdateProcessor(8), max_pending=3)
+        queue = app.update_queue
+        release = asyncio.Event()
+
+        async def handler(update, context):
+            handled.append(update.effective_user.id)
+            await release.wait()
+
+        app.add_handler(TypeHandler(Update, handler))
+        port = free_port()
+        await app.initialize()
+        await app.start()
+        await app.updater.start_webhook(listen='127.0.0.1', port=port, url_path='telegram',
+                                        webhook_url='https://bot.example.com/telegram', secret_token='s3cret')
+        factory = UpdateFactory(app.bot)
+        url = f'http://127.0.0.1:{port}/telegram'
+
+        def post(client, user_id, secret='s3cret'):
+            headers = {'Content-Type': 'application/json'}
+            if secret is not None:
+                headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+            body = json.dumps(factory.message(user_id, 'Дальше').to_dict())
+            return client.post(url, content=body, headers=headers)
+
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                # Запросы без секрета или с чужим секретом отклоняются и не доходят до обработчиков
+                assert (await post(client, 1, secret=None)).status_code == 403
+                assert (await post(client, 1, secret='wrong')).status_code == 403
+                assert queue.pending == 0
+
+                for user_id in (1, 2, 3):
+                    assert (await post(client, user_id)).status_code == 200
+                await asyncio.sleep(0.1)
+                assert sorted(handled) == [1, 2, 3]
+
+                # Три апдейта еще обрабатываются - четвертый запрос ждет свободного места
+                blocked = asyncio.create_task(post(client, 4))
+                await asyncio.sleep(0.3)
+                assert not blocked.done()
+                assert queue.pending == 3
+
+                release.set()
+                assert (await asyncio.wait_for(blocked, 5)).status_code == 200
+                await asyncio.wait_for(queue.join(), 5)
+                assert queue.pending == 0
+        finally:
+            release.set()
+            await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+
+    asyncio.run(scenario())
+    assert sorted(handled) == [1, 2, 3, 4]
@@ -0,0 +1,64 @@
+import time
+
+import psymatch2
+from conftest import add_client, add_psychologist
+
+def stored_views(database, user_id):
+    with database.get_connection() as conn:
+        rows = conn.execute('SELECT viewed_user_id FROM profiles_viewed WHERE user_id = ?', (user_id,)).fetchall()
+    return sorted(row[0] for row in rows)
+
+def test_buffered_writes_are_visible_and_flushed(tmp_path):
+    path = str(tmp_path / 'write_behind.db')
+    # Интервал больше времени теста: сброс происходит только явно
+    database = psymatch2.Database(path, write_behind_interval_ms=60000)
+    add_client(database, 1)
+    for user_id in (101, 102, 103):
+        add_psychologist(database, user_id)
+
+    database.add_viewed_profile(1, 101)
+    database.add_viewed_profile(1, 102)
+    database.update_last_active(1)
+
+    # До сброса строк в базе нет, но чтение уже их учитывает
+    assert stored_views(database, 1) == []
+    assert sorted(database.get_viewed_profiles(1)) == [101, 102]
+    assert [row['user_id'] for row in database.get_next_candidates(1, 'client', 10)] == [103]
+    assert database.get_user(1)['last_active'] == database._pending_active[1]
+
+    database.flush()
+    assert stored_views(database, 1) == [101, 102]
+    assert database._pending_count() == 0
+
+    # Удаление пользователя выбрасывает и его несброшенные просмотры
+    database.add_viewed_profile(1, 103)
+    database.delete_user_data(1)
+    database.flush()
+    assert stored_views(database, 1) == []
+
+    # close() сбрасывает буфер перед закрытием
+    add_client(database, 2)
+    database.add_viewed_profile(2, 101)
+    database.close()
+
+    database = psymatch2.Database(path)
+    try:
+        assert stored_views(database, 2) == [101]
+    finally:
+        database.close()
+
+def test_buffer_flushes_when_full(tmp_path):
+    database = psymatch2.Database(str(tmp_path / 'write_behind.db'), write_behind_interval_ms=60000,
+                                  write_behind_max_rows=3)
+    try:
+        add_client(database, 1)
+        for user_id in (101, 102, 103):
+            add_psychologist(database, user_id)
+            database.add_viewed_profile(1, user_id)
+        # Фоновый поток будят по заполнению буфера, не дожидаясь интервала
+        deadline = time.monotonic() + 2
+        while stored_views(database, 1) != [101, 102, 103] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert stored_views(database, 1) == [101, 102, 103]
+    finally:
+        database.close()